@@ -11,6 +11,11 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'backend'))
 
 from routes.trips_routes import trips_bp
 from routes.insights_routes import insights_bp
+from utils.compression import init_compression
+from utils.db_connection import get_pool_stats
+from utils.json_provider import FastJSONProvider
+from utils.metrics import METRICS_ENABLED, init_metrics
+from utils.response_cache import response_cache
 
 def create_app():
     """Create and configure the Flask application"""
@@ -20,12 +25,21 @@ def create_app():
                 template_folder=frontend_dir,
                 static_folder=os.path.join(frontend_dir, 'static'))
     
+    # jsonify() through orjson when it is installed
+    app.json = FastJSONProvider(app)
+
     # Enable CORS for all routes
     CORS(app)
     
     # Register blueprints
     app.register_blueprint(trips_bp, url_prefix='/api/trips')
     app.register_blueprint(insights_bp, url_prefix='/api/insights')
+
+    # Request/query metrics and the slow-query log (METRICS_ENABLED=0 turns them off)
+    init_metrics(app, gauges={"db_pool": get_pool_stats, "response_cache": response_cache.stats})
+
+    # gzip/brotli; registered after metrics so it runs first and metrics see the compressed size
+    init_compression(app)
     
     # Serve the frontend
     from flask import render_template
@@ -41,10 +55,23 @@ def create_app():
             "message": "Welcome to NYC Mobility API",
             "endpoints": {
                 "trips": "/api/trips",
-                "insights": "/api/insights"
+                "insights": "/api/insights",
+                "db_pool": "/api/db-pool",
+                "cache": "/api/cache",
+                "metrics": "/metrics" if METRICS_ENABLED else None
             }
         }
     
+    # Connection pool usage (in-use, waits, wait time)
+    @app.route('/api/db-pool')
+    def db_pool_stats():
+        return get_pool_stats()
+    
+    # Response cache usage (hits, misses, evictions)
+    @app.route('/api/cache')
+    def cache_stats():
+        return response_cache.stats()
+    
     return app
 
 if __name__ == '__main__':
@@ -1,11 +1,20 @@
 -- Drop existing tables if they exist
+DROP TABLE IF EXISTS trip_summary;
+DROP TABLE IF EXISTS trip_rollup;
+DROP TABLE IF EXISTS trip_sample;
+DROP TABLE IF EXISTS trip_sample_state;
 DROP TABLE IF EXISTS trips;
 
--- Create trips table
+-- Create trips table, partitioned by pickup month so time ranges only read
+-- the months they cover (insert_data.py adds partitions for newer months).
+-- With TRIP_KEYS=compact, insert_data.py adds trip_key BIGINT NOT NULL and
+-- keys the table on (trip_key, pickup_datetime) instead (utils/trip_keys.py)
+-- With TRIPS_SCHEMA=compact it uses narrower column types and generated
+-- pickup_hour/pickup_date/pickup_weekday columns (utils/trips_schema.py)
 CREATE TABLE IF NOT EXISTS trips (
-    id VARCHAR(255) PRIMARY KEY,
+    id VARCHAR(255) NOT NULL,
     vendor_id VARCHAR(50),
-    pickup_datetime DATETIME,
+    pickup_datetime DATETIME NOT NULL,
     dropoff_datetime DATETIME,
     passenger_count INT,
     pickup_longitude DOUBLE,
@@ -18,12 +27,97 @@ CREATE TABLE IF NOT EXISTS trips (
     trip_duration_min DOUBLE,
     speed_kmh DOUBLE,
     fare_per_km DOUBLE,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    pickup_cell INT,
+    dropoff_cell INT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Partitioning needs pickup_datetime in every unique key, so id alone is
+    -- not enforced unique (the loaders keep one row per id) and a lookup by
+    -- id probes every partition
+    PRIMARY KEY (id, pickup_datetime)
+)
+PARTITION BY RANGE COLUMNS(pickup_datetime) (
+    PARTITION p_start VALUES LESS THAN ('2016-01-01'),
+    PARTITION p201601 VALUES LESS THAN ('2016-02-01'),
+    PARTITION p201602 VALUES LESS THAN ('2016-03-01'),
+    PARTITION p201603 VALUES LESS THAN ('2016-04-01'),
+    PARTITION p201604 VALUES LESS THAN ('2016-05-01'),
+    PARTITION p201605 VALUES LESS THAN ('2016-06-01'),
+    PARTITION p201606 VALUES LESS THAN ('2016-07-01'),
+    PARTITION p201607 VALUES LESS THAN ('2016-08-01'),
+    PARTITION p201608 VALUES LESS THAN ('2016-09-01'),
+    PARTITION p201609 VALUES LESS THAN ('2016-10-01'),
+    PARTITION p201610 VALUES LESS THAN ('2016-11-01'),
+    PARTITION p201611 VALUES LESS THAN ('2016-12-01'),
+    PARTITION p201612 VALUES LESS THAN ('2017-01-01'),
+    PARTITION p_future VALUES LESS THAN (MAXVALUE)
 );
 
 
 -- Create indexes for improved query performance
+-- Time ranges, and keyset pages ordered by (pickup_datetime, id)
 CREATE INDEX idx_pickup_datetime ON trips (pickup_datetime);
+-- Covers COUNT(*) for any mix of the time, speed and passenger filters
+CREATE INDEX idx_pickup_speed_passengers ON trips (pickup_datetime, speed_kmh, passenger_count);
+-- passenger_count = x with a time range, already in pickup_datetime order
+CREATE INDEX idx_passenger_pickup ON trips (passenger_count, pickup_datetime);
 CREATE INDEX idx_dropoff_datetime ON trips (dropoff_datetime);
-CREATE INDEX idx_passenger_count ON trips (passenger_count);
 CREATE INDEX idx_speed_kmh ON trips (speed_kmh);
+-- Grid cell ids (see utils/geo_grid.py) for /api/trips/nearby. The
+-- coordinates are part of the index so candidate lookups are index-only.
+CREATE INDEX idx_pickup_cell ON trips (pickup_cell, pickup_latitude, pickup_longitude);
+CREATE INDEX idx_dropoff_cell ON trips (dropoff_cell, dropoff_latitude, dropoff_longitude);
+
+-- Precomputed totals for /api/insights/stats, one row per passenger count
+-- (NULL passenger counts are stored as -1). Maintained by insert_data.py.
+CREATE TABLE IF NOT EXISTS trip_summary (
+    passenger_count INT PRIMARY KEY,
+    trip_count BIGINT NOT NULL DEFAULT 0,
+    duration_sum DOUBLE NOT NULL DEFAULT 0,
+    duration_count BIGINT NOT NULL DEFAULT 0,
+    speed_sum DOUBLE NOT NULL DEFAULT 0,
+    speed_count BIGINT NOT NULL DEFAULT 0,
+    distance_sum DOUBLE NOT NULL DEFAULT 0,
+    distance_count BIGINT NOT NULL DEFAULT 0
+);
+
+-- Trip cube for /api/insights/rollup, /hourly-pattern and /passenger-distribution:
+-- one row per pickup date, hour, passenger count and vendor (NULL passenger
+-- counts are stored as -1, NULL vendors as ''). Maintained by insert_data.py.
+CREATE TABLE IF NOT EXISTS trip_rollup (
+    pickup_date DATE NOT NULL,
+    pickup_hour TINYINT NOT NULL,
+    day_of_week TINYINT NOT NULL,
+    passenger_count INT NOT NULL,
+    vendor_id VARCHAR(50) NOT NULL,
+    trip_count BIGINT NOT NULL DEFAULT 0,
+    duration_sum DOUBLE NOT NULL DEFAULT 0,
+    duration_count BIGINT NOT NULL DEFAULT 0,
+    speed_sum DOUBLE NOT NULL DEFAULT 0,
+    speed_count BIGINT NOT NULL DEFAULT 0,
+    distance_sum DOUBLE NOT NULL DEFAULT 0,
+    distance_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (pickup_date, pickup_hour, passenger_count, vendor_id)
+);
+
+-- Reservoir samples of trips for approx=true (utils/trip_sample.py): the
+-- uniform sample is stratum -1; TRIP_SAMPLE_STRATA=hour adds strata 0-23,
+-- one per pickup hour. trip_sample_state holds each reservoir's capacity and
+-- the trips offered to it. Maintained by insert_data.py.
+CREATE TABLE IF NOT EXISTS trip_sample (
+    stratum TINYINT NOT NULL,
+    slot INT NOT NULL,
+    id VARCHAR(255) NOT NULL,
+    vendor_id VARCHAR(50),
+    pickup_datetime DATETIME NOT NULL,
+    passenger_count INT,
+    trip_duration_min DOUBLE,
+    trip_distance_km DOUBLE,
+    speed_kmh DOUBLE,
+    PRIMARY KEY (stratum, slot)
+);
+
+CREATE TABLE IF NOT EXISTS trip_sample_state (
+    stratum TINYINT PRIMARY KEY,
+    capacity INT NOT NULL,
+    seen BIGINT NOT NULL DEFAULT 0
+);
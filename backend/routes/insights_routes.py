@@ -1,146 +1,475 @@
 """
 Routes for insights and analytics API endpoints
 """
+import asyncio
 import os
 import sys
+import numpy as np
+import pandas as pd
 from flask import Blueprint, jsonify, request
-import mysql.connector
+from mysql.connector import Error
 
 # Add the backend directory to the path for imports
 backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
-from config.db_config import get_db_config
+from utils.async_db import run_in_thread, with_cursor
+from utils.column_store import get_column_store
+from utils.custom_algorithm import estimate_trip_fares, identify_peak_hours
+from utils.db_connection import get_db_connection
+from utils.helpers import haversine_distances, parse_flag
+from utils.response_cache import cached_response
+from utils.streaming_stats import HourlyHistogram, QuantileSketch, RunningStats
+from utils.trip_rollup import (
+    InvalidRollupQuery, build_rollup_query, format_rollup_row, parse_dimensions, parse_filters
+)
+from utils.trip_sample import read_sample_state, sample_group_counts, sample_info, sample_stats
+from utils.trip_summary import SINGLE_SCAN_QUERY, combine_summary
+from utils.trips_schema import PICKUP_HOUR
 
 # Create a Blueprint for insights routes
 insights_bp = Blueprint('insights', __name__)
 
-def get_db_connection():
-    """Helper function to get a database connection"""
+# Speeds pulled from the server per fetchmany() call by /speed-distribution
+STATS_FETCH_SIZE = 50000
+SPEED_PERCENTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+# Trips per /fare-estimate request
+FARE_ESTIMATE_MAX_TRIPS = int(os.environ.get("FARE_ESTIMATE_MAX_TRIPS", 100000))
+COORDINATE_COLUMNS = ("pickup_latitude", "pickup_longitude", "dropoff_latitude", "dropoff_longitude")
+
+def read_rollup(cursor, group_by, filters=None):
+    """Grouped rows from trip_rollup, or [] when the cube isn't built yet"""
+    query, params = build_rollup_query(group_by, filters or {})
     try:
-        config = get_db_config()
-        conn = mysql.connector.connect(**config)
-        return conn
-    except mysql.connector.Error as e:
-        print(f"Error connecting to MySQL: {e}")
-        return None
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    except Error:
+        # Rollup table not created yet
+        return []
+    return [format_rollup_row(row, group_by) for row in rows if row['trip_count']]
 
-@insights_bp.route('/stats', methods=['GET'])
-def get_trip_stats():
-    """Get statistics about the trips data"""
+def trip_stats(cursor, store=None, approx=False):
+    """
+    Totals and averages over all trips (from `store` when given, else MySQL).
+    With `approx`, a missing trip_summary is estimated from trip_sample
+    instead of scanning trips.
+    """
+    if store is not None:
+        return combine_summary(store.summary_groups())
+
+    # Read the precomputed summary (one row per passenger count)
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+        cursor.execute("SELECT * FROM trip_summary")
+        groups = cursor.fetchall()
+    except Error:
+        # Summary table not created yet
+        groups = []
 
-        cursor = conn.cursor(dictionary=True)
+    if not groups and approx:
+        stats = sample_stats(cursor)
+        if stats is not None:
+            return stats
+
+    # Fall back to computing everything from trips in a single scan
+    if not groups:
+        cursor.execute(SINGLE_SCAN_QUERY)
+        groups = cursor.fetchall()
 
-        # Get various statistics
-        stats = {}
+    return combine_summary(groups)
 
-        # Total number of trips
-        cursor.execute("SELECT COUNT(*) as count FROM trips")
-        stats["total_trips"] = cursor.fetchone()['count']
+def hourly_pattern(cursor, store=None, approx=False):
+    """
+    Trip counts by hour of day, formatted for Chart.js, with the peak hours.
+    With `approx`, a missing rollup cube is estimated from trip_sample
+    instead of grouping trips.
+    """
+    states = None
+    if store is not None:
+        hours, counts = store.hourly_counts()
+    else:
+        # Read hourly counts from the rollup cube
+        hourly_data = [{"hour": row['hour'], "trip_count": row['trip_count']}
+                       for row in read_rollup(cursor, ["hour"])]
+        if not hourly_data and approx:
+            states = read_sample_state(cursor)
+        if states is not None:
+            estimates = sample_group_counts(cursor, "HOUR(pickup_datetime)", states)
+            hourly_data = [{"hour": int(hour), "trip_count": estimate} for hour, (estimate, _) in estimates.items()]
 
-        # Average trip duration (minutes)
-        cursor.execute("SELECT AVG(trip_duration_min) as avg_duration FROM trips")
-        stats["avg_duration_min"] = cursor.fetchone()['avg_duration']
+        # Fall back to grouping the trips table
+        if not hourly_data:
+            states = None
+            # An index-only scan of idx_pickup_hour with the compact layout
+            query = f"""
+            SELECT {PICKUP_HOUR} as hour, COUNT(*) as trip_count 
+            FROM trips 
+            GROUP BY {PICKUP_HOUR}
+            ORDER BY hour
+            """
+            cursor.execute(query)
+            hourly_data = cursor.fetchall()
+
+        hours = [row['hour'] for row in hourly_data if row['hour'] is not None]
+        counts = [row['trip_count'] for row in hourly_data if row['hour'] is not None]
+
+    histogram = HourlyHistogram().add_counts(hours, counts)
 
-        # Average speed
-        cursor.execute("SELECT AVG(speed_kmh) as avg_speed FROM trips")
-        stats["avg_speed_kmh"] = cursor.fetchone()['avg_speed']
+    result = {
+        "hours": hours,
+        "counts": counts,
+        "peak_hours": identify_peak_hours(histogram=histogram)
+    }
+    if states is not None:
+        result.update(sample_info(states))
+        result["intervals"] = [interval for _, interval in estimates.values()]
+    return result
 
-        # Average distance
-        cursor.execute("SELECT AVG(trip_distance_km) as avg_distance FROM trips")
-        stats["avg_distance_km"] = cursor.fetchone()['avg_distance']
+def passenger_distribution(cursor, store=None, approx=False):
+    """
+    Trip counts by passenger count, formatted for Chart.js. With `approx`, a
+    missing rollup cube is estimated from trip_sample instead of grouping
+    trips.
+    """
+    states = None
+    if store is not None:
+        passenger_counts, counts = store.passenger_counts()
+    else:
+        # Read trip counts by passenger count from the rollup cube
+        passenger_data = [{"passenger_count": row['passenger_count'], "trip_count": row['trip_count']}
+                          for row in read_rollup(cursor, ["passenger_count"])
+                          if row['passenger_count'] is not None]
+        if not passenger_data and approx:
+            states = read_sample_state(cursor)
+        if states is not None:
+            estimates = sample_group_counts(cursor, "passenger_count", states)
+            estimates.pop(None, None)
+            passenger_data = [{"passenger_count": int(count), "trip_count": estimate}
+                              for count, (estimate, _) in estimates.items()]
 
-        # Most common passenger count
-        cursor.execute("""
-            SELECT passenger_count, COUNT(*) as count 
+        # Fall back to grouping the trips table
+        if not passenger_data:
+            states = None
+            query = """
+            SELECT passenger_count, COUNT(*) as trip_count 
             FROM trips 
-            GROUP BY passenger_count 
-            ORDER BY count DESC 
-            LIMIT 1
-        """)
-        result = cursor.fetchone()
-        stats["most_common_passenger_count"] = result['passenger_count'] if result else None
+            WHERE passenger_count IS NOT NULL
+            GROUP BY passenger_count
+            ORDER BY passenger_count
+            """
+            cursor.execute(query)
+            passenger_data = cursor.fetchall()
+
+        passenger_counts = [row['passenger_count'] for row in passenger_data]
+        counts = [row['trip_count'] for row in passenger_data]
+
+    result = {
+        "labels": [f"{count} passenger{'s' if count > 1 else ''}" for count in passenger_counts],
+        "counts": counts
+    }
+    if states is not None:
+        result.update(sample_info(states))
+        result["intervals"] = [interval for _, interval in estimates.values()]
+    return result
+
+def hourly_speeds(cursor, store=None):
+    """Average speed (km/h) by pickup hour as a 24-element array (NaN for hours without trips)"""
+    if store is not None:
+        rows = [format_rollup_row(row, ["hour"]) for row in store.rollup(["hour"], {}) if row['trip_count']]
+    else:
+        rows = read_rollup(cursor, ["hour"])
+        # Fall back to grouping the trips table
+        if not rows:
+            cursor.execute(f"""
+            SELECT {PICKUP_HOUR} as hour, COUNT(speed_kmh) as trip_count, AVG(speed_kmh) as avg_speed_kmh
+            FROM trips
+            GROUP BY {PICKUP_HOUR}
+            """)
+            rows = cursor.fetchall()
+
+    speeds = np.full(24, np.nan)
+    for row in rows:
+        if row['hour'] is not None and row['avg_speed_kmh'] is not None:
+            speeds[int(row['hour'])] = float(row['avg_speed_kmh'])
+    return speeds
+
+def run_section(section):
+    """
+    Run one of the section functions above against the configured backend.
+    `approx=true` only changes the answer when the precomputed tables are
+    missing; the column store's scans are fast enough that it always
+    answers exactly.
+    """
+    conn = None
+    try:
+        store = get_column_store()
+        if store is not None:
+            return jsonify(section(None, store))
+
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
 
+        cursor = conn.cursor(dictionary=True)
+        result = section(cursor, approx=parse_flag(request.args.get('approx')))
         cursor.close()
-        conn.close()
 
-        return jsonify(stats)
+        return jsonify(result)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    finally:
+        # Return the connection to the pool
+        if conn:
+            conn.close()
+
+@insights_bp.route('/stats', methods=['GET'])
+@cached_response
+def get_trip_stats():
+    """Get statistics about the trips data (`approx=true` estimates them from the trip sample without trip_summary)"""
+    return run_section(trip_stats)
+
 @insights_bp.route('/hourly-pattern', methods=['GET'])
+@cached_response
 def get_hourly_pattern():
-    """Get trip counts by hour of day"""
+    """Get trip counts by hour of day (`approx=true` estimates them from the trip sample without trip_rollup)"""
+    return run_section(hourly_pattern)
+
+@insights_bp.route('/passenger-distribution', methods=['GET'])
+@cached_response
+def get_passenger_distribution():
+    """Get distribution of trips by passenger count (`approx=true` estimates it from the sample without trip_rollup)"""
+    return run_section(passenger_distribution)
+
+@insights_bp.route('/dashboard', methods=['GET'])
+@cached_response
+async def get_dashboard():
+    """
+    /stats, /hourly-pattern and /passenger-distribution in one response
+
+    The three sections run concurrently, each on its own pooled connection,
+    so the dashboard needs one request instead of three. `approx=true`
+    applies to all three.
+    """
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+        sections = (trip_stats, hourly_pattern, passenger_distribution)
+        approx = parse_flag(request.args.get('approx'))
+        store = get_column_store()
+        if store is not None:
+            results = await asyncio.gather(*(run_in_thread(section, None, store) for section in sections))
+        else:
+            results = await asyncio.gather(*(with_cursor(section, None, approx) for section in sections))
 
-        cursor = conn.cursor(dictionary=True)
+        return jsonify(dict(zip(("stats", "hourly_pattern", "passenger_distribution"), results)))
 
-        # Extract hour from pickup_datetime and count trips
-        query = """
-        SELECT HOUR(pickup_datetime) as hour, COUNT(*) as trip_count 
-        FROM trips 
-        GROUP BY HOUR(pickup_datetime)
-        ORDER BY hour
-        """
-        cursor.execute(query)
-        hourly_data = cursor.fetchall()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        cursor.close()
-        conn.close()
 
-        # Format data for Chart.js
-        hours = [row['hour'] for row in hourly_data]
-        counts = [row['trip_count'] for row in hourly_data]
+@insights_bp.route('/rollup', methods=['GET'])
+@cached_response
+def get_rollup():
+    """
+    Trip counts and averages grouped and filtered by any rollup dimensions
+    (date, hour, day_of_week, passenger_count, vendor_id), read from the
+    pre-aggregated trip_rollup cube
+
+    `group_by=hour,vendor_id` and `filter=day_of_week:5|6,hour:7..9`
+    """
+    conn = None
+    try:
+        try:
+            group_by = parse_dimensions(request.args.get('group_by', default=''))
+            filters = parse_filters(request.args.get('filter', default=''))
+        except InvalidRollupQuery as e:
+            return jsonify({"error": str(e)}), 400
+
+        store = get_column_store()
+        if store is not None:
+            grouped = store.rollup(group_by, filters)
+        else:
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({"error": "Database connection failed"}), 500
+
+            cursor = conn.cursor(dictionary=True)
+            query, params = build_rollup_query(group_by, filters)
+            cursor.execute(query, params)
+            grouped = cursor.fetchall()
+            cursor.close()
+        rows = [format_rollup_row(row, group_by) for row in grouped if row['trip_count']]
 
         return jsonify({
-            "hours": hours,
-            "counts": counts
+            "group_by": group_by,
+            "filter": request.args.get('filter', default=''),
+            "rows": rows
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@insights_bp.route('/passenger-distribution', methods=['GET'])
-def get_passenger_distribution():
-    """Get distribution of trips by passenger count"""
+    finally:
+        # Return the connection to the pool
+        if conn:
+            conn.close()
+
+@insights_bp.route('/speed-distribution', methods=['GET'])
+@cached_response
+def get_speed_distribution():
+    """
+    Speed mean/std/percentiles and z-score outliers
+
+    Speeds are streamed from the server in chunks into mergeable
+    accumulators, so memory stays flat however many trips there are.
+    `z` sets the outlier threshold (default 3).
+    """
+    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+        z_threshold = request.args.get('z', default=3.0, type=float)
+        if z_threshold <= 0:
+            return jsonify({"error": "z must be greater than 0"}), 400
 
-        cursor = conn.cursor(dictionary=True)
+        stats = RunningStats()
+        sketch = QuantileSketch()
 
-        # Get trip counts grouped by passenger count
-        query = """
-        SELECT passenger_count, COUNT(*) as trip_count 
-        FROM trips 
-        WHERE passenger_count IS NOT NULL
-        GROUP BY passenger_count
-        ORDER BY passenger_count
-        """
-        cursor.execute(query)
-        passenger_data = cursor.fetchall()
+        store = get_column_store()
+        if store is not None:
+            speeds = store.speeds()
+            for i in range(0, len(speeds), STATS_FETCH_SIZE):
+                chunk = np.asarray(speeds[i:i + STATS_FETCH_SIZE])  # NaN (NULL) is skipped
+                stats.update(chunk)
+                sketch.update(chunk)
+        else:
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({"error": "Database connection failed"}), 500
 
-        cursor.close()
-        conn.close()
+            # Unbuffered: rows stay on the server until we fetch them
+            cursor = conn.cursor(buffered=False)
+            cursor.execute("SELECT speed_kmh FROM trips WHERE speed_kmh IS NOT NULL")
+            while True:
+                rows = cursor.fetchmany(STATS_FETCH_SIZE)
+                if not rows:
+                    break
+                speeds = np.fromiter((row[0] for row in rows), dtype="float64", count=len(rows))
+                stats.update(speeds)
+                sketch.update(speeds)
+            cursor.close()
 
-        # Format data for Chart.js
-        labels = [f"{row['passenger_count']} passenger{'s' if row['passenger_count'] > 1 else ''}" for row in passenger_data]
-        counts = [row['trip_count'] for row in passenger_data]
+        outliers = {"count": 0, "low": None, "high": None}
+        if stats.count:
+            # |z| > threshold is the same as falling outside [low, high],
+            # so the outliers can be counted from the speed index
+            low = stats.mean - z_threshold * stats.std
+            high = stats.mean + z_threshold * stats.std
+            if store is not None:
+                count = int(np.count_nonzero((speeds < low) | (speeds > high)))
+            else:
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute(
+                    "SELECT COUNT(*) as count FROM trips WHERE speed_kmh < %s OR speed_kmh > %s", (low, high))
+                count = cursor.fetchone()['count']
+                cursor.close()
+            outliers = {"count": count, "low": low, "high": high}
+
+        return jsonify({
+            "speed": stats.to_dict(),
+            "percentiles": {f"p{round(q * 100)}": value for q, value in sketch.quantiles(SPEED_PERCENTILES).items()},
+            "relative_accuracy": sketch.relative_accuracy,
+            "z_threshold": z_threshold,
+            "outliers": outliers
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    finally:
+        # Return the connection to the pool
+        if conn:
+            conn.close()
+
+@insights_bp.route('/fare-estimate', methods=['POST'])
+def get_fare_estimates():
+    """
+    Estimate fares for a batch of trips with estimate_trip_fare's formula
+
+    The JSON body holds `trips`, either a list of objects or an object of
+    equal-length arrays (the cheaper form for large batches). Each trip has
+    `distance_km` or the four pickup/dropoff coordinates, and optionally
+    `duration_min`, `passenger_count` (default 1) and `pickup_datetime`.
+    Without a duration, it is estimated from the average speed of trips
+    picked up in the same hour (the mean over all hours without a pickup time).
+    The whole batch is computed with array operations, not per trip.
+    """
+    conn = None
+    try:
+        body = request.get_json(silent=True)
+        trips = body.get('trips') if isinstance(body, dict) else None
+        if isinstance(trips, list):
+            if not all(isinstance(trip, dict) for trip in trips):
+                return jsonify({"error": "trips must be a list of objects or an object of arrays"}), 400
+        elif not (isinstance(trips, dict) and all(isinstance(values, list) for values in trips.values())):
+            return jsonify({"error": "trips must be a list of objects or an object of arrays"}), 400
+        try:
+            df = pd.DataFrame(trips)
+        except ValueError:
+            return jsonify({"error": "trips arrays must all have the same length"}), 400
+        if len(df) > FARE_ESTIMATE_MAX_TRIPS:
+            return jsonify({"error": f"At most {FARE_ESTIMATE_MAX_TRIPS} trips per request"}), 400
+
+        def column(name):
+            values = df[name] if name in df.columns else pd.Series(np.nan, index=df.index)
+            return pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+
+        distance = column('distance_km')
+        if all(col in df.columns for col in COORDINATE_COLUMNS):
+            distance = np.where(np.isnan(distance), haversine_distances(*map(column, COORDINATE_COLUMNS)), distance)
+
+        duration = column('duration_min')
+        needs_duration = np.isnan(duration) & ~np.isnan(distance)
+        if needs_duration.any():
+            store = get_column_store()
+            if store is not None:
+                speeds = hourly_speeds(None, store)
+            else:
+                conn = get_db_connection()
+                if not conn:
+                    return jsonify({"error": "Database connection failed"}), 500
+                cursor = conn.cursor(dictionary=True)
+                speeds = hourly_speeds(cursor)
+                cursor.close()
+
+            # Trips without a pickup time get the all-day average speed
+            trip_speeds = np.full(len(df), np.nanmean(speeds) if not np.isnan(speeds).all() else np.nan)
+            if 'pickup_datetime' in df.columns:
+                hours = pd.to_datetime(df['pickup_datetime'], errors="coerce", format="ISO8601").dt.hour
+                known = hours.notna().to_numpy()
+                trip_speeds[known] = speeds[hours[known].to_numpy(dtype="int64")]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                estimated = distance / trip_speeds * 60
+            duration = np.where(needs_duration & np.isfinite(estimated), estimated, duration)
+
+        passengers = df['passenger_count'] if 'passenger_count' in df.columns else None
+        fares = estimate_trip_fares(distance, duration, passengers)
+
+        estimates = pd.DataFrame({
+            "distance_km": distance.round(3),
+            "duration_min": duration.round(2),
+            "duration_estimated": needs_duration & ~np.isnan(duration),
+            "fare": fares,
+        })
+        # NaN (not enough input for a trip) becomes null
+        estimates = estimates.astype(object).where(estimates.notna(), None)
 
         return jsonify({
-            "labels": labels,
-            "counts": counts
+            "count": len(estimates),
+            "estimates": estimates.to_dict("records")
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    finally:
+        # Return the connection to the pool
+        if conn:
+            conn.close()
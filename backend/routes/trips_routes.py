@@ -1,111 +1,571 @@
 """
 Routes for trip data API endpoints
 """
+import asyncio
+import csv
+import io
+import json
 import os
 import sys
-from flask import Blueprint, jsonify, request
-import mysql.connector
+from flask import Blueprint, Response, jsonify, request
 
 # Add the backend directory to the path for imports
 backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
-from config.db_config import get_db_config
+from utils.async_db import fetch_all, fetch_one, with_cursor
+from utils.column_store import get_column_store
+from utils.dataset_version import get_dataset_version
+from utils.db_connection import get_db_connection
+from utils.geo_grid import bounding_box, cell_ranges
+from utils.helpers import haversine_distance, parse_datetime, parse_flag
+from utils.pagination import (
+    COUNT_MODES, CURSOR_SORT_COLUMNS, InvalidCursorError, cached_count,
+    decode_cursor, encode_cursor, estimate_count, keyset_condition, remember_count
+)
+from utils.trip_keys import KEY_COLUMN, primary_keys, trip_id_from_primary_key
+from utils.trip_sample import sample_count
+from utils.trips_schema import TRIPS_SCHEMA, select_columns
 
 # Create a Blueprint for trips routes
 trips_bp = Blueprint('trips', __name__)
 
-def get_db_connection():
-    """Helper function to get a database connection"""
-    try:
-        config = get_db_config()
-        conn = mysql.connector.connect(**config)
-        return conn
-    except mysql.connector.Error as e:
-        print(f"Error connecting to MySQL: {e}")
+# Columns `fields=` may select, in table order
+TRIP_FIELDS = (
+    "id", "vendor_id", "pickup_datetime", "dropoff_datetime", "passenger_count",
+    "pickup_longitude", "pickup_latitude", "dropoff_longitude", "dropoff_latitude",
+    "store_and_fwd_flag", "trip_duration", "trip_distance_km", "trip_duration_min",
+    "speed_kmh", "fare_per_km", "pickup_cell", "dropoff_cell", "created_at"
+)
+# rows: a list of trip objects; columnar: one array per column
+RESPONSE_FORMATS = ("rows", "columnar")
+
+# Most ids POST /batch resolves per request, and ids per IN (...) query
+BATCH_MAX_IDS = 10000
+BATCH_CHUNK_SIZE = 1000
+
+# Rows pulled from the server per fetchmany() call while exporting
+EXPORT_FETCH_SIZE = 5000
+EXPORT_FORMATS = ("ndjson", "csv")
+
+# Largest search radius for /nearby; bigger circles cover too many grid cells
+MAX_NEARBY_RADIUS_KM = 10
+NEARBY_POINTS = ("pickup", "dropoff")
+
+def build_trip_filters(min_speed=None, max_speed=None, start=None, end=None, passenger_count=None):
+    """
+    Build the WHERE fragment and params shared by trip queries
+
+    `start`/`end` bound pickup_datetime (start inclusive, end exclusive), so
+    only the monthly partitions in that range are read.
+    """
+    where = ""
+    params = []
+
+    if start is not None:
+        where += " AND pickup_datetime >= %s"
+        params.append(start)
+
+    if end is not None:
+        where += " AND pickup_datetime < %s"
+        params.append(end)
+
+    if passenger_count is not None:
+        where += " AND passenger_count = %s"
+        params.append(passenger_count)
+
+    if min_speed is not None:
+        where += " AND speed_kmh >= %s"
+        params.append(min_speed)
+
+    if max_speed is not None:
+        where += " AND speed_kmh <= %s"
+        params.append(max_speed)
+
+    return where, params
+
+def parse_time_range(args):
+    """`start`/`end` request args as naive datetimes (None when absent); raises ValueError"""
+    start = parse_datetime(args['start']).replace(tzinfo=None) if args.get('start') else None
+    end = parse_datetime(args['end']).replace(tzinfo=None) if args.get('end') else None
+    if start and end and start >= end:
+        raise ValueError("start must be before end")
+    return start, end
+
+def parse_fields(value):
+    """`fields` request arg as a list of trip columns (None for all); raises ValueError"""
+    if not value:
         return None
+    fields = list(dict.fromkeys(field.strip() for field in value.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in TRIP_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+def select_list(fields, *required):
+    """SELECT list for `fields` (all columns for None) plus any `required` columns"""
+    if fields is None:
+        # trip_key and the compact layout's generated columns are internal
+        if KEY_COLUMN == "id" and TRIPS_SCHEMA == "standard":
+            return "*"
+        fields = list(TRIP_FIELDS)
+    return select_columns(fields + [column for column in required if column not in fields])
+
+def fetch_trips_by_id(cursor, trip_ids, fields=None):
+    """
+    {id: trip} for the trips among `trip_ids` that exist, read through the
+    primary key with BATCH_CHUNK_SIZE ids per IN (...) query. The key is
+    (KEY_COLUMN, pickup_datetime), so without a pickup time each query probes
+    every monthly partition; MySQL doesn't enforce one row per id, so the
+    last row read wins should there ever be two.
+    """
+    keys = primary_keys(trip_ids)
+    columns = select_list(fields, 'id')
+    trips = {}
+    for i in range(0, len(keys), BATCH_CHUNK_SIZE):
+        chunk = keys[i:i + BATCH_CHUNK_SIZE]
+        cursor.execute(
+            f"SELECT {columns} FROM trips WHERE {KEY_COLUMN} IN ({', '.join(['%s'] * len(chunk))})", chunk)
+        for trip in cursor.fetchall():
+            trips[trip['id']] = trip
+    if fields is not None and 'id' not in fields:
+        for trip in trips.values():
+            del trip['id']
+    return trips
+
+def rows_to_columns(rows, fields=None):
+    """Row dicts as one list per column (the requested fields the rows have)"""
+    if rows:
+        fields = [field for field in fields or rows[0] if field in rows[0]]
+    elif fields is None:
+        fields = list(TRIP_FIELDS)
+    return {field: [row[field] for row in rows] for field in fields}
 
 @trips_bp.route('/', methods=['GET'])
-def get_trips():
-    """Get trips with optional filtering"""
+async def get_trips():
+    """
+    Get trips with optional filtering
+
+    Pagination is either offset based (`limit`, `offset`) or keyset based:
+    pass `cursor` (empty for the first page) and optionally
+    `order_by=speed_kmh|pickup_datetime`, then send back `next_cursor`.
+    `count=exact|approx|sample|none` controls how `total_count` is computed;
+    `sample` (or `approx=true`) scales up the matching trips in trip_sample
+    and adds `count_interval`, falling back to exact before it is built.
+    `start`/`end` limit pickup_datetime and `passenger_count` matches exactly.
+    `fields=a,b,c` returns only those columns (and only reads them), and
+    `format=columnar` returns `trips` as one array per column.
+    The page and the count run concurrently on separate pooled connections.
+    """
     try:
         # Get query parameters
         limit = request.args.get('limit', default=100, type=int)
         offset = request.args.get('offset', default=0, type=int)
         min_speed = request.args.get('min_speed', default=0, type=float)
         max_speed = request.args.get('max_speed', type=float)
+        passenger_count = request.args.get('passenger_count', type=int)
+        count_mode = request.args.get('count', default='exact')
+        if parse_flag(request.args.get('approx')) and count_mode != 'none':
+            count_mode = 'sample'
+        use_cursor = 'cursor' in request.args
+        token = request.args.get('cursor', default='')
+        order_by = request.args.get('order_by', default='speed_kmh')
+        response_format = request.args.get('format', default='rows')
+
+        if count_mode not in COUNT_MODES:
+            return jsonify({"error": f"count must be one of {', '.join(COUNT_MODES)}"}), 400
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(RESPONSE_FORMATS)}"}), 400
+
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        try:
+            start, end = parse_time_range(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if use_cursor:
+            if token:
+                try:
+                    order_by, last_value, last_id = decode_cursor(token)
+                except InvalidCursorError as e:
+                    return jsonify({"error": str(e)}), 400
+            elif order_by not in CURSOR_SORT_COLUMNS:
+                return jsonify({"error": f"order_by must be one of {', '.join(CURSOR_SORT_COLUMNS)}"}), 400
+
+        filters = (min_speed, max_speed, start, end, passenger_count)
+        next_cursor = None
+        count_interval = None
+        store = get_column_store()
+        if store is not None:
+            # Counting is a vectorized scan here, so count=approx|sample is answered exactly
+            if use_cursor:
+                after = (last_value, last_id) if token else None
+                positions = store.page(filters, limit + 1, order_by=order_by, after=after)
+                if len(positions) > limit:
+                    positions = positions[:limit]
+                    next_cursor = encode_cursor(order_by, store.to_dicts(positions[-1:], [order_by, 'id'])[0])
+            else:
+                positions = store.page(filters, limit, offset)
+            if response_format == 'columnar':
+                trips = store.to_columns(positions, fields)
+            else:
+                trips = store.to_dicts(positions, fields)
+            total_count = None if count_mode == 'none' else store.count(filters)
+        else:
+            # Build the query; a cursor needs the sort key and id of the last row
+            where, filter_params = build_trip_filters(min_speed, max_speed, start, end, passenger_count)
+            columns = select_list(fields, order_by, 'id') if use_cursor else select_list(fields)
+            query = f"SELECT {columns} FROM trips WHERE 1=1" + where
+            params = list(filter_params)
+
+            if use_cursor:
+                # Rows with no sort key can't be positioned by a cursor
+                query += f" AND {order_by} IS NOT NULL"
+                if token:
+                    try:
+                        condition, condition_params = keyset_condition(order_by, last_value, last_id)
+                    except InvalidCursorError as e:
+                        return jsonify({"error": str(e)}), 400
+                    query += condition
+                    params.extend(condition_params)
+                # Fetch one extra row to know whether another page exists
+                query += f" ORDER BY {order_by}, {KEY_COLUMN} LIMIT %s"
+                params.append(limit + 1)
+            else:
+                query += " LIMIT %s OFFSET %s"
+                params.extend([limit, offset])
+
+            # Get total count (for pagination) alongside the page. Counts are
+            # cached per dataset version, read before counting, so a count
+            # taken before a load is never reused after it
+            count_key = (get_dataset_version(), filters)
+            total_count = cached_count(count_key) if count_mode == 'approx' else None
+            queries = [fetch_all(query, params)]
+            if count_mode == 'exact':
+                queries.append(fetch_one("SELECT COUNT(*) as count FROM trips WHERE 1=1" + where, filter_params))
+            elif count_mode == 'approx' and total_count is None:
+                queries.append(with_cursor(estimate_count, where, filter_params))
+            elif count_mode == 'sample':
+                queries.append(with_cursor(sample_count, where, filter_params))
+            results = await asyncio.gather(*queries)
+
+            trips = results[0]
+            if count_mode == 'exact':
+                total_count = results[1]['count']
+                remember_count(count_key, total_count)
+            elif count_mode == 'sample':
+                if results[1] is not None:
+                    total_count, count_interval = results[1]
+                else:
+                    # Sample not built yet
+                    row = await fetch_one("SELECT COUNT(*) as count FROM trips WHERE 1=1" + where, filter_params)
+                    total_count = row['count']
+            elif len(results) > 1:
+                total_count = results[1]
+
+            if use_cursor and len(trips) > limit:
+                trips = trips[:limit]
+                next_cursor = encode_cursor(order_by, trips[-1])
+
+            if response_format == 'columnar':
+                trips = rows_to_columns(trips, fields)
+            elif use_cursor and fields is not None and not {order_by, 'id'} <= set(fields):
+                # Drop the sort key and id added for the cursor
+                trips = [{field: trip[field] for field in fields} for trip in trips]
+
+        response = {
+            "trips": trips,
+            "total_count": total_count,
+            "count_mode": count_mode,
+            "limit": limit,
+            "format": response_format
+        }
+        if count_interval is not None:
+            response["count_interval"] = count_interval
+        if use_cursor:
+            response.update({"order_by": order_by, "next_cursor": next_cursor})
+        else:
+            response["offset"] = offset
+
+        return jsonify(response)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Connect to the database
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+@trips_bp.route('/export', methods=['GET'])
+def export_trips():
+    """
+    Stream every matching trip as NDJSON (default) or CSV
 
-        cursor = conn.cursor(dictionary=True)
+    Rows are read through an unbuffered cursor and written out chunk by
+    chunk, so memory stays flat no matter how many trips are exported.
+    Accepts the same `min_speed` / `max_speed` / `start` / `end` /
+    `passenger_count` filters and `fields` projection as GET /api/trips,
+    plus `format=ndjson|csv` and an optional `limit`.
+    """
+    export_format = request.args.get('format', default='ndjson')
+    min_speed = request.args.get('min_speed', default=0, type=float)
+    max_speed = request.args.get('max_speed', type=float)
+    passenger_count = request.args.get('passenger_count', type=int)
+    limit = request.args.get('limit', type=int)
 
-        # Build the query
-        query = "SELECT * FROM trips WHERE 1=1"
-        params = []
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
 
-        if min_speed is not None:
-            query += " AND speed_kmh >= %s"
-            params.append(min_speed)
+    try:
+        start, end = parse_time_range(request.args)
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    store = None
+    conn = None
+    try:
+        store = get_column_store()
+        if store is not None:
+            columns = store.projection(fields)
+            batches = store.iter_rows((min_speed, max_speed, start, end, passenger_count), limit,
+                                      EXPORT_FETCH_SIZE, columns)
+        else:
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({"error": "Database connection failed"}), 500
+
+            where, params = build_trip_filters(min_speed, max_speed, start, end, passenger_count)
+            query = f"SELECT {select_list(fields)} FROM trips WHERE 1=1" + where
+            if limit is not None:
+                query += " LIMIT %s"
+                params.append(limit)
 
-        if max_speed is not None:
-            query += " AND speed_kmh <= %s"
-            params.append(max_speed)
+            # Unbuffered: rows stay on the server until we fetch them
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(query, params)
+            columns = list(cursor.column_names)
+            batches = iter(lambda: cursor.fetchmany(EXPORT_FETCH_SIZE), [])
+    except Exception as e:
+        if conn:
+            conn.close()
+        return jsonify({"error": str(e)}), 500
 
-        query += " LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
+    def generate():
+        try:
+            if export_format == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                for rows in batches:
+                    writer.writerows(rows)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                if buffer.tell():
+                    yield buffer.getvalue()
+            else:
+                for rows in batches:
+                    yield "".join(
+                        json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows
+                    )
+        finally:
+            # Runs on completion or when the client disconnects; a connection
+            # with unread rows fails its rollback and is dropped by the pool
+            if conn:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+                conn.close()
 
-        # Execute the query
-        cursor.execute(query, params)
-        trips = cursor.fetchall()
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(generate(), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=trips.{export_format}'
+    return response
 
-        # Get total count (for pagination)
-        count_query = "SELECT COUNT(*) as count FROM trips WHERE 1=1"
-        count_params = []
+@trips_bp.route('/nearby', methods=['GET'])
+def get_nearby_trips():
+    """
+    Trips picked up (or with `by=dropoff`, dropped off) within `radius_km`
+    of `lat`/`lon`, nearest first
 
-        if min_speed is not None:
-            count_query += " AND speed_kmh >= %s"
-            count_params.append(min_speed)
+    Candidates come from the grid cell index (one id range per grid row,
+    index-only), then haversine_distance keeps the ones inside the circle
+    and only the nearest `limit` rows are read in full.
+    """
+    conn = None
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        radius_km = request.args.get('radius_km', default=1.0, type=float)
+        limit = request.args.get('limit', default=100, type=int)
+        point = request.args.get('by', default='pickup')
 
-        if max_speed is not None:
-            count_query += " AND speed_kmh <= %s"
-            count_params.append(max_speed)
+        if lat is None or lon is None:
+            return jsonify({"error": "lat and lon are required"}), 400
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify({"error": "lat/lon out of range"}), 400
+        if not 0 < radius_km <= MAX_NEARBY_RADIUS_KM:
+            return jsonify({"error": f"radius_km must be greater than 0 and at most {MAX_NEARBY_RADIUS_KM}"}), 400
+        if point not in NEARBY_POINTS:
+            return jsonify({"error": f"by must be one of {', '.join(NEARBY_POINTS)}"}), 400
 
-        cursor.execute(count_query, count_params)
-        total_count = cursor.fetchone()['count']
+        ranges = cell_ranges(lat, lon, radius_km)
+        box = bounding_box(lat, lon, radius_km)
+        min_lat, max_lat, min_lon, max_lon = box
 
-        # Close connection
-        cursor.close()
-        conn.close()
+        store = get_column_store()
+        if store is not None:
+            positions, distances, candidate_count = store.nearby(point, lat, lon, radius_km, ranges, box)
+            trips = store.to_dicts(positions[:limit])
+            for trip, distance in zip(trips, distances[:limit].tolist()):
+                trip['distance_km'] = round(distance, 4)
+            total_count = len(positions)
+        else:
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({"error": "Database connection failed"}), 500
+
+            cursor = conn.cursor()
+
+            # Prune by grid cells, then by the bounding box on the indexed coordinates
+            # (the primary key is part of every index, so this stays index-only)
+            columns = select_columns([KEY_COLUMN, f"{point}_latitude", f"{point}_longitude"])
+            query = (
+                f"SELECT {columns} FROM trips WHERE ("
+                + " OR ".join([f"{point}_cell BETWEEN %s AND %s"] * len(ranges))
+                + f") AND {point}_latitude BETWEEN %s AND %s AND {point}_longitude BETWEEN %s AND %s"
+            )
+            params = [cell for cell_range in ranges for cell in cell_range]
+            params.extend([min_lat, max_lat, min_lon, max_lon])
+            cursor.execute(query, params)
+            candidates = cursor.fetchall()
+
+            # Exact distance check on the candidates only
+            matches = []
+            for key, trip_lat, trip_lon in candidates:
+                distance = haversine_distance(lat, lon, trip_lat, trip_lon)
+                if distance <= radius_km:
+                    matches.append((distance, trip_id_from_primary_key(key)))
+            matches.sort()
+            nearest = matches[:limit]
+            cursor.close()
+
+            trips = []
+            if nearest:
+                cursor = conn.cursor(dictionary=True)
+                rows = fetch_trips_by_id(cursor, [trip_id for _, trip_id in nearest])
+                cursor.close()
+                for distance, trip_id in nearest:
+                    if trip_id in rows:
+                        trip = rows[trip_id]
+                        trip['distance_km'] = round(distance, 4)
+                        trips.append(trip)
+            total_count = len(matches)
+            candidate_count = len(candidates)
 
         return jsonify({
             "trips": trips,
             "total_count": total_count,
-            "limit": limit,
-            "offset": offset
+            "candidates": candidate_count,
+            "lat": lat,
+            "lon": lon,
+            "radius_km": radius_km,
+            "by": point,
+            "limit": limit
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    finally:
+        # Return the connection to the pool
+        if conn:
+            conn.close()
+
+@trips_bp.route('/batch', methods=['POST'])
+def get_trips_batch():
+    """
+    Look up many trips in one request
+
+    The JSON body holds `ids` (up to BATCH_MAX_IDS trip ids) and optionally
+    `fields` and `format` as in GET /api/trips. Found trips come back in
+    request order, and ids that don't exist are listed in `missing`. All
+    ids are resolved on one connection, BATCH_CHUNK_SIZE per query.
+    """
+    conn = None
+    try:
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+
+        trip_ids = body.get('ids')
+        if not isinstance(trip_ids, list) or not all(isinstance(trip_id, str) for trip_id in trip_ids):
+            return jsonify({"error": "ids must be a list of trip id strings"}), 400
+        if len(trip_ids) > BATCH_MAX_IDS:
+            return jsonify({"error": f"At most {BATCH_MAX_IDS} ids per request"}), 400
+
+        response_format = body.get('format', 'rows')
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"error": f"format must be one of {', '.join(RESPONSE_FORMATS)}"}), 400
+
+        fields = body.get('fields')
+        if isinstance(fields, list):
+            fields = ",".join(map(str, fields))
+        try:
+            fields = parse_fields(fields)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        trip_ids = list(dict.fromkeys(trip_ids))
+        store = get_column_store()
+        if store is not None:
+            found = store.get_many(trip_ids, fields)
+        else:
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({"error": "Database connection failed"}), 500
+
+            cursor = conn.cursor(dictionary=True)
+            found = fetch_trips_by_id(cursor, trip_ids, fields)
+            cursor.close()
+
+        trips = [found[trip_id] for trip_id in trip_ids if trip_id in found]
+        if response_format == 'columnar':
+            trips = rows_to_columns(trips, fields)
+
+        return jsonify({
+            "trips": trips,
+            "missing": [trip_id for trip_id in trip_ids if trip_id not in found],
+            "count": len(found),
+            "format": response_format
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    finally:
+        # Return the connection to the pool
+        if conn:
+            conn.close()
+
 @trips_bp.route('/<string:trip_id>', methods=['GET'])
 def get_trip(trip_id):
     """Get a specific trip by ID"""
+    conn = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({"error": "Database connection failed"}), 500
+        store = get_column_store()
+        if store is not None:
+            trip = store.get(trip_id)
+        else:
+            conn = get_db_connection()
+            if not conn:
+                return jsonify({"error": "Database connection failed"}), 500
 
-        cursor = conn.cursor(dictionary=True)
-        query = "SELECT * FROM trips WHERE id = %s"
-        cursor.execute(query, (trip_id,))
-        
-        trip = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+            cursor = conn.cursor(dictionary=True)
+            trip = fetch_trips_by_id(cursor, [trip_id]).get(trip_id)
+            cursor.close()
         
         if trip:
             return jsonify(trip)
@@ -114,3 +574,8 @@ def get_trip(trip_id):
             
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+    finally:
+        # Return the connection to the pool
+        if conn:
+            conn.close()
@@ -0,0 +1,452 @@
+"""
+Benchmark the pipeline stages, custom_algorithm functions and API endpoints
+
+A synthetic raw file (see generate_trips.py) is generated into a temporary
+directory and pushed through every pipeline stage. The featured output feeds
+the algorithm benchmarks and a local SQLite stand-in for MySQL (trips,
+trip_summary, trip_rollup and trip_sample), which the Flask endpoints query
+through the test client. Results are compared with the stored baseline
+(benchmarks/baseline.json, recorded with --rows 100000), and the run fails
+when a case is slower than its threshold allows, or when there is no
+baseline for this --rows to compare with.
+
+    python scripts/benchmark.py --rows 100000 --save-baseline
+    python scripts/benchmark.py --rows 100000
+    python scripts/benchmark.py --groups api,algorithms --repeat 10
+
+The stand-in measures the application side of each endpoint (query building,
+fetching, Python post-processing, JSON), not MySQL itself.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPTS_DIR)
+ROOT_DIR = os.path.dirname(BASE_DIR)
+sys.path.append(BASE_DIR)
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+
+import data_cleaning
+import feature_engineering
+import parallel_transform
+import run_pipeline
+from generate_trips import generate_trips
+from utils import column_store
+from utils.custom_algorithm import detect_outlier_speeds, estimate_trip_fare, estimate_trip_fares, identify_peak_hours
+from utils.streaming_stats import QuantileSketch, RunningStats
+from utils.trip_io import read_trips, to_python_objects, trip_file
+from utils.trip_rollup import CREATE_ROLLUP_TABLE, _ROLLUP_COLUMNS, rollup_frame
+from utils.trip_sample import (
+    CREATE_SAMPLE_STATE_TABLE, CREATE_SAMPLE_TABLE, _SAMPLE_TABLE_COLUMNS, sample_rows, sample_strata
+)
+from utils.trip_summary import CREATE_SUMMARY_TABLE, _SUMMARY_COLUMNS, summarize_frame
+from utils.trips_schema import TRIP_COLUMN_TYPES
+
+BASELINE_FILE = os.path.join(BASE_DIR, "benchmarks/baseline.json")
+GROUPS = ["pipeline", "algorithms", "api", "api_columnar"]
+
+# A case fails when it takes longer than threshold * its baseline time
+DEFAULT_THRESHOLD = 1.25
+
+# Rows passed one by one through the scalar estimate_trip_fare
+FARE_SAMPLE_ROWS = 10000
+
+# --- SQLite stand-in for the MySQL connection pool ---
+
+STANDIN_INDEXES = [
+    "CREATE INDEX idx_pickup_datetime ON trips (pickup_datetime)",
+    "CREATE INDEX idx_speed_kmh ON trips (speed_kmh)",
+    "CREATE INDEX idx_passenger_pickup ON trips (passenger_count, pickup_datetime)",
+    "CREATE INDEX idx_pickup_cell ON trips (pickup_cell, pickup_latitude, pickup_longitude)",
+    "CREATE INDEX idx_dropoff_cell ON trips (dropoff_cell, dropoff_latitude, dropoff_longitude)",
+]
+
+
+def _sql_hour(value):
+    return int(value[11:13]) if value else None
+
+
+def _sql_weekday(value):
+    return datetime.date.fromisoformat(value[:10]).weekday() if value else None
+
+
+def build_standin_db(path, df):
+    """SQLite file with trips, trip_summary, trip_rollup and trip_sample built from a featured frame"""
+    conn = sqlite3.connect(path)
+    # Only the columns the loader puts in the trips table
+    columns = [name for name, _, _ in TRIP_COLUMN_TYPES if name in df.columns]
+    to_python_objects(df[columns]).to_sql("trips", conn, index=False, chunksize=50000)
+    for statement in STANDIN_INDEXES:
+        conn.execute(statement)
+    conn.execute(CREATE_SUMMARY_TABLE)
+    conn.executemany(
+        f"INSERT INTO trip_summary ({', '.join(_SUMMARY_COLUMNS)}) "
+        f"VALUES ({', '.join(['?'] * len(_SUMMARY_COLUMNS))})", summarize_frame(df))
+    conn.execute(CREATE_ROLLUP_TABLE)
+    conn.executemany(
+        f"INSERT INTO trip_rollup ({', '.join(_ROLLUP_COLUMNS)}) "
+        f"VALUES ({', '.join(['?'] * len(_ROLLUP_COLUMNS))})", rollup_frame(df))
+    conn.execute(CREATE_SAMPLE_TABLE)
+    conn.execute(CREATE_SAMPLE_STATE_TABLE)
+    capacities = sample_strata()
+    rows, seen = sample_rows(df, {stratum: (capacity, 0) for stratum, capacity in capacities.items()},
+                             np.random.default_rng(0))
+    conn.executemany(
+        f"INSERT INTO trip_sample ({', '.join(_SAMPLE_TABLE_COLUMNS)}) "
+        f"VALUES ({', '.join(['?'] * len(_SAMPLE_TABLE_COLUMNS))})", rows)
+    conn.executemany("INSERT INTO trip_sample_state (stratum, capacity, seen) VALUES (?, ?, ?)",
+                     [(stratum, capacities[stratum], count) for stratum, count in seen.items()])
+    conn.commit()
+    conn.close()
+
+
+class StandInCursor:
+    """mysql.connector-like cursor over SQLite (%s placeholders, dictionary rows)"""
+
+    def __init__(self, conn, dictionary=False):
+        self._cursor = conn.cursor()
+        self._dictionary = dictionary
+        self._rows = None
+        self.column_names = ()
+
+    def execute(self, query, params=()):
+        if query.lstrip().upper().startswith("EXPLAIN"):
+            # Optimizer estimates for count=approx; SQLite has no equivalent
+            count = self._cursor.execute("SELECT COUNT(*) FROM trips").fetchone()[0]
+            self._rows = [(count, 100.0)]
+            self.column_names = ("rows", "filtered")
+            return
+        self._rows = None
+        self._cursor.execute(query.replace("%s", "?"), list(params or ()))
+        self.column_names = tuple(d[0] for d in self._cursor.description or ())
+
+    def _convert(self, rows):
+        if self._dictionary:
+            return [dict(zip(self.column_names, row)) for row in rows]
+        return rows
+
+    def fetchall(self):
+        if self._rows is not None:
+            rows, self._rows = self._rows, []
+            return self._convert(rows)
+        return self._convert(self._cursor.fetchall())
+
+    def fetchmany(self, size):
+        if self._rows is not None:
+            rows, self._rows = self._rows[:size], self._rows[size:]
+            return self._convert(rows)
+        return self._convert(self._cursor.fetchmany(size))
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandInConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.create_function("HOUR", 1, _sql_hour, deterministic=True)
+        self._conn.create_function("WEEKDAY", 1, _sql_weekday, deterministic=True)
+
+    def cursor(self, dictionary=False, **kwargs):
+        return StandInCursor(self._conn, dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def standin_app(db_path):
+    """Flask app whose routes get their connections from the SQLite stand-in"""
+    sys.path.append(ROOT_DIR)
+    sqlite3.register_adapter(datetime.datetime, lambda v: v.strftime("%Y-%m-%d %H:%M:%S"))
+    from app import create_app
+    from routes import insights_routes, trips_routes
+    from utils import async_db
+
+    for module in (trips_routes, insights_routes, async_db):
+        module.get_db_connection = lambda: StandInConnection(db_path)
+    return create_app()
+
+# --- Cases ---
+
+def pipeline_cases(raw_file, work_dir, workers):
+    cleaned = trip_file(os.path.join(work_dir, "cleaned"))
+    featured = trip_file(os.path.join(work_dir, "featured"))
+    rejects_dir = os.path.join(work_dir, "rejected")
+    rows = sum(1 for _ in open(raw_file)) - 1
+    chunksize = max(1000, rows // 10)
+    return [
+        ("pipeline.clean", lambda: data_cleaning.clean_trips(raw_file, cleaned, 0, rejects_dir)),
+        ("pipeline.clean_chunked", lambda: data_cleaning.clean_trips(raw_file, cleaned, chunksize, rejects_dir)),
+        ("pipeline.features", lambda: feature_engineering.engineer_features(cleaned, featured, rejects_dir)),
+        ("pipeline.fused", lambda: run_pipeline.clean_and_engineer(raw_file, featured, 0, rejects_dir)),
+        (f"pipeline.parallel_{workers}", lambda: parallel_transform.transform_parallel(
+            raw_file, featured, workers, True, rejects_dir)),
+    ]
+
+
+def algorithm_cases(df):
+    sample = df.head(FARE_SAMPLE_ROWS)
+    fares_input = list(zip(sample["trip_distance_km"], sample["trip_duration_min"],
+                           sample["passenger_count"].fillna(1).astype(int)))
+    speeds = df["speed_kmh"].to_numpy(dtype="float64")
+    trips = df[["pickup_datetime"]]
+
+    def streaming_speed_stats():
+        stats, sketch = RunningStats(), QuantileSketch()
+        for chunk in np.array_split(speeds, max(1, len(speeds) // 50000)):
+            stats.update(chunk)
+            sketch.update(chunk)
+        return sketch.quantile(0.99)
+
+    return [
+        (f"algorithms.estimate_trip_fare_x{len(fares_input)}",
+         lambda: [estimate_trip_fare(d, m, p) for d, m, p in fares_input]),
+        (f"algorithms.estimate_trip_fares_x{len(df)}",
+         lambda: estimate_trip_fares(df["trip_distance_km"], df["trip_duration_min"], df["passenger_count"])),
+        ("algorithms.identify_peak_hours", lambda: identify_peak_hours(trips)),
+        ("algorithms.detect_outlier_speeds", lambda: detect_outlier_speeds(speeds)),
+        ("algorithms.streaming_speed_stats", streaming_speed_stats),
+        ("algorithms.summarize_frame", lambda: summarize_frame(df)),
+        ("algorithms.rollup_frame", lambda: rollup_frame(df)),
+    ]
+
+
+def api_cases(client, df, prefix="api"):
+    from utils.response_cache import response_cache
+
+    first = df.iloc[0]
+    day = df["pickup_datetime"].min().normalize()
+    # 1000 ids spread over the table
+    batch_ids = df["id"].astype(str).iloc[::max(1, len(df) // 1000)].tolist()[:1000]
+    # 1000 trips by coordinates and pickup time, as arrays
+    fare_sample = df.iloc[::max(1, len(df) // 1000)].head(1000)
+    fare_trips = {col: fare_sample[col].astype(float).tolist()
+                  for col in ("pickup_latitude", "pickup_longitude", "dropoff_latitude", "dropoff_longitude")}
+    fare_trips["pickup_datetime"] = fare_sample["pickup_datetime"].dt.strftime("%Y-%m-%d %H:%M:%S").tolist()
+    fare_trips["passenger_count"] = fare_sample["passenger_count"].fillna(1).astype(int).tolist()
+    endpoints = {
+        "trips_offset": "/api/trips/?limit=100",
+        "trips_keyset": "/api/trips/?limit=100&count=none&cursor=&order_by=pickup_datetime",
+        "trips_time_range": f"/api/trips/?limit=100&start={day:%Y-%m-%d}&end={day + datetime.timedelta(days=7):%Y-%m-%d}",
+        "trips_count_sample": "/api/trips/?limit=100&min_speed=20&passenger_count=1&approx=true",
+        "trip_by_id": f"/api/trips/{first['id']}",
+        "trips_batch_1000": ("/api/trips/batch", {"ids": batch_ids}),
+        "trips_nearby": f"/api/trips/nearby?lat={first['pickup_latitude']}&lon={first['pickup_longitude']}&radius_km=1",
+        "trips_export_csv": "/api/trips/export?format=csv&limit=20000",
+        "insights_stats": "/api/insights/stats",
+        "insights_hourly_pattern": "/api/insights/hourly-pattern",
+        "insights_passenger_distribution": "/api/insights/passenger-distribution",
+        "insights_stats_approx": "/api/insights/stats?approx=true",
+        "insights_hourly_pattern_approx": "/api/insights/hourly-pattern?approx=true",
+        "insights_passenger_distribution_approx": "/api/insights/passenger-distribution?approx=true",
+        "insights_rollup": "/api/insights/rollup?group_by=hour,vendor_id&filter=day_of_week:5|6",
+        "insights_speed_distribution": "/api/insights/speed-distribution",
+        "insights_fare_estimate_1000": ("/api/insights/fare-estimate", {"trips": fare_trips}),
+    }
+
+    def request(url, body=None):
+        # Measure the view itself, not a cached response
+        response_cache.clear()
+        response = client.get(url) if body is None else client.post(url, json=body)
+        body = response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}: {body[:200]!r}")
+        return len(body)
+
+    cases = []
+    for name, endpoint in endpoints.items():
+        url, body = endpoint if isinstance(endpoint, tuple) else (endpoint, None)
+        cases.append((f"{prefix}.{name}", lambda url=url, body=body: request(url, body)))
+    return cases
+
+
+def columnar_api_cases(client, df, work_dir):
+    """The API cases answered from a column store (TRIPS_BACKEND=columnar)"""
+    store_dir = os.path.join(work_dir, "column_store")
+    os.makedirs(store_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        column_store.build_column_store(df.assign(id=df["id"].astype(str)), store_dir)
+
+    def switch(backend):
+        column_store.TRIPS_BACKEND = backend
+        column_store.COLUMN_STORE_DIR = store_dir
+
+    cases = []
+    for case, func in api_cases(client, df, prefix="api_columnar"):
+        def run(func=func):
+            switch("columnar")
+            try:
+                return func()
+            finally:
+                switch("mysql")
+        cases.append((case, run))
+    return cases
+
+# --- Running and comparing ---
+
+def time_case(func, repeat):
+    """Best wall time of `repeat` runs (output of the case is swallowed)"""
+    best = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def load_baseline(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def compare(results, baseline):
+    """[(case, seconds, baseline seconds, ratio, status)]; status is ok, new or REGRESSION"""
+    thresholds = (baseline or {}).get("thresholds", {})
+    base_results = (baseline or {}).get("results", {})
+    rows = []
+    for case, seconds in results.items():
+        base = base_results.get(case)
+        if not base:
+            rows.append((case, seconds, None, None, "new"))
+            continue
+        ratio = seconds / base
+        threshold = thresholds.get(case, thresholds.get("default", DEFAULT_THRESHOLD))
+        rows.append((case, seconds, base, ratio, "REGRESSION" if ratio > threshold else "ok"))
+    return rows
+
+
+def run_benchmarks(rows=100_000, groups=GROUPS, repeat=3, workers=4, seed=42):
+    """Run the selected groups and return {case: seconds}"""
+    work_dir = tempfile.mkdtemp(prefix="trips_bench_")
+    results = {}
+    try:
+        raw_file = os.path.join(work_dir, "raw.csv")
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_trips(rows, raw_file, seed=seed)
+        print(f"Generated {rows:,} synthetic trips in {work_dir}")
+
+        cases = []
+        if "pipeline" in groups:
+            cases += pipeline_cases(raw_file, work_dir, workers)
+
+        if "algorithms" in groups or "api" in groups or "api_columnar" in groups:
+            featured = trip_file(os.path.join(work_dir, "featured_input"))
+            with contextlib.redirect_stdout(io.StringIO()):
+                run_pipeline.clean_and_engineer(raw_file, featured, 0, os.path.join(work_dir, "rejected_input"))
+            df = read_trips(featured)
+            if "algorithms" in groups:
+                cases += algorithm_cases(df)
+            if "api" in groups or "api_columnar" in groups:
+                db_path = os.path.join(work_dir, "standin.sqlite")
+                build_standin_db(db_path, df)
+                client = standin_app(db_path).test_client()
+                if "api" in groups:
+                    cases += api_cases(client, df)
+                if "api_columnar" in groups:
+                    cases += columnar_api_cases(client, df, work_dir)
+
+        for case, func in cases:
+            results[case] = time_case(func, repeat)
+            print(f"  {case:<52} {results[case] * 1000:10.1f} ms")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def print_report(comparison):
+    print(f"\n{'case':<52} {'ms':>10} {'baseline':>10} {'ratio':>7}  status")
+    for case, seconds, base, ratio, status in comparison:
+        base_ms = f"{base * 1000:10.1f}" if base else f"{'-':>10}"
+        ratio_text = f"{ratio:7.2f}" if ratio else f"{'-':>7}"
+        print(f"{case:<52} {seconds * 1000:10.1f} {base_ms} {ratio_text}  {status}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the NYC trips pipeline, algorithms and API")
+    parser.add_argument("--rows", type=int, default=100_000, help="synthetic rows to generate (10k to 50M)")
+    parser.add_argument("--groups", default=",".join(GROUPS),
+                        help=f"comma separated groups to run (default: {','.join(GROUPS)})")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the best time is kept")
+    parser.add_argument("--workers", type=int, default=4, help="processes for the parallel pipeline case")
+    parser.add_argument("--seed", type=int, default=42, help="seed for the synthetic data")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare with / save to")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="store these results as the new baseline (keeps existing thresholds)")
+    args = parser.parse_args()
+
+    groups = [g.strip() for g in args.groups.split(",") if g.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+
+    results = run_benchmarks(args.rows, groups, args.repeat, args.workers, args.seed)
+    baseline = load_baseline(args.baseline)
+
+    if baseline is None:
+        print(f"\nWARNING: no baseline at {args.baseline}; nothing is compared")
+    elif baseline.get("meta", {}).get("rows") != args.rows:
+        print(f"\nWARNING: baseline was recorded with {baseline['meta'].get('rows')} rows, not {args.rows}; "
+              "nothing is compared")
+        baseline = None
+
+    comparison = compare(results, baseline)
+    print_report(comparison)
+
+    if args.save_baseline:
+        stored = load_baseline(args.baseline) or {}
+        same_size = stored.get("meta", {}).get("rows") == args.rows
+        stored = {
+            "meta": {
+                "rows": args.rows,
+                "repeat": args.repeat,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "recorded_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            },
+            "thresholds": stored.get("thresholds", {"default": DEFAULT_THRESHOLD}),
+            "results": {**(stored.get("results", {}) if same_size else {}), **results},
+        }
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif baseline is None:
+        # Without a baseline the regression gate can't pass
+        print("Record one on this machine with --save-baseline (same --rows)")
+        sys.exit(2)
+    else:
+        new = [case for case, *_, status in comparison if status == "new"]
+        if new:
+            print(f"\nWARNING: {len(new)} case(s) not in the baseline, not compared: {', '.join(new)}")
+        if any(status == "REGRESSION" for *_, status in comparison):
+            sys.exit(1)
@@ -1,46 +1,44 @@
 import pandas as pd
 import os
+import sys
 import  numpy as np
+import argparse
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Add parent directory to path for imports
+sys.path.append(BASE_DIR)
+
+from utils.rejections import REJECTS_DIR, RejectionWriter
+from utils.trip_io import TripWriter, trip_file, write_trips
+
 # Paths
 RAW_FILE = os.path.join(BASE_DIR, "data/raw/train.csv")
 CLEANED_DIR = os.path.join(BASE_DIR, "data/cleaned/")
-CLEANED_FILE = os.path.join(CLEANED_DIR, "cleaned_trips.csv")
-LOG_FILE = os.path.join(BASE_DIR, "data/logs/excluded_records.log")
-
-# Create directories if they don't exist
-os.makedirs(CLEANED_DIR, exist_ok=True)
-os.makedirs(os.path.join(BASE_DIR, "data/logs/"), exist_ok=True)
+CLEANED_FILE = trip_file(os.path.join(CLEANED_DIR, "cleaned_trips"))
 
-# Load raw data
-df = pd.read_csv(RAW_FILE)
-log = open(LOG_FILE, "w")
-
-# --- Remove duplicates ---
-duplicates = df[df.duplicated()]
-if not duplicates.empty:
-    log.write("=== Removed duplicate rows ===\n")
-    log.write(duplicates.to_string(index=False) + "\n\n")
-df = df.drop_duplicates()
-
-# --- Remove rows with missing critical columns ---
 critical_cols = [
     "pickup_datetime", "dropoff_datetime",
     "pickup_longitude", "pickup_latitude",
     "dropoff_longitude", "dropoff_latitude",
     "trip_duration"
 ]
-missing_rows = df[df[critical_cols].isnull().any(axis=1)]
-if not missing_rows.empty:
-    log.write("=== Removed rows with missing critical values ===\n")
-    log.write(missing_rows.to_string(index=False) + "\n\n")
-df = df.dropna(subset=critical_cols)
 
-# --- Normalize timestamps ---
-df["pickup_datetime"] = pd.to_datetime(df["pickup_datetime"], errors="coerce")
-df["dropoff_datetime"] = pd.to_datetime(df["dropoff_datetime"], errors="coerce")
+# Fixed dtypes for the raw columns. In chunked mode every chunk must parse
+# the same way, otherwise identical rows would hash differently.
+RAW_DTYPES = {
+    "id": str,
+    "vendor_id": "Int64",
+    "pickup_datetime": str,
+    "dropoff_datetime": str,
+    "passenger_count": "Int64",
+    "pickup_longitude": "float64",
+    "pickup_latitude": "float64",
+    "dropoff_longitude": "float64",
+    "dropoff_latitude": "float64",
+    "store_and_fwd_flag": str,
+    "trip_duration": "Int64",
+}
 
 # ---  Calculate basic trip distance (Haversine) ---
 def haversine(lat1, lon1, lat2, lon2):
@@ -52,15 +50,115 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
     return R * c
 
-df["trip_distance_km"] = haversine(
-    df["pickup_latitude"], df["pickup_longitude"],
-    df["dropoff_latitude"], df["dropoff_longitude"]
-)
+def clean_frame(df, rejects):
+    """Drop rows missing critical values, parse timestamps and add the distance"""
+    # --- Remove rows with missing critical columns ---
+    missing_rows = df[df[critical_cols].isnull().any(axis=1)]
+    rejects.reject(missing_rows, "clean", "missing_critical", critical_cols)
+    # In place, so pandas doesn't treat the result as a copy of the caller's frame
+    df.dropna(subset=critical_cols, inplace=True)
+
+    # --- Normalize timestamps ---
+    df["pickup_datetime"] = pd.to_datetime(df["pickup_datetime"], errors="coerce")
+    df["dropoff_datetime"] = pd.to_datetime(df["dropoff_datetime"], errors="coerce")
+
+    df["trip_distance_km"] = haversine(
+        df["pickup_latitude"], df["pickup_longitude"],
+        df["dropoff_latitude"], df["dropoff_longitude"]
+    )
+    return df
+
+def reject_duplicates(duplicates, rejects):
+    rejects.reject(duplicates, "clean", "duplicate")
+
+def find_fingerprints(seen, fingerprints):
+    """Boolean mask of the `fingerprints` already in the sorted array `seen`"""
+    if not len(seen):
+        return np.zeros(len(fingerprints), dtype=bool)
+    positions = np.searchsorted(seen, fingerprints)
+    positions[positions == len(seen)] = 0
+    return seen[positions] == fingerprints
+
+def add_fingerprints(seen, fingerprints):
+    """
+    Merge `fingerprints` into the sorted array `seen`. Only the new ones are
+    sorted and inserted in place, so the cost per chunk is one copy of
+    `seen` rather than a re-sort of it.
+    """
+    new = np.unique(fingerprints)
+    new = new[~find_fingerprints(seen, new)]
+    return np.insert(seen, np.searchsorted(seen, new), new)
+
+def iter_cleaned_chunks(raw_file, chunksize, rejects):
+    """
+    Stream the raw file `chunksize` rows at a time and yield cleaned chunks,
+    keeping memory bounded regardless of input size.
+    """
+    # Duplicates are detected across chunks with 64-bit row fingerprints,
+    # kept in a sorted array (8 bytes per unique row instead of the row itself)
+    header = pd.read_csv(raw_file, nrows=0).columns
+    dtypes = {col: RAW_DTYPES.get(col, str) for col in header}
+    seen = np.empty(0, dtype=np.uint64)
+    rows_read = 0
+
+    for chunk in pd.read_csv(raw_file, dtype=dtypes, chunksize=chunksize):
+        rows_read += len(chunk)
+
+        fingerprints = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        is_duplicate = find_fingerprints(seen, fingerprints) | pd.Series(fingerprints).duplicated().to_numpy()
+
+        reject_duplicates(chunk[is_duplicate], rejects)
+        chunk = chunk[~is_duplicate].copy()
+        seen = add_fingerprints(seen, fingerprints[~is_duplicate])
+
+        yield clean_frame(chunk, rejects)
+
+    if rows_read == 0:
+        yield clean_frame(pd.DataFrame({col: pd.Series(dtype=RAW_DTYPES.get(col, str)) for col in header}), rejects)
+
+def load_cleaned(raw_file, rejects):
+    """Load the whole raw file and return it cleaned"""
+    # Load raw data
+    df = pd.read_csv(raw_file)
+
+    # --- Remove duplicates ---
+    reject_duplicates(df[df.duplicated()], rejects)
+    df = df.drop_duplicates()
+
+    return clean_frame(df, rejects)
+
+def print_peak_memory():
+    try:
+        import resource
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"Peak memory: {peak_mb:.0f} MB")
+    except ImportError:
+        pass
+
+def clean_trips(raw_file=RAW_FILE, output_file=CLEANED_FILE, chunksize=0, rejects_dir=REJECTS_DIR):
+    """Clean the raw trips file into the cleaned intermediate file"""
+    # Create directories if they don't exist
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-# Save cleaned data
-df.to_csv(CLEANED_FILE, index=False)
-log.close()
+    with RejectionWriter(["clean"], rejects_dir) as rejects:
+        if chunksize > 0:
+            # --- Streaming mode: bounded memory, one chunk at a time ---
+            with TripWriter(output_file) as writer:
+                for i, chunk in enumerate(iter_cleaned_chunks(raw_file, chunksize, rejects)):
+                    writer.write(chunk)
+                    print(f"Chunk {i+1}: {writer.rows} rows written")
+            print_peak_memory()
+        else:
+            # Save cleaned data
+            write_trips(load_cleaned(raw_file, rejects), output_file)
 
-print(f"Data cleaning done. Cleaned file saved to {CLEANED_FILE}")
-print(f"Excluded rows are logged in {LOG_FILE}")
+    print(f"Data cleaning done. Cleaned file saved to {output_file}")
+    rejects.print_summary()
+    return output_file
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean the raw NYC taxi trips file")
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help="process the raw file in chunks of this many rows (0 = load it all at once)")
+    args = parser.parse_args()
+    clean_trips(chunksize=args.chunksize)
@@ -1,70 +1,113 @@
 import pandas as pd
 import os
+import sys
 import numpy as np
+import argparse
+import time
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Add parent directory to path for imports
+sys.path.append(BASE_DIR)
+
+from utils.custom_algorithm import estimate_trip_fares
+from utils.geo_grid import cell_id
+from utils.rejections import REJECTS_DIR, RejectionWriter
+from utils.trip_io import find_trip_file, read_trips, trip_file, write_trips
+
 # Paths
-CLEANED_FILE = os.path.join(BASE_DIR, "data/cleaned/cleaned_trips.csv")
+CLEANED_FILE = find_trip_file(os.path.join(BASE_DIR, "data/cleaned/cleaned_trips"))
 FEATURED_DIR = os.path.join(BASE_DIR, "data/cleaned/")
-FEATURED_FILE = os.path.join(FEATURED_DIR, "featured_trips.csv")
-LOG_FILE = os.path.join(BASE_DIR, "data/logs/excluded_records.log")
-
-# Create log directory if it doesn't exist
-os.makedirs(os.path.join(BASE_DIR, "data/logs/"), exist_ok=True)
-
-# Load cleaned data
-df = pd.read_csv(CLEANED_FILE)
-
-# Open log file
-log = open(LOG_FILE, "a")
-
-#  Derived features
-# Trip duration in minutes (if not already)
-if "trip_duration_min" not in df.columns:
-    # coerce to numeric first so missing/invalid values become NaN (not Python None)
-    df["trip_duration_min"] = pd.to_numeric(df["trip_duration"], errors="coerce") / 60
-
-# Speed in km/h
-if "speed_kmh" not in df.columns:
-    # Ensure numeric types and avoid division by zero or None
-    df["trip_distance_km"] = pd.to_numeric(df["trip_distance_km"], errors="coerce")
-    duration_hours = pd.to_numeric(df["trip_duration_min"], errors="coerce") / 60
-    # replace zero durations with NaN to avoid inf values
-    duration_hours = duration_hours.replace(0, np.nan)
-    df["speed_kmh"] = df["trip_distance_km"] / duration_hours
-
-# Fare per km (if fare_amount column exists)
-if "fare_amount" in df.columns:
-    # coerce to numeric so invalid values become NaN instead of Python None
-    df["fare_per_km"] = pd.to_numeric(df["fare_amount"], errors="coerce") / pd.to_numeric(df["trip_distance_km"], errors="coerce")
-else:
-    # use np.nan for missing numeric columns so comparisons like <= 0 work safely
-    df["fare_per_km"] = np.nan
-# Remove unrealistic values
-invalid_rows = pd.DataFrame()
-
-if "speed_kmh" in df.columns:
-    invalid_speed = df[(df["speed_kmh"] <= 0) | (df["speed_kmh"] > 150)]
-    if not invalid_speed.empty:
-        log.write("=== Removed rows with unrealistic speeds ===\n")
-        log.write(invalid_speed.to_string(index=False) + "\n\n")
-        invalid_rows = pd.concat([invalid_rows, invalid_speed])
-
-if "fare_per_km" in df.columns:
-    invalid_fare = df[df["fare_per_km"] <= 0]
-    if not invalid_fare.empty:
-        log.write("=== Removed rows with invalid fare/km ===\n")
-        log.write(invalid_fare.to_string(index=False) + "\n\n")
-        invalid_rows = pd.concat([invalid_rows, invalid_fare])
-
-# Drop invalid rows
-df = df.drop(index=invalid_rows.index)
-
-# Save featured data
-df.to_csv(FEATURED_FILE, index=False)
-log.close()
-
-print(f"Feature engineering done. Featured file saved to {FEATURED_FILE}")
-print(f"Excluded rows are logged in {LOG_FILE}")
+FEATURED_FILE = trip_file(os.path.join(FEATURED_DIR, "featured_trips"))
+
+def add_features(df, rejects):
+    """Add derived features to a cleaned frame and drop unrealistic trips"""
+    #  Derived features
+    # Trip duration in minutes (if not already)
+    if "trip_duration_min" not in df.columns:
+        # coerce to numeric first so missing/invalid values become NaN (not Python None)
+        df["trip_duration_min"] = pd.to_numeric(df["trip_duration"], errors="coerce").astype("float64") / 60
+
+    # Speed in km/h
+    if "speed_kmh" not in df.columns:
+        # Ensure numeric types and avoid division by zero or None
+        df["trip_distance_km"] = pd.to_numeric(df["trip_distance_km"], errors="coerce")
+        duration_hours = pd.to_numeric(df["trip_duration_min"], errors="coerce") / 60
+        # replace zero durations with NaN to avoid inf values
+        duration_hours = duration_hours.replace(0, np.nan)
+        df["speed_kmh"] = df["trip_distance_km"] / duration_hours
+
+    # Fare per km (if fare_amount column exists)
+    if "fare_amount" in df.columns:
+        # coerce to numeric so invalid values become NaN instead of Python None
+        df["fare_per_km"] = pd.to_numeric(df["fare_amount"], errors="coerce") / pd.to_numeric(df["trip_distance_km"], errors="coerce")
+    else:
+        # use np.nan for missing numeric columns so comparisons like <= 0 work safely
+        df["fare_per_km"] = np.nan
+
+    add_estimated_fare(df)
+
+    # Grid cells for the spatial index used by /api/trips/nearby
+    for end in ("pickup", "dropoff"):
+        cells = cell_id(df[f"{end}_latitude"], df[f"{end}_longitude"])
+        df[f"{end}_cell"] = pd.Series(cells, index=df.index).where(cells >= 0).astype("Int32")
+
+    # Remove unrealistic values
+    invalid_rows = pd.DataFrame()
+
+    if "speed_kmh" in df.columns:
+        invalid_speed = df[(df["speed_kmh"] <= 0) | (df["speed_kmh"] > 150)]
+        if not invalid_speed.empty:
+            rejects.reject(invalid_speed, "features", "unrealistic_speed")
+            invalid_rows = pd.concat([invalid_rows, invalid_speed])
+
+    if "fare_per_km" in df.columns:
+        invalid_fare = df[df["fare_per_km"] <= 0]
+        if not invalid_fare.empty:
+            rejects.reject(invalid_fare, "features", "invalid_fare_per_km")
+            invalid_rows = pd.concat([invalid_rows, invalid_fare])
+
+    # Drop invalid rows
+    return df.drop(index=invalid_rows.index)
+
+def add_estimated_fare(df):
+    """estimate_trip_fare for every trip, as one vectorized pass (NaN where distance or duration is missing)"""
+    passengers = df["passenger_count"] if "passenger_count" in df.columns else None
+    df["estimated_fare"] = estimate_trip_fares(df["trip_distance_km"], df["trip_duration_min"], passengers)
+    return df
+
+def backfill_fares(path=None):
+    """Add (or recompute) estimated_fare in an existing featured file, leaving the other columns as they are"""
+    # The featured file that exists, which may be in the other format (e.g. the CSV shipped in the repo)
+    path = path or find_trip_file(os.path.join(FEATURED_DIR, "featured_trips"))
+    started = time.perf_counter()
+    df = read_trips(path)
+    add_estimated_fare(df)
+    write_trips(df, path)
+    print(f"Estimated fares for {len(df):,} trips in {time.perf_counter() - started:.1f}s, saved to {path}")
+    return path
+
+def engineer_features(input_file=CLEANED_FILE, output_file=FEATURED_FILE, rejects_dir=REJECTS_DIR):
+    """Read the cleaned trips, add features and write the featured file"""
+    # Load cleaned data
+    df = read_trips(input_file)
+
+    with RejectionWriter(["features"], rejects_dir) as rejects:
+        df = add_features(df, rejects)
+
+    # Save featured data
+    write_trips(df, output_file)
+
+    print(f"Feature engineering done. Featured file saved to {output_file}")
+    rejects.print_summary()
+    return output_file
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add derived features to the cleaned trips")
+    parser.add_argument("--backfill-fares", action="store_true",
+                        help="only add estimated_fare to the existing featured file")
+    args = parser.parse_args()
+    if args.backfill_fares:
+        backfill_fares()
+    else:
+        engineer_features()
@@ -0,0 +1,175 @@
+"""
+Generate a synthetic NYC taxi trips file in the raw train.csv format
+
+Trips start around Manhattan, Brooklyn, Queens and the airports, follow a
+weekday/weekend diurnal profile, and have lognormal distances and speeds.
+Exact duplicate rows and bad rows (missing critical values, impossible
+speeds) are mixed in at configurable rates, so every pipeline stage has
+real work to do. Output is written in chunks, so 50M rows need no more
+memory than 1M, and the same seed always gives the same file.
+
+    python scripts/generate_trips.py --rows 1000000 --output data/raw/synthetic.csv
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_OUTPUT = os.path.join(BASE_DIR, "data/raw/synthetic_trips.csv")
+
+RAW_COLUMNS = [
+    "id", "vendor_id", "pickup_datetime", "dropoff_datetime", "passenger_count",
+    "pickup_longitude", "pickup_latitude", "dropoff_longitude", "dropoff_latitude",
+    "store_and_fwd_flag", "trip_duration"
+]
+
+# NYC bounding box
+MIN_LAT, MAX_LAT = 40.49, 40.92
+MIN_LON, MAX_LON = -74.27, -73.68
+
+# Pickup hotspots: (lat, lon, spread in degrees, weight)
+HOTSPOTS = [
+    (40.758, -73.985, 0.012, 0.35),  # Midtown
+    (40.722, -73.997, 0.012, 0.20),  # Lower Manhattan
+    (40.780, -73.960, 0.012, 0.15),  # Upper East/West Side
+    (40.690, -73.960, 0.025, 0.10),  # Brooklyn
+    (40.745, -73.900, 0.030, 0.08),  # Queens
+    (40.645, -73.785, 0.006, 0.07),  # JFK
+    (40.774, -73.872, 0.004, 0.05),  # LaGuardia
+]
+
+# Relative pickup volume by hour of day
+WEEKDAY_PROFILE = np.array([
+    2.0, 1.3, 0.9, 0.6, 0.5, 0.7, 1.6, 3.0, 4.0, 4.1, 3.8, 3.9,
+    4.0, 4.0, 4.2, 4.1, 3.8, 4.3, 5.2, 5.5, 5.0, 4.8, 4.3, 3.1,
+])
+WEEKEND_PROFILE = np.array([
+    4.2, 3.8, 3.2, 2.4, 1.5, 0.8, 0.7, 1.0, 1.6, 2.4, 3.2, 3.7,
+    4.0, 4.0, 4.0, 3.9, 3.8, 3.9, 4.1, 4.2, 4.0, 4.1, 4.3, 4.4,
+])
+
+PASSENGER_COUNTS = np.array([0, 1, 2, 3, 4, 5, 6])
+PASSENGER_WEIGHTS = np.array([0.001, 0.709, 0.144, 0.041, 0.019, 0.053, 0.033])
+
+CHUNK_ROWS = 1_000_000
+
+
+def _hour_weights(start_date, days):
+    """Probability of each hour slot (days * 24) following the diurnal profiles"""
+    dates = pd.date_range(start_date, periods=days, freq="D")
+    weights = np.concatenate([
+        WEEKEND_PROFILE if date.dayofweek >= 5 else WEEKDAY_PROFILE for date in dates
+    ])
+    return weights / weights.sum()
+
+
+def _clip_lat(lat):
+    return np.clip(lat, MIN_LAT, MAX_LAT)
+
+
+def _clip_lon(lon):
+    return np.clip(lon, MIN_LON, MAX_LON)
+
+
+def generate_chunk(rng, first_id, rows, start, hour_weights, duplicate_rate, bad_rate):
+    """One chunk of synthetic raw trips with ids first_id.. (plus duplicates)"""
+    unique_rows = rows - int(rows * duplicate_rate)
+
+    # Pickup time: an hour slot drawn from the profile, then a uniform second in it
+    slots = rng.choice(len(hour_weights), size=unique_rows, p=hour_weights)
+    pickup = start + pd.to_timedelta(slots * 3600 + rng.integers(0, 3600, unique_rows), unit="s")
+
+    # Pickup location around a hotspot
+    spots = rng.choice(len(HOTSPOTS), size=unique_rows, p=[h[3] for h in HOTSPOTS])
+    centers = np.array([h[:3] for h in HOTSPOTS])[spots]
+    pickup_lat = _clip_lat(centers[:, 0] + rng.normal(0, 1, unique_rows) * centers[:, 2])
+    pickup_lon = _clip_lon(centers[:, 1] + rng.normal(0, 1, unique_rows) * centers[:, 2] * 1.3)
+
+    # Straight-line distance and direction to the dropoff
+    distance_km = np.clip(rng.lognormal(np.log(2.5), 0.75, unique_rows), 0.05, 60)
+    bearing = rng.uniform(0, 2 * np.pi, unique_rows)
+    dropoff_lat = _clip_lat(pickup_lat + distance_km * np.cos(bearing) / 111.32)
+    dropoff_lon = _clip_lon(pickup_lon + distance_km * np.sin(bearing) / (111.32 * np.cos(np.radians(pickup_lat))))
+
+    # Speed is lower at rush hour; road distance ~1.3x the straight line
+    hours = pickup.hour.to_numpy()
+    rush = np.isin(hours, [8, 9, 17, 18, 19])
+    speed_kmh = np.clip(rng.lognormal(np.log(np.where(rush, 12, 17)), 0.35), 2, 90)
+    duration = np.maximum(30, (distance_km * 1.3 / speed_kmh * 3600).round()).astype(np.int64)
+
+    df = pd.DataFrame({
+        "id": [f"id{n:08d}" for n in range(first_id, first_id + unique_rows)],
+        "vendor_id": rng.choice([1, 2], size=unique_rows, p=[0.47, 0.53]),
+        "pickup_datetime": pickup.strftime("%Y-%m-%d %H:%M:%S"),
+        "dropoff_datetime": (pickup + pd.to_timedelta(duration, unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "passenger_count": rng.choice(PASSENGER_COUNTS, size=unique_rows, p=PASSENGER_WEIGHTS),
+        "pickup_longitude": pickup_lon.round(6),
+        "pickup_latitude": pickup_lat.round(6),
+        "dropoff_longitude": dropoff_lon.round(6),
+        "dropoff_latitude": dropoff_lat.round(6),
+        "store_and_fwd_flag": np.where(rng.random(unique_rows) < 0.005, "Y", "N"),
+        "trip_duration": duration,
+    })
+
+    # Bad rows: half lose a critical value, half get an impossible speed
+    bad = np.flatnonzero(rng.random(unique_rows) < bad_rate)
+    missing, too_fast = bad[: len(bad) // 2], bad[len(bad) // 2:]
+    critical = ["pickup_datetime", "dropoff_latitude", "pickup_longitude", "trip_duration"]
+    for col, rows_ in zip(critical, np.array_split(missing, len(critical))):
+        df[col] = df[col].astype(object)
+        df.loc[rows_, col] = None
+    df.loc[too_fast, "trip_duration"] = 1
+
+    # Exact copies of rows from this chunk, placed after the originals
+    if rows > unique_rows:
+        copies = df.iloc[rng.integers(0, unique_rows, rows - unique_rows)]
+        df = pd.concat([df, copies], ignore_index=True)
+
+    return df, unique_rows
+
+
+def generate_trips(rows, output_file=DEFAULT_OUTPUT, seed=42, start_date="2016-01-01", days=182,
+                   duplicate_rate=0.001, bad_rate=0.002, chunk_rows=CHUNK_ROWS):
+    """Write `rows` synthetic trips to `output_file` and return the path"""
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    start = pd.Timestamp(start_date)
+    hour_weights = _hour_weights(start, days)
+
+    started = time.perf_counter()
+    written = 0
+    next_id = 0
+    chunk_no = 0
+    with open(output_file, "w", newline="") as f:
+        while written < rows:
+            # Seeded per chunk, so a file's prefix doesn't depend on its total size
+            rng = np.random.default_rng([seed, chunk_no])
+            size = min(chunk_rows, rows - written)
+            df, unique_rows = generate_chunk(rng, next_id, size, start, hour_weights, duplicate_rate, bad_rate)
+            df.to_csv(f, index=False, header=chunk_no == 0, columns=RAW_COLUMNS)
+            written += len(df)
+            next_id += unique_rows
+            chunk_no += 1
+            if rows > chunk_rows:
+                print(f"{written:,} / {rows:,} rows")
+
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {written:,} trips to {output_file} in {elapsed:.1f}s")
+    return output_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic NYC taxi trips")
+    parser.add_argument("--rows", type=int, default=100_000, help="number of rows, duplicates included")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="CSV file to write")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--start-date", default="2016-01-01", help="first pickup date")
+    parser.add_argument("--days", type=int, default=182, help="number of days of pickups")
+    parser.add_argument("--duplicate-rate", type=float, default=0.001, help="fraction of exact duplicate rows")
+    parser.add_argument("--bad-rate", type=float, default=0.002,
+                        help="fraction of rows with a missing critical value or an impossible speed")
+    args = parser.parse_args()
+    generate_trips(args.rows, args.output, args.seed, args.start_date, args.days,
+                   args.duplicate_rate, args.bad_rate)
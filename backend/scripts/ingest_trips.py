@@ -0,0 +1,264 @@
+"""
+Incremental ingestion of new raw trip files
+
+Raw CSV files (given on the command line, or every *.csv in
+data/raw/incoming/) are checked against data/ingest_manifest.json, which
+records how far each file was ingested: bytes, rows and a hash of the first
+and last block of that part. Only the delta is processed:
+
+- a new file is read in full
+- a file that grew is read from the recorded offset on
+- a file whose ingested part changed is ingested again from the start
+- an unchanged file is skipped
+
+The delta is cleaned and feature-engineered with the pipeline's own code,
+then upserted into trips with bulk INSERT ... ON DUPLICATE KEY UPDATE, so
+rows seen before update their trip instead of failing. trip_summary and
+trip_rollup are corrected for the trips an upsert replaced. When a column
+store has been built, the loaded trips are upserted into a new version of it
+as well, so TRIPS_BACKEND=columnar serves the same trips as MySQL. A file is
+only read up to its last complete line, so a file still being written is
+picked up where it stopped on the next run.
+
+    python scripts/ingest_trips.py data/raw/incoming/2016-07-01.csv
+    python scripts/ingest_trips.py                     # everything new in data/raw/incoming/
+    python scripts/ingest_trips.py --dry-run
+    python scripts/ingest_trips.py --mark-ingested data/raw/train.csv
+"""
+import argparse
+import datetime
+import glob
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+import pandas as pd
+from mysql.connector import Error
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPTS_DIR)
+sys.path.append(BASE_DIR)
+
+import data_cleaning
+import feature_engineering
+from config.db_config import get_db_config
+from insert_data import (
+    DEFAULT_BATCH_SIZE, TRIP_COLUMNS, add_key_column, clear_checkpoints, get_load_id, latest_versions, load_trips
+)
+from utils.column_store import TRIPS_BACKEND, update_column_store
+from utils.dataset_version import bump_dataset_version
+from utils.rejections import REJECTS_DIR, RejectionWriter
+
+MANIFEST_FILE = os.path.join(BASE_DIR, "data/ingest_manifest.json")
+INCOMING_DIR = os.path.join(BASE_DIR, "data/raw/incoming")
+
+# Bytes hashed at each end of the ingested part of a file
+SIGNATURE_BLOCK = 1 << 20
+DEFAULT_CHUNKSIZE = 500000
+
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}}
+
+def save_manifest(manifest):
+    tmp_file = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+def _sha256(f, start, end):
+    f.seek(start)
+    return hashlib.sha256(f.read(end - start)).hexdigest()
+
+def part_signature(path, end):
+    """Hashes of the first and last SIGNATURE_BLOCK bytes of path[:end]"""
+    with open(path, "rb") as f:
+        return {"head": _sha256(f, 0, min(end, SIGNATURE_BLOCK)),
+                "tail": _sha256(f, max(0, end - SIGNATURE_BLOCK), end)}
+
+def header_end(path):
+    """Offset of the first data row"""
+    with open(path, "rb") as f:
+        f.readline()
+        return f.tell()
+
+def data_end(path):
+    """Offset just past the last complete line (a writer may still be appending the next one)"""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(SIGNATURE_BLOCK, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+    return 0
+
+def count_rows(path, start, end):
+    count = 0
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(SIGNATURE_BLOCK, remaining))
+            count += block.count(b"\n")
+            remaining -= len(block)
+    return count
+
+def plan_delta(path, record):
+    """(start offset, rows before it, end offset, reason) of the part of `path` not ingested yet"""
+    start, end = header_end(path), data_end(path)
+    if not record:
+        return start, 0, end, "new"
+    done = record["bytes"]
+    if done <= end and record["signature"] == part_signature(path, done):
+        return done, record["rows"], end, "unchanged" if done == end else "appended"
+    return start, 0, end, "rewritten"
+
+def read_delta(path, start, end, chunksize):
+    """Raw rows in path[start:end] as chunks, typed like data_cleaning reads them"""
+    header = pd.read_csv(path, nrows=0).columns
+    dtypes = {col: data_cleaning.RAW_DTYPES.get(col, str) for col in header}
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return pd.read_csv(io.BytesIO(data), header=None, names=list(header), dtype=dtypes, chunksize=chunksize)
+
+def featured_delta(path, start, end, chunksize, rejects):
+    """Clean and feature-engineer path[start:end]; returns (featured frame, raw rows read)"""
+    frames, rows_read = [], 0
+    for chunk in read_delta(path, start, end, chunksize):
+        rows_read += len(chunk)
+        duplicated = chunk.duplicated()
+        data_cleaning.reject_duplicates(chunk[duplicated], rejects)
+        chunk = data_cleaning.clean_frame(chunk[~duplicated].copy(), rejects)
+        chunk = feature_engineering.add_features(chunk, rejects)
+        frames.append(chunk[TRIP_COLUMNS])
+    df = pd.concat(frames, ignore_index=True)
+    df['id'] = df['id'].astype(str)
+    return df, rows_read
+
+def ingest_file(path, manifest, db_config, batch_size=DEFAULT_BATCH_SIZE, workers=1,
+                chunksize=DEFAULT_CHUNKSIZE, dry_run=False):
+    """
+    Ingest what is new in one raw file. Returns (trips now loaded from it or
+    None, every row loaded); a file with rows that failed is not advanced in
+    the manifest.
+    """
+    key = os.path.abspath(path)
+    name = os.path.basename(path)
+    start, first_row, end, reason = plan_delta(path, manifest["files"].get(key))
+    if reason == "unchanged" or end <= start:
+        print(f"{name}: nothing new")
+        return None, True
+    print(f"{name}: {reason}, {end - start:,} bytes to ingest from row {first_row + 1:,}")
+    if dry_run:
+        return None, True
+
+    started = time.perf_counter()
+    rejects_dir = os.path.join(REJECTS_DIR, "ingest", f"{os.path.splitext(name)[0]}_{first_row}")
+    with RejectionWriter(["clean", "features"], rejects_dir) as rejects:
+        df, rows_read = featured_delta(path, start, end, chunksize, rejects)
+    df = latest_versions(add_key_column(df))
+
+    # A part corrected in place keeps its byte range, so the load id also
+    # covers its content; otherwise its checkpoints would skip the correction
+    signature = part_signature(path, end)
+    load_id = get_load_id(path, batch_size, (start, end), signature)
+    loader, loaded = None, None
+    if len(df):
+        loader = load_trips(db_config, df, load_id, batch_size, workers, upsert=True)
+        # All of it, when an earlier run already loaded every batch
+        loaded = df if loader is None else df.drop(df.index[loader.failed_rows])
+
+    if loader is not None and loader.error_count:
+        # The failed rows' batches are checkpointed too; forget them, so the
+        # next run upserts the whole part again (rows that did load are
+        # upserted to the same values)
+        clear_checkpoints(db_config, load_id)
+        print(f"{name}: {loader.error_count} rows failed to load; the file stays at row {first_row:,} "
+              f"and this part is ingested again on the next run")
+        return loaded, False
+
+    manifest["files"][key] = {
+        "bytes": end,
+        "rows": first_row + rows_read,
+        "signature": signature,
+        "ingested_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    save_manifest(manifest)
+    print(f"{name}: rows {first_row + 1:,}-{first_row + rows_read:,} read, {rejects.total} rejected, "
+          f"{loader.success_count if loader else 0} loaded "
+          f"({loader.updated_count if loader else 0} updates) in {time.perf_counter() - started:.1f}s")
+    return loaded, True
+
+def refresh_column_store(frames):
+    """Upsert the ingested trips into the column store, when one has been built"""
+    path = update_column_store(pd.concat(frames, ignore_index=True))
+    if path is None and TRIPS_BACKEND == "columnar":
+        print("WARNING: TRIPS_BACKEND=columnar but no column store has been built; "
+              "write one with scripts/insert_data.py --column-store-only")
+
+def mark_ingested(paths, manifest):
+    """Record files as fully ingested without loading them (e.g. loaded by the full pipeline)"""
+    for path in paths:
+        start, end = header_end(path), data_end(path)
+        rows = count_rows(path, start, end)
+        manifest["files"][os.path.abspath(path)] = {
+            "bytes": end,
+            "rows": rows,
+            "signature": part_signature(path, end),
+            "ingested_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        print(f"{os.path.basename(path)}: marked as ingested up to row {rows:,}")
+    save_manifest(manifest)
+
+def ingest(paths, batch_size=DEFAULT_BATCH_SIZE, workers=1, chunksize=DEFAULT_CHUNKSIZE, dry_run=False):
+    manifest = load_manifest()
+    db_config = None if dry_run else get_db_config()
+    loaded, complete = [], True
+    try:
+        for path in paths:
+            trips, file_complete = ingest_file(path, manifest, db_config, batch_size, workers, chunksize, dry_run)
+            if trips is not None:
+                loaded.append(trips)
+            complete = complete and file_complete
+    except Error as e:
+        print("Error while loading into MySQL:", e)
+        return False
+    finally:
+        if loaded:
+            # Both backends have to answer the same before the new version is announced
+            refresh_column_store(loaded)
+            # Invalidate cached API responses and ETags
+            print(f"Dataset version is now {bump_dataset_version()}")
+    return complete
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest new rows of raw trip files into MySQL")
+    parser.add_argument("files", nargs="*",
+                        help=f"raw CSV files (default: every *.csv in {os.path.relpath(INCOMING_DIR, BASE_DIR)})")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows per upsert batch (one transaction and checkpoint each)")
+    parser.add_argument("--workers", type=int, default=1, help="number of parallel loader connections")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="raw rows cleaned and feature-engineered at a time")
+    parser.add_argument("--dry-run", action="store_true", help="only show what each file has to ingest")
+    parser.add_argument("--mark-ingested", action="store_true",
+                        help="record the files as already ingested, without loading anything")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(INCOMING_DIR, "*.csv")))
+    if not files:
+        print(f"No files to ingest in {INCOMING_DIR}")
+    elif args.mark_ingested:
+        mark_ingested(files, load_manifest())
+    else:
+        sys.exit(0 if ingest(files, args.batch_size, args.workers, args.chunksize, args.dry_run) else 1)
@@ -1,168 +1,681 @@
-import pandas as pd
 import mysql.connector
 from mysql.connector import Error
+import argparse
+import hashlib
 import os
-import numpy as np
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
 
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.db_config import get_db_config
+from utils.column_store import build_column_store
+from utils.dataset_version import bump_dataset_version
+from utils.geo_grid import cell_id_sql
+from utils.partitions import (
+    FIRST_MONTH, LAST_MONTH, ensure_month_partitions, get_partitions, month_start, partition_clause
+)
+from utils.trip_io import find_trip_file, read_trips, to_python_objects
+from utils.trip_keys import KEY_COLUMN, trip_key_sql, trip_keys
+from utils.trips_schema import TRIPS_SCHEMA, create_table_query, table_indexes
+from utils.trip_rollup import CREATE_ROLLUP_TABLE, rebuild_trip_rollup, update_trip_rollup
+from utils.trip_sample import create_trip_sample, rebuild_trip_sample, update_trip_sample
+from utils.trip_summary import CREATE_SUMMARY_TABLE, SUMMARY_MEASURES, rebuild_trip_summary, update_trip_summary
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-FEATURED_FILE = os.path.join(BASE_DIR, "data/cleaned/featured_trips.csv")
+FEATURED_FILE = find_trip_file(os.path.join(BASE_DIR, "data/cleaned/featured_trips"))
 
-def insert_trips():
-    print(f"Loading data from {FEATURED_FILE}")
-    
-    # Load CSV
-    df = pd.read_csv(FEATURED_FILE)
-    print(f"Loaded {len(df)} rows from CSV")
-    
-    # Properly handle NaN values - this is the key fix
-    df = df.replace({np.nan: None})
-    
-    # Ensure string columns are proper strings, but leave None values as None
-    for col in df.select_dtypes(include=['object']).columns:
-        df[col] = df[col].apply(lambda x: str(x) if x is not None else None)
-
-    # Ensure 'id' is string if your table uses VARCHAR
-    df['id'] = df['id'].astype(str)
+# Columns read from the featured trips file
+TRIP_COLUMNS = [
+    "id", "vendor_id", "pickup_datetime", "dropoff_datetime", "passenger_count",
+    "pickup_longitude", "pickup_latitude", "dropoff_longitude", "dropoff_latitude",
+    "store_and_fwd_flag", "trip_duration", "trip_distance_km", "trip_duration_min",
+    "speed_kmh", "fare_per_km", "pickup_cell", "dropoff_cell"
+]
 
-    try:
-        # Get database config
-        db_config = get_db_config()
-        
-        # Connect to MySQL server (without specifying database initially)
-        conn = mysql.connector.connect(
-            host=db_config['host'],
-            user=db_config['user'],
-            password=db_config['password']
-        )
-        if conn.is_connected():
-            print("Connected to MySQL server")
+# Columns loaded into the trips table, in INSERT order (TRIP_KEYS=compact adds trip_key)
+INSERT_COLUMNS = TRIP_COLUMNS + (["trip_key"] if KEY_COLUMN == "trip_key" else [])
+
+# Secondary indexes of the TRIPS_SCHEMA layout, dropped and rebuilt with --drop-indexes
+SECONDARY_INDEXES = table_indexes()
+
+# Indexes from older schemas that the ones above replace
+OBSOLETE_INDEXES = ["idx_passenger_count"]
+
+DEFAULT_BATCH_SIZE = 20000
+
+# Failing batches are split in half until they are this small,
+# then retried row by row to isolate the bad rows
+MIN_SPLIT_SIZE = 50
+
+CREATE_TABLE_QUERY = create_table_query()
+
+# Batches already committed for a given input, so an interrupted load can resume
+CREATE_CHECKPOINT_TABLE = """
+CREATE TABLE IF NOT EXISTS load_checkpoints (
+    load_id CHAR(40) NOT NULL,
+    batch_no INT NOT NULL,
+    rows_loaded INT NOT NULL,
+    loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (load_id, batch_no)
+)
+"""
+
+INSERT_QUERY = f"""
+INSERT INTO trips ({", ".join(INSERT_COLUMNS)})
+VALUES ({", ".join(["%s"] * len(INSERT_COLUMNS))})
+"""
 
+# Same, but a trip already in the table (same primary key) is updated instead of failing the batch
+UPSERT_QUERY = INSERT_QUERY + f"""ON DUPLICATE KEY UPDATE {", ".join(
+    f"{col} = VALUES({col})" for col in INSERT_COLUMNS if col not in (KEY_COLUMN, "pickup_datetime"))}
+"""
+
+# Keys per lookup of the trips an upsert batch replaces
+UPSERT_LOOKUP_SIZE = 1000
+
+# Deadlock and lock wait timeout: the batch's transaction is rolled back and run again
+RETRYABLE_ERRORS = (1213, 1205)
+BATCH_RETRIES = 3
+
+LOAD_DATA_QUERY = f"""
+LOAD DATA LOCAL INFILE %s INTO TABLE trips
+FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+LINES TERMINATED BY '\\n'
+({", ".join(INSERT_COLUMNS)})
+"""
+
+def get_load_id(path, batch_size, byte_range=None, signature=None):
+    """
+    Identify a load by its input file and batch layout. With `byte_range`
+    (start, end) it identifies that part of the file, however the rest of
+    the file changes; `signature` (a hash of the part's content) tells a
+    part rewritten in place at the same length from the earlier one.
+    """
+    if byte_range is not None:
+        key = f"{os.path.abspath(path)}|{byte_range[0]}-{byte_range[1]}|{batch_size}"
+        if signature is not None:
+            key += f"|{signature['head']}|{signature['tail']}"
+        return hashlib.sha1(key.encode()).hexdigest()
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{batch_size}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def connect(db_config, use_database=True):
+    config = dict(db_config)
+    if not use_database:
+        config.pop('database', None)
+    return mysql.connector.connect(**config, allow_local_infile=True)
+
+def prepare_database(db_config, last_pickup=None):
+    """
+    Create the database and the tables the loader writes to, and make sure
+    trips has a monthly partition for every month up to `last_pickup`
+    """
+    conn = connect(db_config, use_database=False)
+    print("Connected to MySQL server")
+    try:
         cursor = conn.cursor()
-        
-        # Create database if it doesn't exist
         cursor.execute(f"CREATE DATABASE IF NOT EXISTS {db_config['database']}")
         cursor.execute(f"USE {db_config['database']}")
         print(f"Using database {db_config['database']}")
-        
-        # Create table if it doesn't exist
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS trips (
-            id VARCHAR(255) PRIMARY KEY,
-            vendor_id VARCHAR(50),
-            pickup_datetime DATETIME,
-            dropoff_datetime DATETIME,
-            passenger_count INT,
-            pickup_longitude DOUBLE,
-            pickup_latitude DOUBLE,
-            dropoff_longitude DOUBLE,
-            dropoff_latitude DOUBLE,
-            store_and_fwd_flag VARCHAR(10),
-            trip_duration INT,
-            trip_distance_km DOUBLE,
-            trip_duration_min DOUBLE,
-            speed_kmh DOUBLE,
-            fare_per_km DOUBLE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-        cursor.execute(create_table_query)
+
+        cursor.execute(CREATE_TABLE_QUERY)
+        add_cell_columns(cursor)
+        check_table_layout(cursor)
+        if not get_partitions(cursor):
+            print("Table 'trips' is not partitioned; run with --upgrade-table to partition it by month")
+        elif last_pickup is not None:
+            added = ensure_month_partitions(cursor, last_pickup)
+            if added:
+                print(f"Added partitions {', '.join(added)}")
         print("Table 'trips' is ready")
 
-        # Insert query
-        insert_query = """
-        INSERT INTO trips (
-            id, vendor_id, pickup_datetime, dropoff_datetime, passenger_count,
-            pickup_longitude, pickup_latitude, dropoff_longitude, dropoff_latitude,
-            store_and_fwd_flag, trip_duration, trip_distance_km, trip_duration_min,
-            speed_kmh, fare_per_km
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-
-        success_count = 0
-        error_count = 0
-        
-        # First try a small batch to verify the fix
-        test_rows = 10
-        print(f"Testing with first {test_rows} rows...")
-        
-        for i, (_, row) in enumerate(df.head(test_rows).iterrows()):
-            # Convert row to list of values - this correctly handles None values
-            values = [row[col] for col in df.columns]
-            
+        # Summary table backing /api/insights/stats, kept in step with trips
+        cursor.execute(CREATE_SUMMARY_TABLE)
+        print("Table 'trip_summary' is ready")
+
+        # Rollup cube backing the grouped insights endpoints
+        cursor.execute(CREATE_ROLLUP_TABLE)
+        print("Table 'trip_rollup' is ready")
+
+        # Reservoir sample backing approx=true insights
+        unbuilt = create_trip_sample(cursor)
+        if unbuilt:
+            print(f"Table 'trip_sample' has no reservoir for strata {', '.join(map(str, unbuilt))} yet; "
+                  "run with --rebuild-summary to draw them from trips")
+        else:
+            print("Table 'trip_sample' is ready")
+
+        cursor.execute(CREATE_CHECKPOINT_TABLE)
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+def add_cell_columns(cursor):
+    """Add and backfill the grid cell columns on a trips table created before they existed"""
+    cursor.execute("SHOW COLUMNS FROM trips LIKE '%_cell'")
+    if len(cursor.fetchall()) == 2:
+        return
+    start = time.perf_counter()
+    print("Adding pickup_cell/dropoff_cell to the existing trips table")
+    cursor.execute("ALTER TABLE trips ADD COLUMN pickup_cell INT, ADD COLUMN dropoff_cell INT")
+    cursor.execute(
+        f"UPDATE trips SET pickup_cell = {cell_id_sql('pickup_latitude', 'pickup_longitude')}, "
+        f"dropoff_cell = {cell_id_sql('dropoff_latitude', 'dropoff_longitude')}")
+    cursor.execute(
+        f"ALTER TABLE trips ADD INDEX idx_pickup_cell {SECONDARY_INDEXES['idx_pickup_cell']}, "
+        f"ADD INDEX idx_dropoff_cell {SECONDARY_INDEXES['idx_dropoff_cell']}")
+    print(f"Cell columns backfilled in {time.perf_counter() - start:.1f}s")
+
+def has_trip_key(cursor):
+    cursor.execute("SHOW COLUMNS FROM trips LIKE 'trip_key'")
+    return bool(cursor.fetchall())
+
+def has_time_columns(cursor):
+    cursor.execute("SHOW COLUMNS FROM trips LIKE 'pickup_hour'")
+    return bool(cursor.fetchall())
+
+def check_table_layout(cursor):
+    """Stop when the trips table was created for another TRIP_KEYS scheme or TRIPS_SCHEMA layout"""
+    if KEY_COLUMN == "trip_key" and not has_trip_key(cursor):
+        raise SystemExit("Table 'trips' is keyed on id; run with --upgrade-table to switch it to "
+                         "compact trip keys, or unset TRIP_KEYS")
+    if KEY_COLUMN == "id" and has_trip_key(cursor):
+        raise SystemExit("Table 'trips' is keyed on trip_key; set TRIP_KEYS=compact")
+    if TRIPS_SCHEMA == "compact" and not has_time_columns(cursor):
+        raise SystemExit("Table 'trips' has the standard layout; convert it with scripts/migrate_schema.py, "
+                         "or unset TRIPS_SCHEMA")
+    if TRIPS_SCHEMA == "standard" and has_time_columns(cursor):
+        raise SystemExit("Table 'trips' has the compact layout; set TRIPS_SCHEMA=compact")
+
+def add_trip_key(cursor):
+    """Add and backfill trip_key on a table keyed by id, and make it the primary key"""
+    cursor.execute(f"SELECT COUNT(*) FROM trips WHERE ({trip_key_sql()}) IS NULL")
+    missing = cursor.fetchone()[0]
+    if missing:
+        print(f"{missing} trips have ids that can't be made into compact keys; "
+              "delete them, or keep TRIP_KEYS=string")
+        return False
+    print("Adding trip_key and making it the primary key (this rebuilds the table)")
+    cursor.execute("ALTER TABLE trips ADD COLUMN trip_key BIGINT FIRST")
+    cursor.execute(f"UPDATE trips SET trip_key = {trip_key_sql()}")
+    cursor.execute(
+        "ALTER TABLE trips MODIFY trip_key BIGINT NOT NULL, "
+        "DROP PRIMARY KEY, ADD PRIMARY KEY (trip_key, pickup_datetime)")
+    return True
+
+def add_key_column(df):
+    """Add trip_key to a frame for TRIP_KEYS=compact, dropping trips whose id has no compact key"""
+    if KEY_COLUMN != "trip_key":
+        return df
+    df = df.assign(trip_key=trip_keys(df['id']))
+    missing = df['trip_key'].isna()
+    if missing.any():
+        print(f"Skipping {missing.sum()} trips whose ids can't be made into compact keys")
+        df = df[~missing].reset_index(drop=True)
+    return df
+
+def trip_row_keys(df):
+    """(KEY_COLUMN, pickup_datetime) of each row, the trips primary key"""
+    return pd.MultiIndex.from_arrays([df[KEY_COLUMN].astype(object), pd.to_datetime(df['pickup_datetime'])])
+
+def latest_versions(df):
+    """Keep only the last row for each trip, the one an upsert of all of them would leave"""
+    duplicated = df[KEY_COLUMN].duplicated(keep="last")
+    if duplicated.any():
+        print(f"Keeping the last of {duplicated.sum()} repeated trips")
+        df = df[~duplicated].reset_index(drop=True)
+    return df
+
+def replaced_trips(cursor, batch):
+    """
+    Rows already stored for the trips in `batch`, with the columns summary
+    and rollup need. Upserting the batch overwrites those with the same
+    pickup time; stale_trips() picks the ones whose pickup time changed.
+    """
+    columns = [KEY_COLUMN, "pickup_datetime", "passenger_count", "vendor_id"] + [col for col, _ in SUMMARY_MEASURES]
+    keys = batch[KEY_COLUMN].astype(object).tolist()
+    rows = []
+    for i in range(0, len(keys), UPSERT_LOOKUP_SIZE):
+        chunk = keys[i:i + UPSERT_LOOKUP_SIZE]
+        cursor.execute(
+            f"SELECT {', '.join(columns)} FROM trips WHERE {KEY_COLUMN} IN ({', '.join(['%s'] * len(chunk))})",
+            chunk)
+        rows += cursor.fetchall()
+    return pd.DataFrame(rows, columns=columns)
+
+def stale_trips(replaced, batch):
+    """
+    Replaced rows whose pickup time differs from the new version in `batch`.
+    pickup_datetime is part of the primary key, so the upsert inserts those
+    trips as new rows and the old ones have to be deleted.
+    """
+    return replaced[~trip_row_keys(replaced).isin(trip_row_keys(batch))]
+
+def get_existing_indexes(cursor):
+    cursor.execute("SHOW INDEX FROM trips")
+    return {row[2] for row in cursor.fetchall()}
+
+def drop_secondary_indexes(db_config):
+    conn = connect(db_config)
+    try:
+        cursor = conn.cursor()
+        existing = get_existing_indexes(cursor)
+        for name in SECONDARY_INDEXES:
+            if name in existing:
+                cursor.execute(f"ALTER TABLE trips DROP INDEX {name}")
+                print(f"Dropped index {name}")
+        cursor.close()
+    finally:
+        conn.close()
+
+def rebuild_secondary_indexes(db_config):
+    start = time.perf_counter()
+    conn = connect(db_config)
+    try:
+        cursor = conn.cursor()
+        existing = get_existing_indexes(cursor)
+        missing = [f"ADD INDEX {name} {columns}" for name, columns in SECONDARY_INDEXES.items() if name not in existing]
+        if missing:
+            # A single ALTER builds all the indexes in one pass over the table
+            cursor.execute(f"ALTER TABLE trips {', '.join(missing)}")
+            print(f"Rebuilt {len(missing)} indexes in {time.perf_counter() - start:.1f}s")
+        cursor.close()
+    finally:
+        conn.close()
+
+def upgrade_trips_table(db_config):
+    """
+    Bring a trips table created by an older schema up to date: primary key
+    (KEY_COLUMN, pickup_datetime), monthly partitions and the current indexes
+    """
+    start = time.perf_counter()
+    conn = connect(db_config)
+    try:
+        cursor = conn.cursor()
+        if not get_partitions(cursor):
+            cursor.execute("SELECT COUNT(*) FROM trips WHERE pickup_datetime IS NULL")
+            missing = cursor.fetchone()[0]
+            if missing:
+                print(f"{missing} trips have no pickup_datetime and can't be placed in a partition; "
+                      "delete or fix them, then run --upgrade-table again")
+                return
+            cursor.execute("SELECT MIN(pickup_datetime), MAX(pickup_datetime) FROM trips")
+            first, last = cursor.fetchone()
+            first, last = (month_start(first), month_start(last)) if first else (FIRST_MONTH, LAST_MONTH)
+            print("Partitioning trips by month (this rebuilds the table)")
+            cursor.execute(
+                "ALTER TABLE trips MODIFY pickup_datetime DATETIME NOT NULL, "
+                "DROP PRIMARY KEY, ADD PRIMARY KEY (id, pickup_datetime)")
+            cursor.execute(f"ALTER TABLE trips {partition_clause(first, last)}")
+            print(f"Partitioned trips into {len(get_partitions(cursor))} partitions")
+
+        if KEY_COLUMN == "trip_key" and not has_trip_key(cursor) and not add_trip_key(cursor):
+            return
+
+        existing = get_existing_indexes(cursor)
+        for name in OBSOLETE_INDEXES:
+            if name in existing:
+                cursor.execute(f"ALTER TABLE trips DROP INDEX {name}")
+                print(f"Dropped index {name}")
+        cursor.close()
+    finally:
+        conn.close()
+
+    rebuild_secondary_indexes(db_config)
+    print(f"Table 'trips' upgraded in {time.perf_counter() - start:.1f}s")
+
+def get_completed_batches(db_config, load_id):
+    """Batches of this load that were committed by an earlier run"""
+    conn = connect(db_config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT batch_no, rows_loaded FROM load_checkpoints WHERE load_id = %s", (load_id,))
+        completed = dict(cursor.fetchall())
+        cursor.close()
+        return completed
+    finally:
+        conn.close()
+
+def clear_checkpoints(db_config, load_id):
+    conn = connect(db_config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM load_checkpoints WHERE load_id = %s", (load_id,))
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+def insert_rows(cursor, rows, query=INSERT_QUERY):
+    """
+    Insert (position, values) rows with one multi-row INSERT (or `query`,
+    e.g. UPSERT_QUERY). If it fails, split the rows and retry each part, so
+    a few bad rows don't force a row-by-row load. Returns (positions
+    inserted, [(position, error)]).
+    """
+    try:
+        cursor.executemany(query, [values for _, values in rows])
+        return [pos for pos, _ in rows], []
+    except Error as e:
+        if e.errno in RETRYABLE_ERRORS:
+            # Not a bad row: the whole batch has to run again
+            raise
+        if len(rows) == 1:
+            return [], [(rows[0][0], e)]
+        if len(rows) <= MIN_SPLIT_SIZE:
+            parts = [[row] for row in rows]
+        else:
+            middle = len(rows) // 2
+            parts = [rows[:middle], rows[middle:]]
+        positions, errors = [], []
+        for part in parts:
+            part_positions, part_errors = insert_rows(cursor, part, query)
+            positions += part_positions
+            errors += part_errors
+        return positions, errors
+
+def load_with_infile(cursor, batch):
+    """Load a batch through a temporary CSV and LOAD DATA LOCAL INFILE"""
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="") as tmp:
+        # With an empty escape character, MySQL reads an unquoted NULL as NULL
+        # and "" inside a quoted field as a literal quote, as pandas writes them
+        batch.to_csv(tmp, index=False, header=False, na_rep="NULL", date_format="%Y-%m-%d %H:%M:%S")
+        tmp_path = tmp.name
+    try:
+        cursor.execute(LOAD_DATA_QUERY, (tmp_path,))
+        return cursor.rowcount
+    finally:
+        os.remove(tmp_path)
+
+class BatchLoader:
+    """
+    Loads numbered batches of a frame, each in its own transaction. With
+    `upsert`, trips already in the table are updated (a trip whose pickup
+    time changed gets its old row deleted, as pickup_datetime is part of the
+    primary key), and the summary and rollup get the difference between
+    their old and new values; only trips
+    new to the table are offered to the sample. A batch that deadlocks with
+    another worker is rolled back and loaded again.
+    The frame must then hold each trip once (see latest_versions).
+    """
+
+    def __init__(self, db_config, df, batch_size, load_id, method, upsert=False):
+        self.db_config = db_config
+        self.df = df
+        self.batch_size = batch_size
+        self.load_id = load_id
+        # LOAD DATA can't update rows in place
+        self.method = "insert" if upsert else method
+        self.upsert = upsert
+        self.total_batches = (len(df) + batch_size - 1) // batch_size
+        self.success_count = 0
+        self.updated_count = 0
+        self.error_count = 0
+        # Positions in `df` of the rows that failed to load
+        self.failed_rows = []
+        self.batches_done = 0
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+
+    def _connection(self):
+        # One connection per worker thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_config)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def load_batch(self, batch_no):
+        """Load one batch, running it again when it loses a deadlock or times out waiting for a lock"""
+        for attempt in range(BATCH_RETRIES + 1):
             try:
-                cursor.execute(insert_query, values)
-                success_count += 1
-                print(f"Test row {i+1} inserted successfully")
+                return self._load_batch(batch_no)
             except Error as e:
-                error_count += 1
-                print(f"Error with test row {i+1}: {e}")
-                
-        # Commit the test batch
-        conn.commit()
-        print(f"Test batch: {success_count} rows inserted, {error_count} errors")
-        
-        # If test is successful, proceed with batched inserts for the rest
-        if success_count == test_rows:
-            print("Test successful! Processing remaining data in batches...")
-            
-            batch_size = 1000
-            total_rows = len(df)
-            batch_count = 0
-            
-            # Start from where we left off
-            for i in range(test_rows, total_rows, batch_size):
-                end_idx = min(i + batch_size, total_rows)
-                batch_count += 1
-                print(f"Processing batch {batch_count}: rows {i+1}-{end_idx} of {total_rows}")
-                
-                batch_values = []
-                for _, row in df.iloc[i:end_idx].iterrows():
-                    row_values = [row[col] for col in df.columns]
-                    batch_values.append(tuple(row_values))
-                
+                if e.errno not in RETRYABLE_ERRORS or attempt == BATCH_RETRIES:
+                    raise
+                self._connection().rollback()
+                print(f"Batch {batch_no + 1}: {e.msg}, retrying ({attempt + 1}/{BATCH_RETRIES})")
+                time.sleep(0.1 * 2 ** attempt)
+
+    def _load_batch(self, batch_no):
+        start_row = batch_no * self.batch_size
+        batch = self.df.iloc[start_row:start_row + self.batch_size]
+        conn = self._connection()
+        cursor = conn.cursor()
+        try:
+            loaded_batch = None
+            errors = []
+            replaced = replaced_trips(cursor, batch) if self.upsert else None
+
+            if self.method == "infile":
                 try:
-                    cursor.executemany(insert_query, batch_values)
-                    conn.commit()
-                    success_count += len(batch_values)
-                    print(f"Batch {batch_count} inserted successfully")
+                    loaded = load_with_infile(cursor, batch)
+                    if loaded == len(batch):
+                        loaded_batch = batch
+                    else:
+                        # LOAD DATA LOCAL skips bad or duplicate rows with only a warning
+                        print(f"LOAD DATA loaded {loaded} of {len(batch)} rows in batch {batch_no + 1}, retrying with INSERTs")
+                        conn.rollback()
                 except Error as e:
-                    print(f"Error with batch {batch_count}: {e}")
-                    print("Trying row by row...")
-                    
-                    # If batch fails, try one by one
-                    for j, values in enumerate(batch_values):
-                        try:
-                            cursor.execute(insert_query, values)
-                            conn.commit()
-                            success_count += 1
-                        except Error as e2:
-                            error_count += 1
-                            if error_count < 20:  # Limit error reporting
-                                print(f"Error at row {i+j+1}: {e2}")
-                
-                # Report progress
-                if batch_count % 10 == 0:
-                    print(f"Progress: {min(i + batch_size, total_rows)}/{total_rows} rows processed")
-        
-        # Final commit and report
-        conn.commit()
-        print(f"Final results: {success_count} rows inserted successfully, {error_count} rows with errors.")
+                    print(f"LOAD DATA failed for batch {batch_no + 1} ({e}), retrying with INSERTs")
+                    conn.rollback()
+
+            if loaded_batch is None:
+                values = to_python_objects(batch).itertuples(index=False, name=None)
+                query = UPSERT_QUERY if self.upsert else INSERT_QUERY
+                positions, errors = insert_rows(cursor, list(enumerate(values)), query)
+                loaded_batch = batch.iloc[positions]
+
+            if replaced is not None and not replaced.empty:
+                # Rows that failed to load still have their old values
+                replaced = replaced[replaced[KEY_COLUMN].isin(loaded_batch[KEY_COLUMN])]
+                stale = stale_trips(replaced, loaded_batch)
+                if not stale.empty:
+                    cursor.executemany(
+                        f"DELETE FROM trips WHERE {KEY_COLUMN} = %s AND pickup_datetime = %s",
+                        list(to_python_objects(stale[[KEY_COLUMN, "pickup_datetime"]]).itertuples(index=False, name=None)))
+
+            # Summary, rollup, sample and checkpoint commit atomically with the rows themselves.
+            # Replaced trips are netted out in the same upserts, so each aggregate row is locked once.
+            update_trip_summary(cursor, loaded_batch, replaced)
+            update_trip_rollup(cursor, loaded_batch, replaced)
+            new_trips = loaded_batch
+            if replaced is not None and not replaced.empty:
+                new_trips = loaded_batch[~loaded_batch[KEY_COLUMN].isin(replaced[KEY_COLUMN])]
+            update_trip_sample(cursor, new_trips)
+            cursor.execute(
+                "INSERT INTO load_checkpoints (load_id, batch_no, rows_loaded) VALUES (%s, %s, %s)",
+                (self.load_id, batch_no, len(loaded_batch)),
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+
+        with self._lock:
+            self.success_count += len(loaded_batch)
+            self.updated_count += 0 if replaced is None else replaced[KEY_COLUMN].nunique()
+            self.batches_done += 1
+            for pos, e in errors:
+                self.error_count += 1
+                self.failed_rows.append(start_row + pos)
+                if self.error_count < 20:  # Limit error reporting
+                    print(f"Error at row {start_row + pos + 1}: {e}")
+            elapsed = time.perf_counter() - self.start
+            print(f"Batch {batch_no + 1}/{self.total_batches}: {len(loaded_batch)} rows "
+                  f"({self.batches_done} batches done, {self.success_count / elapsed:,.0f} rows/s)")
+
+    def run(self, batch_numbers, workers=1):
+        try:
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    list(pool.map(self.load_batch, batch_numbers))
+            else:
+                for batch_no in batch_numbers:
+                    self.load_batch(batch_no)
+        finally:
+            for conn in self._connections:
+                conn.close()
+
+def detect_method(db_config, method):
+    """Use LOAD DATA LOCAL INFILE when the server allows it, INSERTs otherwise"""
+    if method != "auto":
+        return method
+    conn = connect(db_config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT @@GLOBAL.local_infile")
+        enabled = bool(cursor.fetchone()[0])
+        cursor.close()
+    except Error:
+        enabled = False
+    finally:
+        conn.close()
+    return "infile" if enabled else "insert"
+
+def load_trips(db_config, df, load_id, batch_size=DEFAULT_BATCH_SIZE, workers=1, method="auto",
+               drop_indexes=False, restart=False, upsert=False):
+    """
+    Load a frame of trips (INSERT_COLUMNS) in checkpointed batches, skipping
+    the batches of `load_id` an earlier run committed. Returns the
+    BatchLoader, or None when there was nothing left to load.
+    """
+    pickups = df['pickup_datetime'].dropna()
+    prepare_database(db_config, pickups.max() if len(pickups) else None)
+
+    # Skip batches an interrupted earlier run already committed
+    if restart:
+        clear_checkpoints(db_config, load_id)
+    completed = get_completed_batches(db_config, load_id)
+    total_batches = (len(df) + batch_size - 1) // batch_size
+    pending = [b for b in range(total_batches) if b not in completed]
+    if completed:
+        print(f"Resuming: {len(completed)} of {total_batches} batches "
+              f"({sum(completed.values())} rows) were already loaded")
+    if not pending:
+        print("Nothing left to load")
+        return None
+
+    method = detect_method(db_config, "insert" if upsert else method)
+    print(f"Loading {len(pending)} batches of up to {batch_size} rows with "
+          f"{'LOAD DATA LOCAL INFILE' if method == 'infile' else 'multi-row INSERTs'}"
+          f"{' ... ON DUPLICATE KEY UPDATE' if upsert else ''} and {workers} worker(s)")
+
+    if drop_indexes:
+        drop_secondary_indexes(db_config)
+
+    loader = BatchLoader(db_config, df, batch_size, load_id, method, upsert)
+    try:
+        loader.run(pending, workers)
+    finally:
+        if drop_indexes:
+            rebuild_secondary_indexes(db_config)
+
+    elapsed = time.perf_counter() - loader.start
+    updated = f" ({loader.updated_count} of them updated existing trips)" if upsert else ""
+    print(f"Final results: {loader.success_count} rows inserted successfully{updated}, "
+          f"{loader.error_count} rows with errors.")
+    print(f"Loaded in {elapsed:.1f}s ({loader.success_count / elapsed:,.0f} rows/s)")
+    return loader
+
+def insert_trips(batch_size=DEFAULT_BATCH_SIZE, workers=1, method="auto", drop_indexes=False, restart=False,
+                 column_store=False, upsert=False):
+    """Load the featured file; returns False when MySQL reported an error"""
+    print(f"Loading data from {FEATURED_FILE}")
+
+    # Load only the columns we insert
+    df = read_trips(FEATURED_FILE, columns=TRIP_COLUMNS)
+    df['id'] = df['id'].astype(str)
+    print(f"Loaded {len(df)} rows from {os.path.basename(FEATURED_FILE)}")
+    df = add_key_column(df)
+    if upsert:
+        df = latest_versions(df)
+
+    try:
+        db_config = get_db_config()
+        loader = load_trips(db_config, df, get_load_id(FEATURED_FILE, batch_size), batch_size, workers, method,
+                            drop_indexes, restart, upsert)
+        if loader is None and not column_store:
+            return True
+
+        if column_store:
+            build_column_store(df)
+
+        # Invalidate cached API responses and ETags
+        print(f"Dataset version is now {bump_dataset_version()}")
+        return True
 
     except Error as e:
-        print("Error while connecting to MySQL:", e)
+        print("Error while loading into MySQL:", e)
+        return False
 
+def rebuild_summary():
+    """Recompute trip_summary and trip_rollup, and redraw trip_sample, from the trips already in the database"""
+    conn = mysql.connector.connect(**get_db_config())
+    try:
+        cursor = conn.cursor()
+        rebuild_trip_summary(cursor)
+        rebuild_trip_rollup(cursor)
+        rebuild_trip_sample(cursor)
+        conn.commit()
+        cursor.close()
+        print("Tables 'trip_summary', 'trip_rollup' and 'trip_sample' rebuilt from trips")
+        bump_dataset_version()
     finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-            print("MySQL connection closed.")
+        conn.close()
+
+def write_column_store():
+    """Build the memory-mapped column store from the featured file without touching MySQL"""
+    df = read_trips(FEATURED_FILE, columns=TRIP_COLUMNS)
+    df['id'] = df['id'].astype(str)
+    build_column_store(df)
+    print(f"Dataset version is now {bump_dataset_version()}")
 
 if __name__ == "__main__":
-    insert_trips()
+    parser = argparse.ArgumentParser(description="Load featured trips into MySQL")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows per batch (one transaction and checkpoint each)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of parallel loader connections")
+    parser.add_argument("--method", choices=["auto", "infile", "insert"], default="auto",
+                        help="LOAD DATA LOCAL INFILE, multi-row INSERTs, or pick based on the server")
+    parser.add_argument("--drop-indexes", action="store_true",
+                        help="drop secondary indexes during the load and rebuild them afterwards")
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore checkpoints left by an interrupted run of the same file")
+    parser.add_argument("--upsert", action="store_true",
+                        help="update trips that are already in the table instead of failing on them")
+    parser.add_argument("--rebuild-summary", action="store_true",
+                        help="only recompute trip_summary, trip_rollup and trip_sample from the trips table")
+    parser.add_argument("--upgrade-table", action="store_true",
+                        help="only partition an existing trips table by month, switch it to TRIP_KEYS "
+                             "and update its indexes")
+    parser.add_argument("--column-store", action="store_true",
+                        help="also write the memory-mapped column store used with TRIPS_BACKEND=columnar")
+    parser.add_argument("--column-store-only", action="store_true",
+                        help="only write the column store, without loading MySQL")
+    args = parser.parse_args()
 
+    if args.column_store_only:
+        write_column_store()
+    elif args.rebuild_summary:
+        rebuild_summary()
+    elif args.upgrade_table:
+        upgrade_trips_table(get_db_config())
+    else:
+        loaded = insert_trips(batch_size=args.batch_size, workers=args.workers, method=args.method,
+                              drop_indexes=args.drop_indexes, restart=args.restart, column_store=args.column_store,
+                              upsert=args.upsert)
+        sys.exit(0 if loaded else 1)
@@ -0,0 +1,253 @@
+"""
+Convert the trips table to the compact layout (see utils/trips_schema.py)
+
+Copies trips into a new trips_compact table one partition at a time, then
+compares the two tables: data and index size from information_schema, and
+the best of --repeat runs of typical queries on each (the standard table
+computing HOUR()/DATE()/WEEKDAY(), the compact one reading the indexed
+generated columns). The report is printed and saved as JSON. Finally the
+tables are swapped with one atomic RENAME; the old table is kept as
+trips_standard unless --drop-old is given.
+
+    python scripts/migrate_schema.py --no-swap     # copy and report only
+    python scripts/migrate_schema.py               # then set TRIPS_SCHEMA=compact
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+import mysql.connector
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.db_config import get_db_config
+from utils.dataset_version import bump_dataset_version
+from utils.partitions import FIRST_MONTH, LAST_MONTH, get_partitions, month_start, partition_clause
+from utils.trip_keys import KEY_COLUMN
+from utils.trips_schema import COMPACT_VALUE_CHECKS, TRIP_COLUMN_TYPES, create_table_query, select_columns, \
+    time_expressions
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_REPORT = os.path.join(BASE_DIR, "data/reports/schema_migration.json")
+
+SOURCE_TABLE = "trips"
+TARGET_TABLE = "trips_compact"
+OLD_TABLE = "trips_standard"
+
+# Stored columns copied across (generated columns fill themselves in)
+COPY_COLUMNS = ([KEY_COLUMN] if KEY_COLUMN == "trip_key" else []) + [name for name, _, _ in TRIP_COLUMN_TYPES]
+
+
+def query_shapes(first_day):
+    """(name, build) pairs; build(table, schema) returns (query, params) for that layout"""
+    day = (first_day, first_day + datetime.timedelta(days=1))
+    month = (first_day, first_day + datetime.timedelta(days=31))
+    all_columns = [name for name, _, _ in TRIP_COLUMN_TYPES]
+
+    def hourly(table, schema):
+        t = time_expressions(schema)
+        return f"SELECT {t['hour']} AS hour, COUNT(*) FROM {table} GROUP BY 1 ORDER BY 1", ()
+
+    def weekday_hour(table, schema):
+        t = time_expressions(schema)
+        return f"SELECT {t['weekday']} AS weekday, {t['hour']} AS hour, COUNT(*) FROM {table} GROUP BY 1, 2", ()
+
+    def monday_8am(table, schema):
+        t = time_expressions(schema)
+        return f"SELECT COUNT(*) FROM {table} WHERE {t['weekday']} = 0 AND {t['hour']} = 8", ()
+
+    def daily_counts(table, schema):
+        t = time_expressions(schema)
+        return (f"SELECT {t['date']} AS day, COUNT(*) FROM {table} "
+                "WHERE pickup_datetime >= %s AND pickup_datetime < %s GROUP BY 1", month)
+
+    def day_page(table, schema):
+        return (f"SELECT {select_columns(all_columns, schema)} FROM {table} "
+                "WHERE pickup_datetime >= %s AND pickup_datetime < %s LIMIT 1000", day)
+
+    def speed_count(table, schema):
+        return f"SELECT COUNT(*) FROM {table} WHERE speed_kmh BETWEEN 10 AND 30", ()
+
+    def full_scan(table, schema):
+        return (f"SELECT AVG(trip_distance_km), AVG(trip_duration_min), AVG(passenger_count), "
+                f"AVG(pickup_latitude) FROM {table}", ())
+
+    return [
+        ("hourly pattern", hourly),
+        ("weekday x hour counts", weekday_hour),
+        ("Monday 8am count", monday_8am),
+        ("daily counts for a month", daily_counts),
+        ("1000-row page of one day", day_page),
+        ("speed range count", speed_count),
+        ("full-scan averages", full_scan),
+    ]
+
+
+def has_column(cursor, table, column):
+    cursor.execute(f"SHOW COLUMNS FROM {table} LIKE %s", (column,))
+    return bool(cursor.fetchall())
+
+
+def table_stats(cursor, table):
+    """Row count and on-disk size of a table, from fresh statistics"""
+    cursor.execute(f"ANALYZE TABLE {table}")
+    cursor.fetchall()
+    cursor.execute(
+        "SELECT TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH, INDEX_LENGTH FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+    rows, avg_row, data, index = cursor.fetchone()
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    return {
+        "rows": cursor.fetchone()[0],
+        "estimated_rows": int(rows or 0),
+        "avg_row_bytes": int(avg_row or 0),
+        "data_bytes": int(data or 0),
+        "index_bytes": int(index or 0),
+        "total_bytes": int(data or 0) + int(index or 0),
+    }
+
+
+def time_query(cursor, query, params, repeat):
+    """Best wall time in ms of `repeat` runs, after one warm-up run"""
+    best = None
+    for run in range(repeat + 1):
+        started = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        elapsed = (time.perf_counter() - started) * 1000
+        if run and (best is None or elapsed < best):
+            best = elapsed
+    return best
+
+
+def find_unfit_rows(cursor):
+    """{check: row count} for values the compact types can't hold"""
+    unfit = {}
+    for name, condition in COMPACT_VALUE_CHECKS.items():
+        cursor.execute(f"SELECT COUNT(*) FROM {SOURCE_TABLE} WHERE {condition}")
+        count = cursor.fetchone()[0]
+        if count:
+            unfit[name] = count
+    return unfit
+
+
+def copy_trips(conn, cursor):
+    """Copy every trip into TARGET_TABLE, one transaction per source partition"""
+    columns = ", ".join(COPY_COLUMNS)
+    partitions = get_partitions(cursor, SOURCE_TABLE) or [None]
+    copied = 0
+    started = time.perf_counter()
+    for partition in partitions:
+        source = f"{SOURCE_TABLE} PARTITION ({partition})" if partition else SOURCE_TABLE
+        cursor.execute(f"INSERT INTO {TARGET_TABLE} ({columns}) SELECT {columns} FROM {source}")
+        conn.commit()
+        copied += cursor.rowcount
+        print(f"Copied {partition or 'trips'}: {cursor.rowcount:,} rows "
+              f"({copied / (time.perf_counter() - started):,.0f} rows/s)")
+    return copied
+
+
+def print_report(report):
+    before, after = report["tables"]["standard"], report["tables"]["compact"]
+    print(f"\n{'':<28}{'standard':>14}{'compact':>14}{'change':>10}")
+    for key in ("rows", "avg_row_bytes", "data_bytes", "index_bytes", "total_bytes"):
+        change = f"{after[key] / before[key] - 1:+.0%}" if before[key] else "-"
+        print(f"{key:<28}{before[key]:>14,}{after[key]:>14,}{change:>10}")
+    print(f"\n{'query (best of ' + str(report['repeat']) + ', ms)':<28}{'standard':>14}{'compact':>14}{'speedup':>10}")
+    for row in report["queries"]:
+        print(f"{row['name']:<28}{row['standard_ms']:>14.1f}{row['compact_ms']:>14.1f}{row['speedup']:>9.2f}x")
+
+
+def migrate_schema(repeat=5, swap=True, drop_old=False, report_file=DEFAULT_REPORT):
+    conn = mysql.connector.connect(**get_db_config())
+    try:
+        cursor = conn.cursor()
+        if has_column(cursor, SOURCE_TABLE, "pickup_hour"):
+            print("Table 'trips' already has the compact layout")
+            return True
+        if KEY_COLUMN == "trip_key" and not has_column(cursor, SOURCE_TABLE, "trip_key"):
+            print("Table 'trips' is keyed on id; run insert_data.py --upgrade-table with TRIP_KEYS=compact first")
+            return False
+        if swap:
+            cursor.execute("SHOW TABLES LIKE %s", (OLD_TABLE,))
+            if cursor.fetchall():
+                print(f"Table '{OLD_TABLE}' is left from an earlier migration; drop it or run with --no-swap")
+                return False
+
+        unfit = find_unfit_rows(cursor)
+        if unfit:
+            for name, count in unfit.items():
+                print(f"{count:,} trips have {name}")
+            print("These values don't fit the compact layout; fix or delete them, or keep the standard layout")
+            return False
+
+        cursor.execute(f"SELECT MIN(pickup_datetime), MAX(pickup_datetime) FROM {SOURCE_TABLE}")
+        first, last = cursor.fetchone()
+        if first is None:
+            print("The trips table is empty; load some data first")
+            return False
+
+        # Same monthly partitions as a fresh load of this data would get
+        cursor.execute(f"DROP TABLE IF EXISTS {TARGET_TABLE}")
+        partitions = partition_clause(min(FIRST_MONTH, month_start(first)), max(LAST_MONTH, month_start(last)))
+        cursor.execute(create_table_query("compact", TARGET_TABLE, partitions))
+        print(f"Created {TARGET_TABLE}")
+        copied = copy_trips(conn, cursor)
+
+        tables = {"standard": table_stats(cursor, SOURCE_TABLE), "compact": table_stats(cursor, TARGET_TABLE)}
+        if tables["compact"]["rows"] != tables["standard"]["rows"]:
+            print(f"Copied {copied:,} of {tables['standard']['rows']:,} trips; not swapping")
+            return False
+
+        first_day = datetime.datetime.combine(first.date(), datetime.time())
+        queries = []
+        for name, build in query_shapes(first_day):
+            standard_ms = time_query(cursor, *build(SOURCE_TABLE, "standard"), repeat)
+            compact_ms = time_query(cursor, *build(TARGET_TABLE, "compact"), repeat)
+            queries.append({"name": name, "standard_ms": round(standard_ms, 2), "compact_ms": round(compact_ms, 2),
+                            "speedup": round(standard_ms / compact_ms, 2) if compact_ms else None})
+
+        report = {
+            "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "repeat": repeat,
+            "tables": tables,
+            "queries": queries,
+        }
+        print_report(report)
+        os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {report_file}")
+
+        if not swap:
+            print(f"Left {TARGET_TABLE} next to trips (--no-swap)")
+            return True
+
+        cursor.execute(f"RENAME TABLE {SOURCE_TABLE} TO {OLD_TABLE}, {TARGET_TABLE} TO {SOURCE_TABLE}")
+        print(f"Swapped: trips now has the compact layout, the old table is {OLD_TABLE}")
+        if drop_old:
+            cursor.execute(f"DROP TABLE {OLD_TABLE}")
+            print(f"Dropped {OLD_TABLE}")
+        cursor.close()
+    finally:
+        conn.close()
+
+    # Coordinates are now stored rounded to 6 decimals
+    print(f"Dataset version is now {bump_dataset_version()}")
+    print("Set TRIPS_SCHEMA=compact for insert_data.py and the API server, and restart the server")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the trips table to the compact layout")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per query (best one is reported)")
+    parser.add_argument("--no-swap", action="store_true",
+                        help=f"copy and report, but leave trips as it is next to {TARGET_TABLE}")
+    parser.add_argument("--drop-old", action="store_true", help=f"drop {OLD_TABLE} after the swap")
+    parser.add_argument("--report", default=DEFAULT_REPORT, help="JSON file for the size and timing report")
+    args = parser.parse_args()
+    sys.exit(0 if migrate_schema(args.repeat, not args.no_swap, args.drop_old, args.report) else 1)
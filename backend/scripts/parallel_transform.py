@@ -0,0 +1,208 @@
+"""
+Multi-core cleaning and feature engineering
+
+The raw CSV is split into byte ranges aligned to line starts. Each worker
+process reads only its own range from disk, so no frames are pickled
+between processes. It runs the per-row transforms (missing-value filter,
+datetime parsing, haversine, speed/fare features and the unrealistic-speed
+filter) and writes its partition, and the rows it rejected, to temporary
+Parquet/CSV parts. The parent merges the parts in partition order, dropping
+rows already seen in an earlier partition, so the output is the same for any
+number of workers. Workers keep the fingerprint of every row they reject, so
+a row that repeats one of an earlier partition is counted as a duplicate
+even when its worker rejected it for another reason, as in a single-process
+run.
+
+Assumes no quoted newlines inside CSV fields, which holds for the NYC TLC files.
+
+    python scripts/parallel_transform.py --workers 8
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPTS_DIR)
+sys.path.append(BASE_DIR)
+if SCRIPTS_DIR not in sys.path:
+    sys.path.append(SCRIPTS_DIR)
+
+import data_cleaning
+import feature_engineering
+from utils.rejections import REJECTS_DIR, RejectionWriter, read_rejections
+from utils.trip_io import TripWriter, read_trips, trip_file
+
+# Target size of one partition; more partitions than workers keeps every
+# core busy when some partitions are slower than others
+PARTITION_BYTES = 64 * 1024 * 1024
+
+FINGERPRINT_COLUMN = "_fingerprint"
+
+class PartRejections(RejectionWriter):
+    """
+    A worker's RejectionWriter that also saves the fingerprint of each
+    rejected row, in record order, to <stage>.fingerprints.npy
+    """
+
+    def __init__(self, stages, directory):
+        super().__init__(stages, directory)
+        self.fingerprints = {stage: [] for stage in stages}
+
+    def reject(self, df, stage, reason, columns=None):
+        if not df.empty:
+            self.fingerprints[stage].append(df[FINGERPRINT_COLUMN].to_numpy(dtype=np.uint64))
+        super().reject(df, stage, reason, columns)
+
+    def close(self):
+        super().close()
+        for stage, arrays in self.fingerprints.items():
+            np.save(os.path.join(self.directory, f"{stage}.fingerprints.npy"),
+                    np.concatenate(arrays) if arrays else np.empty(0, dtype=np.uint64))
+
+def read_part_rejections(part_rejects_dir, stage):
+    """(records, fingerprints) a worker rejected in `stage`, in the same order"""
+    records = read_rejections(part_rejects_dir, stage)
+    fingerprints = np.load(os.path.join(part_rejects_dir, f"{stage}.fingerprints.npy"))
+    return records, fingerprints
+
+def partition_boundaries(path, partitions):
+    """Byte offsets splitting `path` into ranges that start at line starts"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()  # header
+        data_start = f.tell()
+        boundaries = [data_start]
+        step = max(1, (size - data_start) // partitions)
+        for i in range(1, partitions):
+            f.seek(data_start + i * step - 1)
+            f.readline()  # move to the start of the next line
+            position = f.tell()
+            if boundaries[-1] < position < size:
+                boundaries.append(position)
+    boundaries.append(size)
+    return boundaries
+
+def process_partition(task):
+    """Worker: clean (and optionally engineer) one byte range of the raw file"""
+    raw_file, start, end, part_file, part_rejects_dir, engineer = task
+    started = time.perf_counter()
+
+    header = pd.read_csv(raw_file, nrows=0).columns
+    dtypes = {col: data_cleaning.RAW_DTYPES.get(col, str) for col in header}
+    with open(raw_file, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    df = pd.read_csv(io.BytesIO(data), header=None, names=list(header), dtype=dtypes)
+    del data
+    rows_in = len(df)
+
+    stages = ["clean", "features"] if engineer else ["clean"]
+    with PartRejections(stages, part_rejects_dir) as rejects:
+        # Duplicates inside the partition; the parent handles the ones across partitions
+        fingerprints = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        df[FINGERPRINT_COLUMN] = fingerprints
+        is_duplicate = pd.Series(fingerprints).duplicated().to_numpy()
+        data_cleaning.reject_duplicates(df[is_duplicate], rejects)
+        df = df[~is_duplicate].copy()
+
+        df = data_cleaning.clean_frame(df, rejects)
+        if engineer:
+            df = feature_engineering.add_features(df, rejects)
+
+    with TripWriter(part_file) as writer:
+        writer.write(df)
+
+    return {"rows_in": rows_in, "rows_out": len(df), "seconds": time.perf_counter() - started}
+
+def transform_parallel(raw_file=data_cleaning.RAW_FILE, output_file=None, workers=None, engineer=True,
+                       rejects_dir=REJECTS_DIR, partition_bytes=PARTITION_BYTES):
+    """
+    Clean (and with `engineer`, feature-engineer) the raw file on `workers`
+    processes. Returns the output path and prints a scaling report.
+    """
+    workers = workers or os.cpu_count() or 1
+    if output_file is None:
+        output_file = feature_engineering.FEATURED_FILE if engineer else data_cleaning.CLEANED_FILE
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    started = time.perf_counter()
+    partitions = max(workers, -(-os.path.getsize(raw_file) // max(1, partition_bytes)))
+    boundaries = partition_boundaries(raw_file, partitions)
+    header = pd.read_csv(raw_file, nrows=0).columns
+
+    tmp_dir = tempfile.mkdtemp(prefix="trips_parts_", dir=os.path.dirname(output_file))
+    try:
+        tasks = []
+        for i, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+            part_file = trip_file(os.path.join(tmp_dir, f"part_{i:05d}"))
+            tasks.append((raw_file, start, end, part_file, os.path.join(tmp_dir, f"rejected_{i:05d}"), engineer))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_partition, tasks))
+        transformed = time.perf_counter()
+
+        # Merge in partition order so output doesn't depend on scheduling
+        seen = np.empty(0, dtype=np.uint64)
+        stages = ["clean", "features"] if engineer else ["clean"]
+        with RejectionWriter(stages, rejects_dir) as rejects, TripWriter(output_file) as writer:
+            for _, _, _, part_file, part_rejects_dir, _ in tasks:
+                part_fingerprints = []
+                for stage in stages:
+                    records, fingerprints = read_part_rejections(part_rejects_dir, stage)
+                    part_fingerprints.append(fingerprints)
+                    # A row an earlier partition already has is a duplicate, whatever
+                    # else the worker rejected it for (once, even with several reasons)
+                    repeated = (data_cleaning.find_fingerprints(seen, fingerprints)
+                                & (records["reason"] != "duplicate").to_numpy())
+                    if repeated.any():
+                        first = ~pd.Series(fingerprints[repeated]).duplicated().to_numpy()
+                        records = pd.concat([records[~repeated], records[repeated][first].assign(
+                            stage="clean", reason="duplicate", values="{}")], ignore_index=True)
+                    rejects.add_records(records)
+
+                df = read_trips(part_file)
+                fingerprints = df[FINGERPRINT_COLUMN].to_numpy(dtype=np.uint64)
+                duplicate = data_cleaning.find_fingerprints(seen, fingerprints)
+                if duplicate.any():
+                    data_cleaning.reject_duplicates(df[duplicate].drop(columns=FINGERPRINT_COLUMN), rejects)
+                part_fingerprints.append(fingerprints)
+                seen = data_cleaning.add_fingerprints(seen, np.concatenate(part_fingerprints))
+                writer.write(df[~duplicate].drop(columns=FINGERPRINT_COLUMN))
+            if not tasks:
+                writer.write(pd.DataFrame(columns=list(header)))
+            rows_written = writer.rows
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    wall = time.perf_counter() - started
+    busy = sum(r["seconds"] for r in results)
+    rows_in = sum(r["rows_in"] for r in results)
+    print(f"Parallel transform: {len(tasks)} partitions on {workers} worker(s)")
+    print(f"  rows read {rows_in}, rows written {rows_written}")
+    print(f"  transform {transformed - started:.2f}s, merge {wall - (transformed - started):.2f}s, total {wall:.2f}s "
+          f"({rows_in / wall:,.0f} rows/s)")
+    print(f"  worker time {busy:.2f}s, effective speedup {busy / (transformed - started):.2f}x")
+    print(f"Output saved to {output_file}")
+    rejects.print_summary()
+    return output_file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean and engineer trip features on multiple cores")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: all cores)")
+    parser.add_argument("--clean-only", action="store_true",
+                        help="only clean; write the cleaned file instead of the featured one")
+    parser.add_argument("--partition-mb", type=int, default=PARTITION_BYTES // (1024 * 1024),
+                        help="target partition size in MB")
+    args = parser.parse_args()
+
+    transform_parallel(workers=args.workers, engineer=not args.clean_only,
+                       partition_bytes=args.partition_mb * 1024 * 1024)
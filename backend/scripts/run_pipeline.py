@@ -0,0 +1,196 @@
+"""
+Run the data pipeline: clean -> features -> load
+
+Stages whose inputs and code haven't changed since their last successful
+run are skipped (tracked in data/pipeline_state.json by size, mtime and
+content hash). With --fuse, cleaning and feature engineering run as one
+in-memory pass and the cleaned intermediate file is never written.
+
+    python scripts/run_pipeline.py
+    python scripts/run_pipeline.py --fuse --chunksize 500000
+    python scripts/run_pipeline.py --fuse --workers 8
+    python scripts/run_pipeline.py --stages clean,features --force
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(SCRIPTS_DIR)
+sys.path.append(BASE_DIR)
+
+import data_cleaning
+import feature_engineering
+import parallel_transform
+from utils import custom_algorithm, geo_grid, rejections, trip_rollup, trip_sample, trip_summary, trips_schema
+from utils.rejections import REJECTS_DIR, RejectionWriter
+from utils.trip_io import TripWriter, write_trips
+
+STATE_FILE = os.path.join(BASE_DIR, "data/pipeline_state.json")
+STAGES = ["clean", "features", "load"]
+
+def load_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(state):
+    tmp_file = f"{STATE_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, STATE_FILE)
+
+def file_fingerprint(path, known=None):
+    """
+    Size, mtime and SHA-256 of a file. The hash is only recomputed when
+    size or mtime differ from `known`, so unchanged files cost one stat().
+    """
+    stat = os.stat(path)
+    if known and known.get("size") == stat.st_size and known.get("mtime_ns") == stat.st_mtime_ns:
+        return known
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+def fingerprints(paths, known):
+    return {path: file_fingerprint(path, known.get(path)) for path in paths}
+
+def same_content(current, recorded):
+    """Compare fingerprints by content hash only (a touched file still matches)"""
+    return (set(current) == set(recorded)
+            and all(current[p]["sha256"] == recorded[p]["sha256"] for p in current))
+
+class StageFailed(RuntimeError):
+    """Raised when a stage's action reports failure; the stage is not recorded as done"""
+
+def run_stage(state, name, inputs, code, outputs, action, force=False):
+    """
+    Run `action` unless the stage's inputs, code and outputs are unchanged.
+    An action returning False failed, so the next run tries it again.
+    """
+    record = state.get(name, {})
+    known = {**record.get("inputs", {}), **record.get("code", {}), **record.get("outputs", {})}
+    current_inputs = fingerprints(inputs, known)
+    current_code = fingerprints(code, known)
+
+    if not force and record and all(os.path.exists(p) for p in outputs):
+        current_outputs = fingerprints(outputs, known)
+        if (same_content(current_inputs, record.get("inputs", {}))
+                and same_content(current_code, record.get("code", {}))
+                and same_content(current_outputs, record.get("outputs", {}))):
+            print(f"[{name}] up to date, skipping")
+            return False
+
+    print(f"[{name}] running")
+    start = time.perf_counter()
+    if action() is False:
+        raise StageFailed(f"[{name}] failed")
+    state[name] = {
+        "inputs": current_inputs,
+        "code": current_code,
+        "outputs": fingerprints(outputs, {}),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    save_state(state)
+    print(f"[{name}] done in {state[name]['seconds']:.1f}s")
+    return True
+
+def clean_and_engineer(raw_file, output_file, chunksize=0, rejects_dir=REJECTS_DIR):
+    """Cleaning and feature engineering fused into one pass, no cleaned file"""
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+    with RejectionWriter(["clean", "features"], rejects_dir) as rejects:
+        if chunksize > 0:
+            with TripWriter(output_file) as writer:
+                for i, chunk in enumerate(data_cleaning.iter_cleaned_chunks(raw_file, chunksize, rejects)):
+                    writer.write(feature_engineering.add_features(chunk, rejects))
+                    print(f"Chunk {i+1}: {writer.rows} rows written")
+            data_cleaning.print_peak_memory()
+        else:
+            df = data_cleaning.load_cleaned(raw_file, rejects)
+            write_trips(feature_engineering.add_features(df, rejects), output_file)
+
+    print(f"Cleaning and feature engineering done. Featured file saved to {output_file}")
+    rejects.print_summary()
+    return output_file
+
+def run_pipeline(stages=STAGES, fuse=False, chunksize=0, workers=1, force=False, load_options=None):
+    state = load_state()
+    raw_file = data_cleaning.RAW_FILE
+    cleaned_file = data_cleaning.CLEANED_FILE
+    featured_file = feature_engineering.FEATURED_FILE
+    cleaning_code = [data_cleaning.__file__, parallel_transform.__file__, rejections.__file__]
+    features_code = [feature_engineering.__file__, custom_algorithm.__file__, geo_grid.__file__, rejections.__file__]
+
+    # Anything downstream of a stage that ran must run too
+    upstream_changed = False
+
+    if fuse and "clean" in stages and "features" in stages:
+        if workers > 1:
+            action = lambda: parallel_transform.transform_parallel(raw_file, featured_file, workers, engineer=True)
+        else:
+            action = lambda: clean_and_engineer(raw_file, featured_file, chunksize)
+        upstream_changed = run_stage(
+            state, "clean+features", [raw_file], sorted(set(cleaning_code + features_code)), [featured_file], action, force)
+    else:
+        if "clean" in stages:
+            if workers > 1:
+                action = lambda: parallel_transform.transform_parallel(raw_file, cleaned_file, workers, engineer=False)
+            else:
+                action = lambda: data_cleaning.clean_trips(raw_file, cleaned_file, chunksize)
+            upstream_changed = run_stage(
+                state, "clean", [raw_file], cleaning_code, [cleaned_file], action, force)
+        if "features" in stages:
+            upstream_changed = run_stage(
+                state, "features", [cleaned_file], features_code, [featured_file],
+                lambda: feature_engineering.engineer_features(cleaned_file, featured_file),
+                force or upstream_changed) or upstream_changed
+
+    if "load" in stages:
+        # Imported here so the file stages run without a database configured
+        import insert_data
+        load_code = [insert_data.__file__, trip_rollup.__file__, trip_sample.__file__, trip_summary.__file__,
+                     trips_schema.__file__]
+        run_stage(
+            state, "load", [featured_file], load_code, [],
+            lambda: insert_data.insert_trips(**(load_options or {})),
+            force or upstream_changed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the NYC trips data pipeline")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"comma separated stages to run (default: {','.join(STAGES)})")
+    parser.add_argument("--fuse", action="store_true",
+                        help="clean and engineer features in one pass without writing the cleaned file")
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help="stream the raw file in chunks of this many rows")
+    parser.add_argument("--force", action="store_true",
+                        help="run every selected stage even if its inputs are unchanged")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes for cleaning/feature engineering (see parallel_transform.py)")
+    parser.add_argument("--load-workers", type=int, default=1, help="parallel loader connections")
+    parser.add_argument("--batch-size", type=int, default=None, help="rows per load batch")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    load_options = {"workers": args.load_workers}
+    if args.batch_size:
+        load_options["batch_size"] = args.batch_size
+
+    try:
+        run_pipeline(stages, fuse=args.fuse, chunksize=args.chunksize, workers=args.workers, force=args.force,
+                     load_options=load_options)
+    except StageFailed as e:
+        print(e)
+        sys.exit(1)
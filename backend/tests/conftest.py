@@ -0,0 +1,86 @@
+"""
+Shared fixtures
+
+The loader tests run against a SQLite stand-in for MySQL (the one
+scripts/benchmark.py serves the API from), with the MySQL upsert syntax the
+loader and the aggregate modules use translated to SQLite's.
+"""
+import datetime
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+from mysql.connector import Error
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+sys.path.append(os.path.join(BASE_DIR, "scripts"))
+
+from benchmark import StandInConnection, StandInCursor
+from utils.trip_rollup import CREATE_ROLLUP_TABLE
+from utils.trip_sample import create_trip_sample
+from utils.trip_summary import CREATE_SUMMARY_TABLE
+from utils.trips_schema import TRIP_COLUMN_TYPES
+
+sqlite3.register_adapter(datetime.datetime, lambda v: v.strftime("%Y-%m-%d %H:%M:%S"))
+
+# errno passed on for SQLite errors: a bad row, not a deadlock, so the loader isolates it
+STANDIN_ERRNO = 1366
+
+
+def to_sqlite(query):
+    """MySQL's ON DUPLICATE KEY UPDATE ... VALUES(col) as SQLite's ON CONFLICT DO UPDATE ... excluded.col"""
+    query = query.replace(" FOR UPDATE", "")
+    if "ON DUPLICATE KEY UPDATE" in query:
+        insert, updates = query.split("ON DUPLICATE KEY UPDATE")
+        query = insert + "ON CONFLICT DO UPDATE SET " + re.sub(r"VALUES\((\w+)\)", r"excluded.\1", updates)
+    return query
+
+
+class LoaderCursor(StandInCursor):
+    """Stand-in cursor that also takes the loader's writes, raising mysql.connector errors like MySQL"""
+
+    def execute(self, query, params=()):
+        try:
+            super().execute(to_sqlite(query), params)
+        except sqlite3.Error as e:
+            raise Error(msg=str(e), errno=STANDIN_ERRNO)
+
+    def executemany(self, query, rows):
+        try:
+            self._cursor.executemany(to_sqlite(query).replace("%s", "?"), [list(row) for row in rows])
+        except sqlite3.Error as e:
+            raise Error(msg=str(e), errno=STANDIN_ERRNO)
+
+
+class LoaderConnection(StandInConnection):
+    def cursor(self, dictionary=False, **kwargs):
+        return LoaderCursor(self._conn, dictionary)
+
+
+@pytest.fixture
+def loader_db(tmp_path, monkeypatch):
+    """
+    Path of an empty stand-in database with the tables the loader writes
+    to; insert_data.connect() opens connections to it
+    """
+    pytest.importorskip("config.db_config", reason="insert_data needs backend/config/db_config.py")
+    import insert_data
+    path = str(tmp_path / "trips.db")
+    conn = LoaderConnection(path)
+    cursor = conn.cursor()
+    columns = [f"{name} {standard_type}" for name, standard_type, _ in TRIP_COLUMN_TYPES]
+    if insert_data.KEY_COLUMN == "trip_key":
+        columns.insert(0, "trip_key BIGINT NOT NULL")
+    cursor.execute(f"CREATE TABLE trips ({', '.join(columns)}, "
+                   f"PRIMARY KEY ({insert_data.KEY_COLUMN}, pickup_datetime))")
+    cursor.execute(CREATE_SUMMARY_TABLE)
+    cursor.execute(CREATE_ROLLUP_TABLE)
+    create_trip_sample(cursor)
+    cursor.execute(insert_data.CREATE_CHECKPOINT_TABLE)
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(insert_data, "connect", lambda db_config, use_database=True: LoaderConnection(path))
+    return path
@@ -0,0 +1,44 @@
+"""
+parallel_transform.py against a single-process run of the same stages: the
+output rows and the rejection counts must not depend on the partitioning.
+"""
+import pandas as pd
+import pytest
+
+import data_cleaning
+import feature_engineering
+import parallel_transform
+from generate_trips import generate_trips
+from utils.rejections import RejectionWriter, read_rejections
+
+
+@pytest.fixture(scope="module")
+def raw_file(tmp_path_factory):
+    # Enough duplicates and bad rows that some duplicates of rejected rows
+    # land in a later partition than the row they repeat
+    path = tmp_path_factory.mktemp("raw") / "trips.csv"
+    return str(generate_trips(20000, str(path), duplicate_rate=0.05, bad_rate=0.1))
+
+
+def single_process(raw_file, rejects_dir, engineer):
+    stages = ["clean", "features"] if engineer else ["clean"]
+    with RejectionWriter(stages, rejects_dir) as rejects:
+        df = data_cleaning.load_cleaned(raw_file, rejects)
+        if engineer:
+            df = feature_engineering.add_features(df, rejects)
+    return len(df), rejects.counts
+
+
+@pytest.mark.parametrize("engineer", [True, False])
+@pytest.mark.parametrize("workers, partition_bytes", [(1, 1 << 30), (3, 50000)])
+def test_counts_match_single_process(raw_file, tmp_path, engineer, workers, partition_bytes):
+    rows, counts = single_process(raw_file, str(tmp_path / "single"), engineer)
+    assert counts[("clean", "duplicate")] and counts[("clean", "missing_critical")]
+
+    output = parallel_transform.transform_parallel(
+        raw_file, str(tmp_path / "out.csv"), workers, engineer=engineer,
+        rejects_dir=str(tmp_path / "parallel"), partition_bytes=partition_bytes)
+
+    assert len(pd.read_csv(output)) == rows
+    records = read_rejections(str(tmp_path / "parallel"))
+    assert records.groupby(["stage", "reason"]).size().to_dict() == counts
@@ -0,0 +1,103 @@
+"""
+EXPLAIN the trips endpoint queries: a time range must read only its own
+monthly partition and use the index its query shape was built for
+
+Runs against the MySQL database in backend/config/db_config.py with trips
+loaded, over a one-day window in the first loaded month; skipped when there
+is no such database.
+
+    python -m pytest -q tests/test_query_plans.py
+"""
+import datetime
+
+import mysql.connector
+import pytest
+from mysql.connector import Error
+
+pytest.importorskip("config.db_config", reason="needs backend/config/db_config.py")
+from config.db_config import get_db_config
+from routes.trips_routes import build_trip_filters
+from utils.trip_keys import KEY_COLUMN
+
+PASSENGER_COUNT = 1
+
+
+def query_shapes(start, end, passenger_count=PASSENGER_COUNT):
+    """
+    {name: (query, params, expectations)} for each query shape GET
+    /api/trips and /api/trips/export produce with a time range. min_speed is
+    0 where the endpoints default it to 0.
+    """
+    shapes = {}
+
+    where, params = build_trip_filters(0, None, start, end)
+    shapes["time range page"] = (
+        "SELECT * FROM trips WHERE 1=1" + where + " LIMIT 100", params,
+        {"keys": {"idx_pickup_datetime", "idx_pickup_speed_passengers"}})
+
+    where, params = build_trip_filters(10, 60, start, end)
+    shapes["time range + speed count"] = (
+        "SELECT COUNT(*) as count FROM trips WHERE 1=1" + where, params,
+        {"keys": {"idx_pickup_speed_passengers"}, "covering": True})
+
+    where, params = build_trip_filters(0, None, start, end, passenger_count)
+    shapes["time range + passengers count"] = (
+        "SELECT COUNT(*) as count FROM trips WHERE 1=1" + where, params,
+        {"keys": {"idx_passenger_pickup", "idx_pickup_speed_passengers"}})
+
+    where, params = build_trip_filters(0, None, start, end, passenger_count)
+    shapes["passengers keyset page"] = (
+        "SELECT * FROM trips WHERE 1=1" + where
+        + f" AND pickup_datetime IS NOT NULL ORDER BY pickup_datetime, {KEY_COLUMN} LIMIT 101", params,
+        {"keys": {"idx_passenger_pickup"}, "no_filesort": True})
+
+    where, params = build_trip_filters(0, None, start, end)
+    shapes["time keyset page"] = (
+        "SELECT * FROM trips WHERE 1=1" + where
+        + f" AND pickup_datetime IS NOT NULL ORDER BY pickup_datetime, {KEY_COLUMN} LIMIT 101", params,
+        {"keys": {"idx_pickup_datetime"}, "no_filesort": True})
+    return shapes
+
+
+SHAPES = list(query_shapes(datetime.datetime(2016, 1, 1), datetime.datetime(2016, 1, 2)))
+
+
+@pytest.fixture(scope="module")
+def plan_cursor():
+    """(dictionary cursor, window start, window end) on the configured database"""
+    try:
+        conn = mysql.connector.connect(**get_db_config(), connection_timeout=5)
+    except Error as e:
+        pytest.skip(f"no MySQL server: {e}")
+    try:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT MIN(pickup_datetime) AS first_pickup FROM trips")
+            first_pickup = cursor.fetchone()["first_pickup"]
+        except Error as e:
+            pytest.skip(f"no trips table: {e}")
+        if first_pickup is None:
+            pytest.skip("the trips table is empty")
+        # A window inside one month, so exactly one monthly partition should be read
+        start = datetime.datetime.combine(first_pickup.date(), datetime.time())
+        yield cursor, start, start + datetime.timedelta(days=1)
+        cursor.close()
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("name", SHAPES)
+def test_time_range_query_plan(plan_cursor, name):
+    cursor, start, end = plan_cursor
+    query, params, expectations = query_shapes(start, end)[name]
+    cursor.execute("EXPLAIN " + query, params)
+    plan = cursor.fetchall()[0]
+
+    partitions = set((plan.get("partitions") or "").split(",")) - {""}
+    assert partitions == {f"p{start:%Y%m}"}, f"{name} is not pruned to one month"
+    assert plan.get("key") in expectations["keys"]
+    extra = plan.get("Extra") or ""
+    if expectations.get("covering"):
+        assert "Using index" in extra, f"{name} is not index-only"
+    if expectations.get("no_filesort"):
+        assert "filesort" not in extra, f"{name} needs a filesort"
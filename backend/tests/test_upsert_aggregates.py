@@ -0,0 +1,166 @@
+"""
+Upsert loads (ingest_trips.py, insert_data.py --upsert) against the SQLite
+stand-in: after each load, trip_summary and trip_rollup must equal what a
+full rebuild from trips gives.
+"""
+import itertools
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import LoaderConnection
+from utils.trip_rollup import _ROLLUP_COLUMNS, ROLLUP_SCAN_QUERY
+from utils.trip_summary import _SUMMARY_COLUMNS, SINGLE_SCAN_QUERY
+
+pytest.importorskip("config.db_config", reason="insert_data needs backend/config/db_config.py")
+import insert_data
+
+_load_ids = itertools.count()
+
+
+def trips_frame(count, first=0):
+    """`count` featured trips with ids id<first>... in one March 2016 week"""
+    rng = np.random.default_rng(first)
+    pickups = pd.Timestamp("2016-03-07") + pd.to_timedelta(rng.integers(0, 7 * 86400, count), unit="s")
+    durations = rng.integers(120, 3600, count)
+    distances = rng.uniform(0.5, 20, count).round(3)
+    speeds = distances / (durations / 3600)
+    speeds[0] = np.nan
+    return pd.DataFrame({
+        "id": [f"id{i:07d}" for i in range(first, first + count)],
+        "vendor_id": rng.choice(["1", "2"], count),
+        "pickup_datetime": pickups,
+        "dropoff_datetime": pickups + pd.to_timedelta(durations, unit="s"),
+        "passenger_count": rng.integers(1, 7, count),
+        "pickup_longitude": rng.uniform(-74.02, -73.93, count),
+        "pickup_latitude": rng.uniform(40.70, 40.80, count),
+        "dropoff_longitude": rng.uniform(-74.02, -73.93, count),
+        "dropoff_latitude": rng.uniform(40.70, 40.80, count),
+        "store_and_fwd_flag": "N",
+        "trip_duration": durations,
+        "trip_distance_km": distances,
+        "trip_duration_min": durations / 60,
+        "speed_kmh": speeds,
+        "fare_per_km": rng.uniform(1, 5, count),
+        "pickup_cell": rng.integers(0, 1000, count),
+        "dropoff_cell": rng.integers(0, 1000, count),
+    })
+
+
+def load(df, upsert=True, batch_size=4):
+    """Load `df` in batches through BatchLoader, as load_trips does"""
+    df = insert_data.add_key_column(df)
+    if upsert:
+        df = insert_data.latest_versions(df)
+    loader = insert_data.BatchLoader({}, df, batch_size, f"test-{next(_load_ids)}", "insert", upsert)
+    loader.run(range(loader.total_batches))
+    return loader
+
+
+def stored_trips(path):
+    conn = sqlite3.connect(path)
+    try:
+        return pd.read_sql("SELECT id, pickup_datetime, passenger_count, trip_duration FROM trips ORDER BY id", conn)
+    finally:
+        conn.close()
+
+
+def _measures(rows, columns, key_count):
+    """{(key..., measure): value} of aggregate rows, leaving out groups that net to no trips"""
+    result = {}
+    for row in rows:
+        values = dict(zip(columns, row))
+        if not values["trip_count"]:
+            continue
+        key = tuple(str(value) for value in row[:key_count])
+        result.update({key + (col,): float(values[col]) for col in columns[key_count:]})
+    return result
+
+
+def assert_aggregates_match_rebuild(path):
+    conn = LoaderConnection(path)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {', '.join(_SUMMARY_COLUMNS)} FROM trip_summary")
+        summary = _measures(cursor.fetchall(), _SUMMARY_COLUMNS, 1)
+        cursor.execute(SINGLE_SCAN_QUERY)
+        assert summary == pytest.approx(_measures(cursor.fetchall(), _SUMMARY_COLUMNS, 1))
+
+        cursor.execute(f"SELECT {', '.join(_ROLLUP_COLUMNS)} FROM trip_rollup")
+        rollup = _measures(cursor.fetchall(), _ROLLUP_COLUMNS, 5)
+        cursor.execute(ROLLUP_SCAN_QUERY)
+        assert rollup == pytest.approx(_measures(cursor.fetchall(), _ROLLUP_COLUMNS, 5))
+    finally:
+        conn.close()
+
+
+def test_upsert_updates_existing_trips(loader_db):
+    base = trips_frame(12)
+    load(base, upsert=False)
+    assert_aggregates_match_rebuild(loader_db)
+
+    changed = base.iloc[[1, 5, 9]].copy()
+    changed["passenger_count"] = 6
+    changed["trip_duration"] += 600
+    changed["trip_duration_min"] = changed["trip_duration"] / 60
+    changed["speed_kmh"] = changed["trip_distance_km"] / (changed["trip_duration"] / 3600)
+    loader = load(pd.concat([changed, trips_frame(3, first=100)], ignore_index=True))
+
+    assert loader.success_count == 6
+    assert loader.updated_count == 3
+    trips = stored_trips(loader_db).set_index("id")
+    assert len(trips) == 15
+    assert (trips.loc[changed["id"], "passenger_count"] == 6).all()
+    assert trips.loc[changed["id"], "trip_duration"].tolist() == changed["trip_duration"].tolist()
+    assert_aggregates_match_rebuild(loader_db)
+
+
+def test_upsert_replaces_trip_whose_pickup_moved(loader_db):
+    base = trips_frame(12)
+    load(base, upsert=False)
+
+    moved = base.iloc[[2, 3, 7]].copy()
+    # Across an hour and across a day, so different rollup rows lose and gain the trip
+    moved["pickup_datetime"] += pd.to_timedelta([1, 1, 26], unit="h")
+    moved["dropoff_datetime"] += pd.to_timedelta([1, 1, 26], unit="h")
+    # The same trip twice in one load: the last version wins
+    again = moved.iloc[[0]].copy()
+    again["pickup_datetime"] += pd.Timedelta(hours=1)
+    load(pd.concat([moved, again], ignore_index=True))
+
+    trips = stored_trips(loader_db)
+    assert len(trips) == 12
+    assert trips["id"].is_unique
+    expected = pd.concat([moved.iloc[1:], again]).set_index("id")["pickup_datetime"]
+    stored = pd.to_datetime(trips.set_index("id").loc[expected.index, "pickup_datetime"])
+    assert stored.tolist() == expected.tolist()
+    assert_aggregates_match_rebuild(loader_db)
+
+
+def test_failed_row_keeps_its_old_version(loader_db):
+    base = trips_frame(12)
+    load(base, upsert=False)
+    failing = base["id"][6]
+    conn = sqlite3.connect(loader_db)
+    conn.execute(f"CREATE TRIGGER reject_row BEFORE INSERT ON trips WHEN NEW.id = '{failing}' "
+                 "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    conn.commit()
+    conn.close()
+
+    updates = base.iloc[[4, 5, 6, 8]].copy()
+    updates["passenger_count"] = 6
+    # The failing trip also moved: its old row must not be deleted
+    updates.loc[updates["id"] == failing, "pickup_datetime"] += pd.Timedelta(hours=3)
+    loader = load(updates)
+
+    assert loader.error_count == 1
+    assert loader.failed_rows == [2]
+    assert loader.success_count == 3
+    trips = stored_trips(loader_db).set_index("id")
+    assert len(trips) == 12
+    assert trips.loc[failing, "passenger_count"] == base["passenger_count"][6]
+    assert str(trips.loc[failing, "pickup_datetime"]) == str(base["pickup_datetime"][6])
+    assert (trips.loc[updates["id"][updates["id"] != failing], "passenger_count"] == 6).all()
+    assert_aggregates_match_rebuild(loader_db)
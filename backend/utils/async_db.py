@@ -0,0 +1,77 @@
+"""
+Async access to the MySQL pool for async views
+
+mysql-connector is blocking, so each query runs on a worker thread with its
+own pooled connection while the view awaits it. Independent queries within a
+request can then run at the same time:
+
+    trips, count = await asyncio.gather(
+        fetch_all("SELECT ... LIMIT 100"), fetch_one("SELECT COUNT(*) ..."))
+
+The request context is copied into the worker thread, so the metrics layer
+still attributes each query to its endpoint. Queries in flight are bounded by
+ASYNC_DB_THREADS and, below that, by the connection pool size.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .db_connection import POOL_SIZE, get_db_connection
+
+ASYNC_DB_THREADS = int(os.environ.get("ASYNC_DB_THREADS", POOL_SIZE))
+
+# Shared by every event loop (Flask runs each async view in its own loop)
+_executor = ThreadPoolExecutor(max_workers=ASYNC_DB_THREADS, thread_name_prefix="async-db")
+
+
+class DatabaseUnavailable(RuntimeError):
+    """Raised when no pooled connection could be checked out"""
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Run a blocking callable on the DB thread pool with the caller's context"""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+
+def _with_cursor(func, args, dictionary):
+    conn = get_db_connection()
+    if not conn:
+        raise DatabaseUnavailable("Database connection failed")
+    try:
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            return func(cursor, *args)
+        finally:
+            cursor.close()
+    finally:
+        # Return the connection to the pool
+        conn.close()
+
+
+async def with_cursor(func, *args, dictionary=True):
+    """await func(cursor, *args) on its own pooled connection"""
+    return await run_in_thread(_with_cursor, func, args, dictionary)
+
+
+def _fetch_all(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.fetchall()
+
+
+def _fetch_one(cursor, query, params):
+    cursor.execute(query, params)
+    return cursor.fetchone()
+
+
+async def fetch_all(query, params=(), dictionary=True):
+    """All rows of a query, run on its own pooled connection"""
+    return await with_cursor(_fetch_all, query, params, dictionary=dictionary)
+
+
+async def fetch_one(query, params=(), dictionary=True):
+    """First row of a query (or None), run on its own pooled connection"""
+    return await with_cursor(_fetch_one, query, params, dictionary=dictionary)
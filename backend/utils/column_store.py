@@ -0,0 +1,557 @@
+"""
+Memory-mapped columnar store for the read API
+
+Between loads the trips never change, so insert_data.py can also write them
+out as one NumPy array per column, sorted by (pickup_datetime, id). With
+TRIPS_BACKEND=columnar the trips and insights routes answer from these files
+instead of MySQL: time ranges are binary searches on the sorted pickup
+column, filters and aggregates are vectorized over the arrays, and only the
+rows on the returned page are turned into dicts. The arrays are opened with
+mmap, so every worker process reads the same pages from the OS page cache.
+
+A few small sort indexes sit next to the columns: trip ids, speeds (for
+cursor pages ordered by speed) and the pickup/dropoff grid cells (for
+/nearby). Each build goes into a new directory and CURRENT is switched to it
+atomically; readers notice the switch on their next request. The version
+before the current one is kept until the next build, so a reader that is
+still opening it doesn't lose its files.
+"""
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from .trip_rollup import NULL_VENDOR_ID
+from .trip_summary import NULL_PASSENGER_COUNT, SUMMARY_MEASURES
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "mysql" (default) or "columnar"
+TRIPS_BACKEND = os.environ.get("TRIPS_BACKEND", "mysql")
+COLUMN_STORE_DIR = os.environ.get("COLUMN_STORE_DIR", os.path.join(BASE_DIR, "data/column_store"))
+
+# Storage kind of each trips column, in table order
+STORE_COLUMNS = {
+    "id": "str",
+    "vendor_id": "str",
+    "pickup_datetime": "datetime",
+    "dropoff_datetime": "datetime",
+    "passenger_count": "int",
+    "pickup_longitude": "float",
+    "pickup_latitude": "float",
+    "dropoff_longitude": "float",
+    "dropoff_latitude": "float",
+    "store_and_fwd_flag": "str",
+    "trip_duration": "int",
+    "trip_distance_km": "float",
+    "trip_duration_min": "float",
+    "speed_kmh": "float",
+    "fare_per_km": "float",
+    "pickup_cell": "int",
+    "dropoff_cell": "int",
+}
+
+# NULL in int columns (strings use "", floats NaN, datetimes NaT)
+NULL_INT = np.iinfo(np.int32).min
+
+# Columns with a sort index: <column>_order.npy holds row positions sorted by
+# (value, id), skipping NULLs, and <column>_sorted.npy the matching values
+SORT_INDEXES = ("id", "speed_kmh", "pickup_cell", "dropoff_cell")
+
+# Rows filtered per vectorized step when scanning for a page or an export
+SCAN_BLOCK = 65536
+
+EARTH_RADIUS_KM = 6371.0
+
+# Tries at opening the current version when builds keep replacing it
+OPEN_ATTEMPTS = 3
+
+
+class ColumnStoreError(RuntimeError):
+    """Raised when the columnar backend is selected but no store has been built"""
+
+
+def _to_array(series, kind):
+    if kind == "str":
+        values = series.astype(object).where(series.notna(), "").astype(str).to_numpy()
+        return values.astype("S")
+    if kind == "datetime":
+        return pd.to_datetime(series, errors="coerce").to_numpy(dtype="datetime64[s]")
+    if kind == "int":
+        return pd.to_numeric(series, errors="coerce").fillna(NULL_INT).to_numpy(dtype="int32")
+    return pd.to_numeric(series, errors="coerce").to_numpy(dtype="float64")
+
+
+def _sort_index(values, ids, kind):
+    """Positions of the non-NULL values sorted by (value, id), and the sorted values"""
+    if kind == "float":
+        valid = np.flatnonzero(~np.isnan(values))
+    elif kind == "int":
+        valid = np.flatnonzero(values != NULL_INT)
+    else:
+        valid = np.arange(len(values))
+    order = valid[np.lexsort((ids[valid], values[valid]))]
+    return order.astype("int64"), values[order]
+
+
+def build_column_store(df, directory=COLUMN_STORE_DIR):
+    """Write the trips in `df` as a new store version under `directory` and make it current"""
+    start = time.perf_counter()
+    df = df[df["pickup_datetime"].notna()]
+    arrays = {col: _to_array(df[col], kind) for col, kind in STORE_COLUMNS.items()}
+
+    # Physical order is (pickup_datetime, id), like the keyset index in MySQL
+    order = np.lexsort((arrays["id"], arrays["pickup_datetime"]))
+    arrays = {col: values[order] for col, values in arrays.items()}
+
+    # UTC down to the nanosecond, so names sort by build time and two builds in
+    # the same second don't collide
+    built_ns = time.time_ns()
+    version = (f"v{time.strftime('%Y%m%d%H%M%S', time.gmtime(built_ns // 10**9))}"
+               f".{built_ns % 10**9:09d}-{os.getpid()}")
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+    for col, values in arrays.items():
+        np.save(os.path.join(path, f"{col}.npy"), values)
+    for col in SORT_INDEXES:
+        positions, values = _sort_index(arrays[col], arrays["id"], STORE_COLUMNS[col])
+        np.save(os.path.join(path, f"{col}_order.npy"), positions)
+        np.save(os.path.join(path, f"{col}_sorted.npy"), values)
+
+    pickups = arrays["pickup_datetime"]
+    meta = {
+        "rows": len(pickups),
+        "columns": STORE_COLUMNS,
+        "first_pickup": str(pickups[0]) if len(pickups) else None,
+        "last_pickup": str(pickups[-1]) if len(pickups) else None,
+        "built_at": datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    # Atomic switch; processes still reading the old version keep their mappings
+    previous = _current_version(directory)
+    tmp_file = os.path.join(directory, f"CURRENT.{version}.tmp")
+    with open(tmp_file, "w") as f:
+        f.write(version)
+    os.replace(tmp_file, os.path.join(directory, "CURRENT"))
+    # The previous version stays until the next switch, for readers that read
+    # CURRENT just before this one and are still opening it. Newer names are
+    # builds still being written.
+    if previous is not None:
+        for name in os.listdir(directory):
+            if name.startswith("v") and name < previous:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    print(f"Column store {version}: {meta['rows']} trips written to {path} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return path
+
+
+def _datetime_value(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.replace(" ", "T")
+    return np.datetime64(value, "s")
+
+
+def _haversine_km(lat, lon, lats, lons):
+    """Vectorized great-circle distance from (lat, lon) to each point"""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class ColumnStore:
+    """
+    One store version opened read-only. `filters` arguments are
+    (min_speed, max_speed, start, end, passenger_count) tuples with the
+    meaning build_trip_filters gives them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.kinds = self.meta["columns"]
+        self.column_names = list(self.kinds)
+        self.rows = self.meta["rows"]
+        self.columns = {col: self._load(col) for col in self.kinds}
+        self.indexes = {col: (self._load(f"{col}_order"), self._load(f"{col}_sorted")) for col in SORT_INDEXES}
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def to_frame(self):
+        """Every trip as a frame in the shape build_column_store takes (NULLs as None/NaN)"""
+        frame = {}
+        for col, kind in self.kinds.items():
+            values = np.asarray(self.columns[col])
+            if kind == "str":
+                values = pd.Series(values).str.decode("utf-8")
+                values = values.where(values != "", None)
+            elif kind == "int":
+                values = np.where(values == NULL_INT, np.nan, values)
+            frame[col] = values
+        return pd.DataFrame(frame)
+
+    # --- Row access ---
+
+    def to_dicts(self, positions, columns=None):
+        """Rows at `positions` as dicts of plain Python values (None for NULL), like the MySQL cursor"""
+        columns = self.projection(columns)
+        positions = np.asarray(positions, dtype="int64")
+        values = [self._column_values(col, positions) for col in columns]
+        return [dict(zip(columns, row)) for row in zip(*values)]
+
+    def to_tuples(self, positions, columns=None):
+        positions = np.asarray(positions, dtype="int64")
+        return list(zip(*(self._column_values(col, positions) for col in self.projection(columns))))
+
+    def to_columns(self, positions, columns=None):
+        """Rows at `positions` as one list of values per column"""
+        positions = np.asarray(positions, dtype="int64")
+        return {col: self._column_values(col, positions) for col in self.projection(columns)}
+
+    def projection(self, columns):
+        """The requested columns this store has (all of them for None)"""
+        if columns is None:
+            return self.column_names
+        return [col for col in columns if col in self.kinds]
+
+    def _column_values(self, col, positions):
+        values = self.columns[col][positions]
+        kind = self.kinds[col]
+        if kind == "str":
+            return [v.decode() or None for v in values.tolist()]
+        result = values.tolist()  # datetime64[s] gives datetime objects, NaT gives None
+        if kind == "float":
+            missing = np.flatnonzero(np.isnan(values))
+        elif kind == "int":
+            missing = np.flatnonzero(values == NULL_INT)
+        else:
+            return result
+        for i in missing:
+            result[i] = None
+        return result
+
+    def get(self, trip_id):
+        """The trip with this id as a dict, or None"""
+        order, sorted_ids = self.indexes["id"]
+        key = str(trip_id).encode()
+        i = np.searchsorted(sorted_ids, key)
+        if i < len(sorted_ids) and sorted_ids[i] == key:
+            return self.to_dicts([order[i]])[0]
+        return None
+
+    def get_many(self, trip_ids, columns=None):
+        """{id: trip dict} for the trips among `trip_ids` that exist, with one vectorized lookup"""
+        order, sorted_ids = self.indexes["id"]
+        # Longer ids can't be stored, and would compare truncated
+        trip_ids = [trip_id for trip_id in trip_ids if len(trip_id.encode()) <= sorted_ids.dtype.itemsize]
+        if not trip_ids or not len(sorted_ids):
+            return {}
+        keys = np.array([trip_id.encode() for trip_id in trip_ids], dtype=sorted_ids.dtype)
+        found = np.searchsorted(sorted_ids, keys)
+        found[found == len(sorted_ids)] = 0
+        hits = np.flatnonzero(sorted_ids[found] == keys)
+        trips = self.to_dicts(order[found[hits]], columns)
+        return dict(zip((trip_ids[i] for i in hits), trips))
+
+    # --- Filtering ---
+
+    def _time_bounds(self, start, end):
+        """[lo, hi) row range with pickup_datetime in [start, end)"""
+        pickups = self.columns["pickup_datetime"]
+        lo = np.searchsorted(pickups, _datetime_value(start), "left") if start is not None else 0
+        hi = np.searchsorted(pickups, _datetime_value(end), "left") if end is not None else self.rows
+        return int(lo), int(hi)
+
+    def _mask(self, rows, filters, check_time=False):
+        """Boolean mask over `rows` (a slice or positions) for the non-time filters"""
+        min_speed, max_speed, start, end, passenger_count = filters
+        mask = None
+
+        def combine(condition):
+            return condition if mask is None else mask & condition
+
+        if check_time and (start is not None or end is not None):
+            pickups = self.columns["pickup_datetime"][rows]
+            if start is not None:
+                mask = combine(pickups >= _datetime_value(start))
+            if end is not None:
+                mask = combine(pickups < _datetime_value(end))
+        if passenger_count is not None:
+            mask = combine(self.columns["passenger_count"][rows] == passenger_count)
+        if min_speed is not None or max_speed is not None:
+            speeds = self.columns["speed_kmh"][rows]
+            # NaN compares false, like NULL in SQL
+            if min_speed is not None:
+                mask = combine(speeds >= min_speed)
+            if max_speed is not None:
+                mask = combine(speeds <= max_speed)
+        return mask
+
+    def _iter_matches(self, filters, order_by=None, after=None):
+        """Blocks of matching row positions in (order_by, id) order (physical order when None)"""
+        _, _, start, end, _ = filters
+        if order_by in (None, "pickup_datetime"):
+            lo, hi = self._time_bounds(start, end)
+            if after is not None:
+                lo = max(lo, self._position_after(self.columns["pickup_datetime"], None,
+                                                  _datetime_value(after[0]), after[1]))
+            for block_start in range(lo, hi, SCAN_BLOCK):
+                block = slice(block_start, min(block_start + SCAN_BLOCK, hi))
+                mask = self._mask(block, filters)
+                if mask is None:
+                    yield np.arange(block.start, block.stop)
+                else:
+                    yield block.start + np.flatnonzero(mask)
+        else:
+            order, sorted_values = self.indexes[order_by]
+            first = 0
+            if after is not None:
+                first = self._position_after(sorted_values, order, float(after[0]), after[1])
+            for block_start in range(first, len(order), SCAN_BLOCK):
+                positions = np.asarray(order[block_start:block_start + SCAN_BLOCK])
+                mask = self._mask(positions, filters, check_time=True)
+                yield positions if mask is None else positions[mask]
+
+    def _position_after(self, sorted_values, order, value, last_id):
+        """Index of the first entry after (value, last_id) in a (value, id) sorted index"""
+        first = np.searchsorted(sorted_values, value, "left")
+        last = np.searchsorted(sorted_values, value, "right")
+        ties = self.columns["id"][first:last] if order is None else self.columns["id"][order[first:last]]
+        return int(first + np.searchsorted(ties, str(last_id).encode(), "right"))
+
+    def page(self, filters, limit, offset=0, order_by=None, after=None):
+        """Positions of up to `limit` matching rows, skipping `offset`"""
+        found = []
+        wanted = offset + limit
+        count = 0
+        for positions in self._iter_matches(filters, order_by, after):
+            found.append(positions)
+            count += len(positions)
+            if count >= wanted:
+                break
+        if not found:
+            return np.empty(0, dtype="int64")
+        return np.concatenate(found)[offset:wanted]
+
+    def count(self, filters):
+        """Number of matching trips"""
+        min_speed, max_speed, start, end, passenger_count = filters
+        lo, hi = self._time_bounds(start, end)
+        if min_speed is None and max_speed is None and passenger_count is None:
+            return hi - lo
+        return int(sum(len(positions) for positions in self._iter_matches(filters)))
+
+    def iter_rows(self, filters, limit=None, batch_size=SCAN_BLOCK, columns=None):
+        """Matching rows as lists of tuples in `columns` (default column_names) order, for exports"""
+        remaining = limit
+        for positions in self._iter_matches(filters):
+            if remaining is not None:
+                positions = positions[:remaining]
+                remaining -= len(positions)
+            for i in range(0, len(positions), batch_size):
+                yield self.to_tuples(positions[i:i + batch_size], columns)
+            if remaining == 0:
+                break
+
+    def nearby(self, point, lat, lon, radius_km, ranges, box):
+        """
+        (positions, distances) of trips whose `point` lies within radius_km,
+        nearest first, and the number of candidates inside the cells and box
+        """
+        order, sorted_cells = self.indexes[f"{point}_cell"]
+        slices = [order[np.searchsorted(sorted_cells, first, "left"):np.searchsorted(sorted_cells, last, "right")]
+                  for first, last in ranges]
+        positions = np.concatenate(slices) if slices else np.empty(0, dtype="int64")
+        lats = self.columns[f"{point}_latitude"][positions]
+        lons = self.columns[f"{point}_longitude"][positions]
+        min_lat, max_lat, min_lon, max_lon = box
+        in_box = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+        positions, lats, lons = positions[in_box], lats[in_box], lons[in_box]
+
+        distances = _haversine_km(lat, lon, lats, lons)
+        inside = distances <= radius_km
+        positions, distances = positions[inside], distances[inside]
+        nearest = np.lexsort((self.columns["id"][positions], distances))
+        return positions[nearest], distances[nearest], int(in_box.sum())
+
+    # --- Aggregates ---
+
+    def _passenger_codes(self):
+        """passenger_count with NULL as NULL_PASSENGER_COUNT, as in trip_summary/trip_rollup"""
+        counts = np.asarray(self.columns["passenger_count"], dtype="int64")
+        return np.where(counts == NULL_INT, NULL_PASSENGER_COUNT, counts)
+
+    def summary_groups(self):
+        """Per-passenger_count aggregates in the shape of trip_summary rows"""
+        codes, inverse = np.unique(self._passenger_codes(), return_inverse=True)
+        groups = [{"passenger_count": int(code)} for code in codes]
+        for group, measures in zip(groups, self._group_measures(inverse, len(codes))):
+            group.update(measures)
+        return groups
+
+    def _group_measures(self, inverse, groups, mask=None):
+        """
+        trip_count and the SUMMARY_MEASURES sums/counts for each group id in
+        `inverse` (which covers the rows selected by `mask`, or all rows)
+        """
+        result = [{"trip_count": int(n)} for n in np.bincount(inverse, minlength=groups)]
+        for col, prefix in SUMMARY_MEASURES:
+            values = np.asarray(self.columns[col])
+            if mask is not None:
+                values = values[mask]
+            valid = ~np.isnan(values)
+            sums = np.bincount(inverse[valid], weights=values[valid], minlength=groups)
+            counts = np.bincount(inverse[valid], minlength=groups)
+            for group, total, n in zip(result, sums, counts):
+                group[f"{prefix}_sum"] = float(total)
+                group[f"{prefix}_count"] = int(n)
+        return result
+
+    def hourly_counts(self):
+        """(hours, counts) of pickups by hour of day, hours with no trips left out"""
+        seconds = np.asarray(self.columns["pickup_datetime"]).astype("int64")
+        counts = np.bincount((seconds // 3600) % 24, minlength=24)
+        hours = np.flatnonzero(counts)
+        return hours.tolist(), counts[hours].tolist()
+
+    def passenger_counts(self):
+        """(passenger_counts, trip_counts), NULLs left out"""
+        codes = self._passenger_codes()
+        values, counts = np.unique(codes[codes != NULL_PASSENGER_COUNT], return_counts=True)
+        return values.tolist(), counts.tolist()
+
+    def _dimension(self, dimension):
+        """Values of a rollup dimension for every row (sentinels for NULL, like trip_rollup)"""
+        if dimension == "passenger_count":
+            return self._passenger_codes()
+        if dimension == "vendor_id":
+            return np.asarray(self.columns["vendor_id"])
+        seconds = np.asarray(self.columns["pickup_datetime"]).astype("int64")
+        days = seconds // 86400
+        if dimension == "date":
+            return days
+        if dimension == "hour":
+            return (seconds // 3600) % 24
+        # day_of_week, Monday = 0 like MySQL WEEKDAY(); 1970-01-01 was a Thursday
+        return (days + 3) % 7
+
+    def _filter_value(self, dimension, value):
+        if dimension == "date":
+            return (np.datetime64(value, "D") - np.datetime64("1970-01-01", "D")).astype("int64")
+        if dimension == "vendor_id":
+            return str(value).encode()
+        return value
+
+    def rollup(self, group_by, filters):
+        """
+        Rows shaped like build_rollup_query() results (format_rollup_row
+        turns them into the API shape), computed over the trips directly
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        for dimension, (kind, values) in filters.items():
+            column = self._dimension(dimension)
+            values = [self._filter_value(dimension, v) for v in values]
+            if kind == "range":
+                mask &= (column >= values[0]) & (column <= values[1])
+            else:
+                mask &= np.isin(column, values)
+
+        if group_by:
+            keys = [self._dimension(d)[mask] for d in group_by]
+            uniques, inverses = zip(*(np.unique(key, return_inverse=True) for key in keys))
+            combined = np.ravel_multi_index(inverses, [len(u) for u in uniques]) if len(keys) > 1 else inverses[0]
+            group_ids, inverse = np.unique(combined, return_inverse=True)
+            indices = np.unravel_index(group_ids, [len(u) for u in uniques])
+        else:
+            inverse, group_ids, uniques, indices = np.zeros(int(mask.sum()), dtype="int64"), [0], [], []
+
+        result = self._group_measures(inverse, len(group_ids), mask)
+        for dimension, unique, index in zip(group_by, uniques, indices):
+            for row, value in zip(result, unique[index].tolist()):
+                if dimension == "date":
+                    value = datetime.date(1970, 1, 1) + datetime.timedelta(days=value)
+                elif dimension == "vendor_id":
+                    value = value.decode() or NULL_VENDOR_ID
+                row[dimension] = value
+        return result
+
+    def speeds(self):
+        """The speed_kmh column (NaN for NULL)"""
+        return self.columns["speed_kmh"]
+
+
+_lock = threading.Lock()
+_current = {"key": None, "store": None}
+
+
+def _current_version(directory):
+    """Name of the version CURRENT points at, or None before the first build"""
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def open_column_store(directory=COLUMN_STORE_DIR):
+    """The current store version, reopened when a new build is switched in"""
+    current_file = os.path.join(directory, "CURRENT")
+    with _lock:
+        for attempt in range(OPEN_ATTEMPTS):
+            try:
+                mtime = os.stat(current_file).st_mtime_ns
+            except OSError:
+                raise ColumnStoreError(f"No column store in {directory}; build one with "
+                                       f"scripts/insert_data.py --column-store")
+            if _current["key"] == (directory, mtime):
+                break
+            try:
+                with open(current_file) as f:
+                    version = f.read().strip()
+                store = ColumnStore(os.path.join(directory, version))
+            except OSError:
+                # Builds switched twice while this version was being opened and
+                # removed it; CURRENT names a newer one by now
+                if attempt == OPEN_ATTEMPTS - 1:
+                    raise
+                continue
+            _current["store"] = store
+            _current["key"] = (directory, mtime)
+            break
+        return _current["store"]
+
+
+def update_column_store(df, directory=COLUMN_STORE_DIR):
+    """
+    Write a new store version with the trips in `df` upserted: stored trips
+    with the same id are replaced, as ingest_trips.py does in MySQL. Returns
+    the new version's path, or None when no store has been built yet.
+    """
+    try:
+        store = open_column_store(directory)
+    except ColumnStoreError:
+        return None
+    df = df.drop_duplicates("id", keep="last")
+    stored = store.to_frame()
+    stored = stored[~stored["id"].isin(df["id"])]
+    frames = [stored, df[list(STORE_COLUMNS)]] if len(stored) else [df[list(STORE_COLUMNS)]]
+    return build_column_store(pd.concat(frames, ignore_index=True), directory)
+
+
+def get_column_store():
+    """The store when TRIPS_BACKEND is "columnar", otherwise None (use MySQL)"""
+    if TRIPS_BACKEND != "columnar":
+        return None
+    return open_column_store(COLUMN_STORE_DIR)
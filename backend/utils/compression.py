@@ -0,0 +1,82 @@
+"""
+gzip / brotli compression of API responses
+
+Responses are compressed with the best encoding the client accepts: brotli
+when the `brotli` package is installed and the client sends `br`, gzip
+otherwise. Streamed responses (exports) and files sent by Flask are left
+alone, as are bodies too small to be worth it. Compressed responses get a
+weak ETag, since the bytes differ per encoding while the content doesn't.
+"""
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSION_ENABLED = os.environ.get("COMPRESSION_ENABLED", "1") != "0"
+# Smaller bodies fit in a packet or two anyway
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))
+# Brotli's higher qualities are far slower for little gain on JSON
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/csv",
+    "text/css",
+    "text/html",
+    "text/javascript",
+    "text/plain",
+}
+
+
+def choose_encoding():
+    """The Content-Encoding to use for this request, or None"""
+    accepted = request.accept_encodings
+    encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+    # Highest quality wins; on a tie the earlier (smaller) encoding does
+    best = max(encodings, key=lambda encoding: accepted[encoding])
+    return best if accepted[best] > 0 else None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response):
+    """after_request hook compressing the response body in place"""
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    # The body depends on Accept-Encoding from here on, whatever we pick
+    response.vary.add("Accept-Encoding")
+
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers):
+        return response
+    if (response.content_length or 0) < COMPRESS_MIN_BYTES:
+        return response
+
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Compress the app's responses (COMPRESSION_ENABLED=0 turns it off)"""
+    if COMPRESSION_ENABLED:
+        app.after_request(compress_response)
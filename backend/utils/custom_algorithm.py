@@ -4,6 +4,14 @@ Custom algorithm implementation for NYC mobility insights
 import pandas as pd
 import numpy as np
 from .helpers import haversine_distance
+from .streaming_stats import HourlyHistogram, RunningStats
+
+# Fare formula used by estimate_trip_fare / estimate_trip_fares
+BASE_FARE = 2.50
+FARE_PER_KM = 2.50
+FARE_PER_MINUTE = 0.50
+# Per passenger beyond the first
+EXTRA_PASSENGER_FARE = 0.50
 
 def estimate_trip_fare(distance_km, duration_min, passenger_count=1):
     """
@@ -13,50 +21,66 @@ def estimate_trip_fare(distance_km, duration_min, passenger_count=1):
     custom algorithm logic.
     """
     # Base fare
-    base_fare = 2.50
+    base_fare = BASE_FARE
     
     # Distance component: $2.50 per km
-    distance_fare = distance_km * 2.50
+    distance_fare = distance_km * FARE_PER_KM
     
     # Time component: $0.50 per minute
-    time_fare = duration_min * 0.50
+    time_fare = duration_min * FARE_PER_MINUTE
     
     # Passenger surcharge: $0.50 per additional passenger beyond the first
-    passenger_surcharge = max(0, passenger_count - 1) * 0.50
+    passenger_surcharge = max(0, passenger_count - 1) * EXTRA_PASSENGER_FARE
     
     # Total fare
     total_fare = base_fare + distance_fare + time_fare + passenger_surcharge
     
     return round(total_fare, 2)
 
-def identify_peak_hours(trip_df):
+def estimate_trip_fares(distance_km, duration_min, passenger_count=None):
+    """
+    estimate_trip_fare over whole arrays (or Series) in one pass
+
+    Returns a float array of fares rounded to cents. A missing distance or
+    duration gives NaN; a missing passenger count counts as one passenger,
+    like the scalar default.
+    """
+    fares = BASE_FARE + _floats(distance_km) * FARE_PER_KM + _floats(duration_min) * FARE_PER_MINUTE
+    if passenger_count is not None:
+        passengers = np.nan_to_num(_floats(passenger_count), nan=1)
+        fares = fares + np.maximum(passengers - 1, 0) * EXTRA_PASSENGER_FARE
+    return np.round(fares, 2)
+
+def _floats(values):
+    """float64 array of `values`; None, <NA> and non-numbers become NaN"""
+    array = np.asarray(values) if not isinstance(values, pd.Series) else None
+    if array is not None and array.dtype.kind in "biuf":
+        return array.astype("float64", copy=False).ravel()
+    values = values if array is None else pd.Series(array.astype(object).ravel())
+    return pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+
+def identify_peak_hours(trip_df=None, histogram=None):
     """
     Identify peak hours based on trip volume
     Returns a list of hour integers (0-23)
+
+    Pass either a DataFrame with `pickup_datetime` (it is not modified) or an
+    HourlyHistogram already fed chunk by chunk / merged across partitions.
     """
-    # Convert pickup_datetime to datetime if it's not already
-    if trip_df['pickup_datetime'].dtype != 'datetime64[ns]':
-        trip_df['pickup_datetime'] = pd.to_datetime(trip_df['pickup_datetime'])
-    
-    # Extract hour from pickup_datetime
-    trip_df['hour'] = trip_df['pickup_datetime'].dt.hour
-    
-    # Count trips by hour
-    hourly_counts = trip_df['hour'].value_counts().sort_index()
-    
-    # Calculate the mean and standard deviation of hourly counts
-    mean_count = hourly_counts.mean()
-    std_count = hourly_counts.std()
-    
-    # Identify hours that are more than 1 std dev above the mean
-    peak_hours = hourly_counts[hourly_counts > (mean_count + std_count)].index.tolist()
-    
-    return peak_hours
+    if histogram is None:
+        histogram = HourlyHistogram().update(trip_df['pickup_datetime'])
+
+    # Hours more than 1 std dev above the mean hourly count
+    return histogram.peak_hours()
 
-def detect_outlier_speeds(speeds, z_threshold=3.0):
+def detect_outlier_speeds(speeds, z_threshold=3.0, stats=None):
     """
     Detect outlier speeds using z-score method
     Returns boolean array where True indicates an outlier
+
+    `stats` is a RunningStats over the whole dataset, so a single chunk can be
+    checked against global mean/std; without it they come from `speeds`.
     """
-    z_scores = np.abs((speeds - np.mean(speeds)) / np.std(speeds))
-    return z_scores > z_threshold
+    if stats is None:
+        stats = RunningStats().update(speeds)
+    return stats.z_scores(speeds) > z_threshold
@@ -0,0 +1,48 @@
+"""
+Dataset version marker shared by the loader and the API
+
+insert_data.py bumps the version after every successful load. Readers only
+stat() the file and re-read it when its mtime changes, so checking the
+version is cheap enough to do on every request.
+"""
+import os
+import threading
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VERSION_FILE = os.environ.get("DATASET_VERSION_FILE", os.path.join(BASE_DIR, "data/dataset.version"))
+
+_lock = threading.Lock()
+_cached = {"mtime": None, "version": None}
+
+
+def get_dataset_version():
+    """Return the current dataset version string, or None if never loaded"""
+    try:
+        mtime = os.stat(VERSION_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+    with _lock:
+        if _cached["mtime"] != mtime:
+            with open(VERSION_FILE) as f:
+                _cached["version"] = f.read().strip() or None
+            _cached["mtime"] = mtime
+        return _cached["version"]
+
+
+def bump_dataset_version():
+    """Increment the dataset version after new data has been committed"""
+    try:
+        with open(VERSION_FILE) as f:
+            current = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        current = 0
+
+    new_version = current + 1
+    os.makedirs(os.path.dirname(VERSION_FILE), exist_ok=True)
+    tmp_file = f"{VERSION_FILE}.tmp"
+    with open(tmp_file, "w") as f:
+        f.write(f"{new_version}\n")
+    # Atomic swap so readers never see a half-written file
+    os.replace(tmp_file, VERSION_FILE)
+    return str(new_version)
@@ -1,8 +1,17 @@
 """
-Database connection utilities for the NYC Mobility App
+Database connection pool for the NYC Mobility App
+
+All routes share one process-wide pool of MySQL connections instead of
+opening a new connection per request. Connections are health-checked on
+checkout (pre-ping), recycled once they get too old, and checkouts wait at
+most POOL_TIMEOUT seconds for a free slot.
 """
 import os
 import sys
+import threading
+import time
+from collections import deque
+
 import mysql.connector
 from mysql.connector import Error
 
@@ -12,27 +21,228 @@ if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 from config.db_config import get_db_config
 
-def create_connection():
-    """Create a connection to the MySQL database"""
-    try:
-        config = get_db_config()
+from .metrics import instrument_connection
+
+# Pool settings (can be overridden with environment variables)
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+POOL_RECYCLE = float(os.environ.get("DB_POOL_RECYCLE", 1800))
+POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+
+
+class PoolTimeoutError(Error):
+    """Raised when no connection becomes free within the checkout timeout"""
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a MySQL connection that returns it to the pool
+    on close() instead of tearing down the socket.
+    """
+
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self._closed = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._pool._release(self._conn, self._created_at)
+
+
+class ConnectionPool:
+    """Fixed-size, thread-safe pool of MySQL connections"""
+
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT, recycle=POOL_RECYCLE,
+                 pre_ping=POOL_PRE_PING, config=None):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._config = config
+        self._idle = deque()  # (connection, created_at), most recently used on the right
+        self._lock = threading.Condition()
+        self._open = 0
+        self._in_use = 0
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_s": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+        }
+
+    def _connect(self):
+        config = self._config or get_db_config()
         conn = mysql.connector.connect(**config)
-        if conn.is_connected():
-            return conn
-        return None
+        with self._lock:
+            self._stats["connects"] += 1
+        return conn, time.monotonic()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Error:
+            pass
+
+    def _is_usable(self, conn, created_at):
+        """Check that an idle connection is young enough and still alive"""
+        if self.recycle and time.monotonic() - created_at > self.recycle:
+            with self._lock:
+                self._stats["recycled"] += 1
+            return False
+        if self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Error:
+                with self._lock:
+                    self._stats["ping_failures"] += 1
+                return False
+        return True
+
+    def get_connection(self):
+        """
+        Check out a connection, waiting up to `timeout` seconds for one
+        to become free. Raises PoolTimeoutError if none does.
+        """
+        start = time.monotonic()
+        waited = False
+        with self._lock:
+            while not self._idle and self._open >= self.size:
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        msg=f"Timed out after {self.timeout}s waiting for a database connection")
+                waited = True
+                self._lock.wait(remaining)
+
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time_s"] += time.monotonic() - start
+            self._stats["checkouts"] += 1
+            self._in_use += 1
+            if self._idle:
+                conn, created_at = self._idle.pop()
+            else:
+                conn, created_at = None, None
+                self._open += 1
+
+        # Validate or open the connection outside the lock
+        try:
+            if conn is not None and not self._is_usable(conn, created_at):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn, created_at = self._connect()
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._in_use -= 1
+                self._lock.notify()
+            raise
+
+        return PooledConnection(self, conn, created_at)
+
+    def _release(self, conn, created_at):
+        # End any open transaction so the next user starts from a clean snapshot
+        try:
+            conn.rollback()
+            reusable = True
+        except Error:
+            reusable = False
+
+        with self._lock:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append((conn, created_at))
+            else:
+                self._open -= 1
+            self._lock.notify()
+
+        if not reusable:
+            self._discard(conn)
+
+    def stats(self):
+        """Return a snapshot of pool usage counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+            })
+        stats["wait_time_s"] = round(stats["wait_time_s"], 6)
+        stats["avg_wait_time_s"] = round(stats["wait_time_s"] / stats["waits"], 6) if stats["waits"] else 0.0
+        return stats
+
+    def close_all(self):
+        """Close every idle connection (checked-out ones close on release)"""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_db_connection():
+    """
+    Check out a pooled connection, or return None if the database is
+    unreachable. Calling close() on it returns it to the pool.
+    """
+    try:
+        started = time.perf_counter()
+        conn = get_pool().get_connection()
+        return instrument_connection(conn, time.perf_counter() - started)
     except Error as e:
         print(f"Error connecting to MySQL: {e}")
         return None
 
+
+def get_pool_stats():
+    """Return usage counters for the shared pool"""
+    return get_pool().stats()
+
+
 def execute_query(conn, query, params=None, fetch=True):
     """Execute a query and return results if applicable"""
     try:
         cursor = conn.cursor(dictionary=True)
         cursor.execute(query, params or ())
-        
+
         if fetch:
             return cursor.fetchall()
-        
+
         conn.commit()
         return cursor.rowcount
     except Error as e:
@@ -41,8 +251,3 @@ def execute_query(conn, query, params=None, fetch=True):
     finally:
         if 'cursor' in locals():
             cursor.close()
-
-def close_connection(conn):
-    """Close the database connection"""
-    if conn and conn.is_connected():
-        conn.close()
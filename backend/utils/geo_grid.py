@@ -0,0 +1,57 @@
+"""
+Fixed-size latitude/longitude grid used to index trip pickups and dropoffs
+
+Each point maps to an integer cell id. Ids are laid out row by row
+(lat_index * LON_CELLS + lon_index), so the cells covering a bounding box are
+one contiguous id range per latitude row. That lets a radius search become a
+few BETWEEN ranges on an indexed column before any distance is computed.
+"""
+import math
+
+import numpy as np
+
+# 0.01 degrees is about 1.1 km north-south and 0.85 km east-west in NYC
+CELL_SIZE_DEG = 0.01
+LON_CELLS = int(round(360 / CELL_SIZE_DEG))
+
+KM_PER_DEG_LAT = 111.32
+EARTH_RADIUS_KM = 6371
+
+
+def cell_id(lat, lon):
+    """
+    Grid cell id for a point, or for arrays of points (NaN in, -1 out).
+    cell_id_sql() builds the matching SQL expression.
+    """
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    lat_index = np.floor((lat + 90) / CELL_SIZE_DEG)
+    lon_index = np.floor((lon + 180) / CELL_SIZE_DEG)
+    cells = lat_index * LON_CELLS + lon_index
+    cells = np.where(np.isnan(cells), -1, cells).astype("int64")
+    return int(cells) if cells.ndim == 0 else cells
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) of a box containing the circle"""
+    dlat = radius_km / KM_PER_DEG_LAT
+    # Widen the longitude span using the latitude edge closest to a pole
+    max_abs_lat = min(89.9, abs(lat) + dlat)
+    dlon = radius_km / (KM_PER_DEG_LAT * math.cos(math.radians(max_abs_lat)))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def cell_ranges(lat, lon, radius_km):
+    """Inclusive (first_cell, last_cell) id ranges covering the circle's bounding box, one per grid row"""
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    first_row = math.floor((min_lat + 90) / CELL_SIZE_DEG)
+    last_row = math.floor((max_lat + 90) / CELL_SIZE_DEG)
+    first_col = math.floor((min_lon + 180) / CELL_SIZE_DEG)
+    last_col = math.floor((max_lon + 180) / CELL_SIZE_DEG)
+    return [(row * LON_CELLS + first_col, row * LON_CELLS + last_col) for row in range(first_row, last_row + 1)]
+
+
+def cell_id_sql(lat_column, lon_column):
+    """SQL expression computing the same cell id as cell_id(), for backfilling existing rows"""
+    return (f"FLOOR(({lat_column} + 90) / {CELL_SIZE_DEG}) * {LON_CELLS} "
+            f"+ FLOOR(({lon_column} + 180) / {CELL_SIZE_DEG})")
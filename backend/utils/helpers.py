@@ -4,6 +4,8 @@ Helper functions for the NYC mobility app
 import datetime
 import math
 
+import numpy as np
+
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
     Calculate the great-circle distance between two points on Earth
@@ -21,6 +23,15 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     r = 6371  # Radius of Earth in kilometers
     return c * r
 
+def haversine_distances(lat1, lon1, lat2, lon2):
+    """
+    haversine_distance over arrays (or Series) of coordinates at once.
+    Returns a float array of kilometers, NaN where a coordinate is missing.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype="float64")) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
+
 def parse_datetime(datetime_str):
     """
     Parse datetime string to datetime object
@@ -36,6 +47,14 @@ def parse_datetime(datetime_str):
             except ValueError:
                 raise ValueError(f"Could not parse datetime string: {datetime_str}")
 
+def parse_flag(value):
+    """
+    Parse a boolean query parameter ('true'/'false', '1'/'0', 'yes'/'no')
+    """
+    if value is None:
+        return False
+    return value.strip().lower() in ("1", "true", "yes")
+
 def calculate_trip_duration_minutes(start_time, end_time):
     """
     Calculate trip duration in minutes between two datetime objects
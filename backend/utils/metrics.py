@@ -0,0 +1,394 @@
+"""
+Request and query instrumentation for the NYC Mobility App
+
+init_metrics(app) hooks into every request and records its latency, status
+and response size per endpoint. Connections handed out by get_db_connection()
+are wrapped so the connection checkout time, each query's execution + fetch
+time and the rows fetched are recorded as well, attributed to the endpoint
+that ran them. Queries and requests slower than SLOW_QUERY_MS /
+SLOW_REQUEST_MS are written to the slow-query log, and everything is served
+in the Prometheus text format at /metrics.
+
+With METRICS_ENABLED=0 no hooks are registered and connections are returned
+unwrapped, so the only cost left is one flag check per checkout.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") not in ("0", "false", "False")
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 500))
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 2000))
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", os.path.join(BASE_DIR, "data/logs/slow_queries.log"))
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Longest SQL text kept in a slow-query log line
+MAX_LOGGED_QUERY = 2000
+
+NO_ENDPOINT = "none"
+
+slow_log = logging.getLogger("nyc_mobility.slow")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, values)} {value}" for values, value in items]
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels (Prometheus semantics)"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        # label values -> [count per bucket..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            return sum(series[:-1]) if series else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((values, list(series)) for values, series in self._series.items())
+        lines = []
+        for values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {round(series[-1], 6)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics plus callables whose numeric results are exported as gauges"""
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = {}
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets, labels=()):
+        metric = Histogram(name, help_text, buckets, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def add_gauges(self, prefix, stats_func):
+        """Export every numeric value of stats_func() as a gauge named prefix_<key>"""
+        self._gauges[prefix] = stats_func
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for prefix, stats_func in self._gauges.items():
+            try:
+                stats = stats_func()
+            except Exception as e:
+                lines.append(f"# {prefix} unavailable: {e}")
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+REQUESTS = metrics.counter(
+    "http_requests_total", "HTTP requests by endpoint, method and status", ("endpoint", "method", "status"))
+REQUEST_LATENCY = metrics.histogram(
+    "http_request_duration_seconds", "Request latency, including streaming the body",
+    LATENCY_BUCKETS, ("endpoint", "method"))
+RESPONSE_SIZE = metrics.histogram(
+    "http_response_size_bytes", "Response body size", SIZE_BUCKETS, ("endpoint",))
+DB_CONNECT_LATENCY = metrics.histogram(
+    "db_connect_duration_seconds", "Time to check out a pooled connection", LATENCY_BUCKETS)
+DB_QUERY_LATENCY = metrics.histogram(
+    "db_query_duration_seconds", "Query execution plus fetch time", LATENCY_BUCKETS, ("endpoint",))
+DB_ROWS = metrics.histogram(
+    "db_rows_fetched", "Rows fetched per query", ROW_BUCKETS, ("endpoint",))
+DB_ERRORS = metrics.counter(
+    "db_query_errors_total", "Queries that raised an error", ("endpoint",))
+SLOW_QUERIES = metrics.counter(
+    "slow_queries_total", f"Queries slower than SLOW_QUERY_MS ({SLOW_QUERY_MS:g} ms)", ("endpoint",))
+SLOW_REQUESTS = metrics.counter(
+    "slow_requests_total", f"Requests slower than SLOW_REQUEST_MS ({SLOW_REQUEST_MS:g} ms)", ("endpoint",))
+
+
+class RequestStats:
+    """Database work done on behalf of one request"""
+
+    __slots__ = ("endpoint", "queries", "db_seconds", "rows")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+
+
+def _current_request_stats():
+    if has_request_context():
+        stats = g.get("request_stats")
+        if stats is None:
+            stats = g.request_stats = RequestStats(request.endpoint or NO_ENDPOINT)
+        return stats
+    return RequestStats(NO_ENDPOINT)
+
+
+class InstrumentedCursor:
+    """
+    Cursor wrapper that times each query from execute() until the next
+    execute() or close(), so fetches from unbuffered cursors are included.
+    """
+
+    def __init__(self, cursor, request_stats):
+        self._cursor = cursor
+        self._stats = request_stats
+        self._query = None
+        self._params = None
+        self._seconds = 0.0
+        self._rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._rows += 1
+            yield row
+
+    def _timed(self, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._seconds += time.perf_counter() - started
+
+    def execute(self, query, params=None, *args, **kwargs):
+        self._finish()
+        self._query, self._params = query, params
+        try:
+            return self._timed(self._cursor.execute, query, params, *args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(self._stats.endpoint)
+            raise
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._rows += len(rows)
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._timed(self._cursor.fetchmany, *args, **kwargs)
+        self._rows += len(rows)
+        return rows
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        self._rows += row is not None
+        return row
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def _finish(self):
+        """Record the current query, if any"""
+        if self._query is None:
+            return
+        endpoint = self._stats.endpoint
+        DB_QUERY_LATENCY.observe(self._seconds, endpoint)
+        DB_ROWS.observe(self._rows, endpoint)
+        self._stats.queries += 1
+        self._stats.db_seconds += self._seconds
+        self._stats.rows += self._rows
+        if self._seconds * 1000 >= SLOW_QUERY_MS:
+            SLOW_QUERIES.inc(endpoint)
+            query = " ".join(str(self._query).split())[:MAX_LOGGED_QUERY]
+            slow_log.warning("slow query %.1f ms endpoint=%s rows=%d query=%s params=%r",
+                             self._seconds * 1000, endpoint, self._rows, query, self._params)
+        self._query, self._params = None, None
+        self._seconds, self._rows = 0.0, 0
+
+
+class InstrumentedConnection:
+    """Connection wrapper whose cursors are instrumented; close() records open queries"""
+
+    def __init__(self, conn, request_stats):
+        self._conn = conn
+        self._stats = request_stats
+        self._cursors = []
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def cursor(self, *args, **kwargs):
+        cursor = InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._stats)
+        self._cursors.append(cursor)
+        return cursor
+
+    def close(self):
+        for cursor in self._cursors:
+            cursor._finish()
+        self._cursors = []
+        return self._conn.close()
+
+
+def instrument_connection(conn, connect_seconds):
+    """Wrap a freshly checked-out connection (returned as is when metrics are off)"""
+    if not METRICS_ENABLED or conn is None:
+        return conn
+    DB_CONNECT_LATENCY.observe(connect_seconds)
+    stats = _current_request_stats()
+    stats.db_seconds += connect_seconds
+    return InstrumentedConnection(conn, stats)
+
+
+def _configure_slow_log():
+    if slow_log.handlers or not SLOW_QUERY_LOG:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(SLOW_QUERY_LOG)), exist_ok=True)
+    handler = logging.FileHandler(SLOW_QUERY_LOG)
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_log.addHandler(handler)
+    slow_log.setLevel(logging.WARNING)
+
+
+def _record_request(endpoint, method, status, started, size, stats):
+    seconds = time.perf_counter() - started
+    REQUESTS.inc(endpoint, method, status)
+    REQUEST_LATENCY.observe(seconds, endpoint, method)
+    if size is not None:
+        RESPONSE_SIZE.observe(size, endpoint)
+    if seconds * 1000 >= SLOW_REQUEST_MS:
+        SLOW_REQUESTS.inc(endpoint)
+        slow_log.warning("slow request %.1f ms endpoint=%s method=%s status=%s bytes=%s "
+                         "queries=%d db_ms=%.1f rows=%d", seconds * 1000, endpoint, method, status,
+                         size, stats.queries, stats.db_seconds * 1000, stats.rows)
+
+
+def _counting(body, counter):
+    # Text chunks are counted in characters (the same as bytes for CSV/NDJSON exports)
+    try:
+        for chunk in body:
+            counter[0] += len(chunk)
+            yield chunk
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+
+
+def init_metrics(app, gauges=None):
+    """
+    Register the request hooks and the /metrics endpoint on `app`.
+    `gauges` maps a name prefix to a stats function (e.g. get_pool_stats).
+    """
+    if not METRICS_ENABLED:
+        return
+    _configure_slow_log()
+    for prefix, stats_func in (gauges or {}).items():
+        metrics.add_gauges(prefix, stats_func)
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        g.request_stats = RequestStats(request.endpoint or NO_ENDPOINT)
+
+    @app.after_request
+    def record_request(response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        stats = g.request_stats
+        endpoint, method, status = stats.endpoint, request.method, response.status_code
+        if status >= 500 and response.is_json:
+            error = (response.get_json(silent=True) or {}).get("error")
+            app.logger.error("%s %s failed with %s: %s", method, request.full_path, status, error)
+
+        if response.is_streamed and not response.direct_passthrough:
+            # Measure the whole stream: record once the server closes the response
+            counter = [0]
+            response.response = _counting(response.response, counter)
+            response.call_on_close(
+                lambda: _record_request(endpoint, method, status, started, counter[0], stats))
+        else:
+            size = None if response.direct_passthrough else response.content_length
+            _record_request(endpoint, method, status, started, size, stats)
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
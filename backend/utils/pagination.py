@@ -0,0 +1,106 @@
+"""
+Keyset pagination and row-count helpers for GET /api/trips
+
+Cursors are opaque, URL-safe tokens holding the sort column and the
+(sort value, id) of the last row on the previous page, so the next page is
+an index range scan instead of a growing OFFSET.
+"""
+import base64
+import datetime
+import json
+import threading
+import time
+
+from .trip_keys import KEY_COLUMN, primary_keys
+
+# Sort keys allowed for cursor pagination; each has a single-column index,
+# which InnoDB extends with the primary key, so (column, KEY_COLUMN) is index order.
+CURSOR_SORT_COLUMNS = ("speed_kmh", "pickup_datetime")
+
+# approx: optimizer estimate; sample: estimate with a confidence interval from trip_sample
+COUNT_MODES = ("exact", "approx", "sample", "none")
+
+# How long an exact count may be reused to answer count=approx
+COUNT_CACHE_TTL = 300
+COUNT_CACHE_MAX_ENTRIES = 256
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor can't be decoded"""
+
+
+def encode_cursor(sort_column, last_row):
+    """Build the cursor pointing just after `last_row`"""
+    value = last_row[sort_column]
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    payload = json.dumps([sort_column, value, last_row["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Return (sort_column, last_value, last_id) from a cursor token"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        sort_column, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {token}") from e
+    if sort_column not in CURSOR_SORT_COLUMNS:
+        raise InvalidCursorError(f"Invalid cursor sort column: {sort_column}")
+    return sort_column, value, last_id
+
+
+def keyset_condition(sort_column, last_value, last_id):
+    """
+    WHERE fragment and params selecting rows after (last_value, last_id).
+    Written as a range on the sort column so MySQL can use its index. Ties
+    are broken on the primary key column, so pages must be ordered by
+    (sort_column, KEY_COLUMN).
+    """
+    last_key = primary_keys([last_id])
+    if not last_key:
+        raise InvalidCursorError(f"Invalid cursor id: {last_id}")
+    condition = f" AND {sort_column} >= %s AND ({sort_column} > %s OR {KEY_COLUMN} > %s)"
+    return condition, [last_value, last_value, last_key[0]]
+
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+def remember_count(key, count):
+    """
+    Store an exact count so later count=approx requests can reuse it. `key`
+    has to include the dataset version as well as the filters.
+    """
+    with _count_cache_lock:
+        if len(_count_cache) >= COUNT_CACHE_MAX_ENTRIES and key not in _count_cache:
+            # Drop the oldest entry
+            oldest = min(_count_cache, key=lambda k: _count_cache[k][1])
+            del _count_cache[oldest]
+        _count_cache[key] = (count, time.monotonic())
+
+
+def cached_count(key):
+    """Return a recently computed exact count, or None"""
+    with _count_cache_lock:
+        entry = _count_cache.get(key)
+    if entry and time.monotonic() - entry[1] <= COUNT_CACHE_TTL:
+        return entry[0]
+    return None
+
+
+def estimate_count(cursor, where_clause, params):
+    """
+    Estimate the number of matching trips from optimizer statistics
+    (EXPLAIN rows * filtered%), without scanning the table.
+    """
+    cursor.execute(f"EXPLAIN SELECT id FROM trips WHERE 1=1{where_clause}", params)
+    plan = cursor.fetchall()
+    if not plan:
+        return 0
+    row = plan[0]
+    rows = row.get("rows") or 0
+    filtered = row.get("filtered")
+    filtered = 100.0 if filtered is None else float(filtered)
+    return int(round(rows * filtered / 100.0))
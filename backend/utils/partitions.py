@@ -0,0 +1,77 @@
+"""
+Monthly RANGE partitioning of the trips table by pickup_datetime
+
+One partition per month, plus p_start for anything older and p_future
+(MAXVALUE) for anything newer. Queries with a pickup_datetime range only
+touch the months they cover. The loader splits p_future when it sees trips
+past the last monthly partition.
+"""
+import datetime
+
+# Months created for a fresh table (the NYC TLC 2016 data)
+FIRST_MONTH = datetime.date(2016, 1, 1)
+LAST_MONTH = datetime.date(2016, 12, 1)
+
+START_PARTITION = "p_start"
+FUTURE_PARTITION = "p_future"
+
+
+def next_month(month):
+    return datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def month_start(value):
+    """First day of the month containing a date/datetime"""
+    return datetime.date(value.year, value.month, 1)
+
+
+def month_partitions(first_month, last_month):
+    """PARTITION definitions for each month from first_month to last_month"""
+    partitions = []
+    month = month_start(first_month)
+    while month <= last_month:
+        upper = next_month(month)
+        partitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{upper:%Y-%m-%d}')")
+        month = upper
+    return partitions
+
+
+def partition_clause(first_month=FIRST_MONTH, last_month=LAST_MONTH):
+    """PARTITION BY clause for CREATE TABLE / ALTER TABLE trips"""
+    partitions = [f"PARTITION {START_PARTITION} VALUES LESS THAN ('{first_month:%Y-%m-%d}')"]
+    partitions += month_partitions(first_month, last_month)
+    partitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    return "PARTITION BY RANGE COLUMNS(pickup_datetime) (\n    " + ",\n    ".join(partitions) + "\n)"
+
+
+def get_partitions(cursor, table="trips"):
+    """Partition names of `table` in order, or [] if it isn't partitioned"""
+    cursor.execute(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION",
+        (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def ensure_month_partitions(cursor, last_pickup):
+    """
+    Split p_future so every month up to `last_pickup` has its own partition.
+    Returns the names of the partitions added.
+    """
+    partitions = get_partitions(cursor)
+    if FUTURE_PARTITION not in partitions:
+        return []
+    months = [p for p in partitions if p not in (START_PARTITION, FUTURE_PARTITION)]
+    if months:
+        last = months[-1][1:]
+        first_new = next_month(datetime.date(int(last[:4]), int(last[4:]), 1))
+    else:
+        first_new = FIRST_MONTH
+    new_partitions = month_partitions(first_new, month_start(last_pickup))
+    if not new_partitions:
+        return []
+    new_partitions.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN (MAXVALUE)")
+    cursor.execute(
+        f"ALTER TABLE trips REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({', '.join(new_partitions)})")
+    return [p.split()[1] for p in new_partitions[:-1]]
@@ -0,0 +1,178 @@
+"""
+Structured store for rows the pipeline rejects
+
+Each rejected row becomes one small record: its trip id, the stage, a reason
+code and a JSON object with only the values that caused the rejection. The
+records go to one Parquet file per stage (CSV without pyarrow) under
+data/logs/rejected/. They are buffered and written on a background thread,
+so the pipeline doesn't wait on quality logging. Per-reason counters are
+kept for the run summary.
+
+    df = read_rejections()
+    df.groupby(["stage", "reason"]).size()
+"""
+import glob
+import os
+import queue
+import threading
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from .trip_io import PIPELINE_FORMAT
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REJECTS_DIR = os.path.join(BASE_DIR, "data/logs/rejected")
+
+REJECTION_COLUMNS = ["row_id", "stage", "reason", "values"]
+
+# Reason codes and the columns whose values are kept as evidence
+REASONS = {
+    "duplicate": [],
+    "missing_critical": [],  # data_cleaning passes the critical columns
+    "unrealistic_speed": ["speed_kmh", "trip_distance_km", "trip_duration_min"],
+    "invalid_fare_per_km": ["fare_per_km"],
+}
+
+# Rejections buffered per stage before they are handed to the writer thread
+FLUSH_ROWS = 50000
+
+
+def rejection_records(df, stage, reason, columns):
+    """Rejection records (REJECTION_COLUMNS) for the rows of `df`"""
+    if "id" in df.columns:
+        row_ids = df["id"].astype(str).to_numpy()
+    else:
+        row_ids = df.index.astype(str).to_numpy()
+    columns = [col for col in columns if col in df.columns]
+    if columns:
+        values = df[columns].to_json(orient="records", lines=True, date_format="iso").splitlines()
+    else:
+        values = ["{}"] * len(df)
+    return pd.DataFrame({"row_id": row_ids, "stage": stage, "reason": reason, "values": values})
+
+
+class RejectionWriter:
+    """
+    Collects rejected rows and writes them to `directory` in the background.
+    Files left by an earlier run of `stages` are replaced. Use as a context
+    manager; counts holds {(stage, reason): rows}.
+    """
+
+    def __init__(self, stages, directory=REJECTS_DIR, fmt=PIPELINE_FORMAT):
+        self.directory = directory
+        self.format = fmt if fmt == "parquet" and pq is not None else "csv"
+        self.counts = {}
+        self._buffers = {}
+        self._buffered = {}
+        self._sinks = {}
+        self._queue = queue.Queue(maxsize=8)
+        self._error = None
+        os.makedirs(directory, exist_ok=True)
+        for stage in stages:
+            for path in glob.glob(os.path.join(directory, f"{stage}.*")):
+                os.remove(path)
+        self._thread = threading.Thread(target=self._run, name="rejection-writer", daemon=True)
+        self._thread.start()
+
+    def reject(self, df, stage, reason, columns=None):
+        """Record every row of `df` as rejected by `stage` for `reason`"""
+        if df.empty:
+            return
+        if columns is None:
+            columns = REASONS.get(reason, [])
+        self.add_records(rejection_records(df, stage, reason, columns))
+
+    def add_records(self, records):
+        """Add records already in REJECTION_COLUMNS form (e.g. read from a worker's file)"""
+        if records.empty:
+            return
+        for (stage, reason), count in records.groupby(["stage", "reason"]).size().items():
+            self.counts[(stage, reason)] = self.counts.get((stage, reason), 0) + int(count)
+        for stage, frame in records.groupby("stage"):
+            self._buffers.setdefault(stage, []).append(frame)
+            self._buffered[stage] = self._buffered.get(stage, 0) + len(frame)
+            if self._buffered[stage] >= FLUSH_ROWS:
+                self._flush(stage)
+
+    def _flush(self, stage):
+        frames = self._buffers.pop(stage, [])
+        self._buffered[stage] = 0
+        if frames:
+            if self._error:
+                raise self._error
+            self._queue.put((stage, pd.concat(frames, ignore_index=True)))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self._error:
+                continue
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._error = e
+
+    def _write(self, stage, frame):
+        frame = frame[REJECTION_COLUMNS]
+        if self.format == "parquet":
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if stage not in self._sinks:
+                self._sinks[stage] = pq.ParquetWriter(os.path.join(self.directory, f"{stage}.parquet"),
+                                                      table.schema)
+            self._sinks[stage].write_table(table)
+        else:
+            path = os.path.join(self.directory, f"{stage}.csv")
+            frame.to_csv(path, index=False, mode="a" if stage in self._sinks else "w",
+                         header=stage not in self._sinks)
+            self._sinks[stage] = path
+
+    def close(self):
+        for stage in list(self._buffers):
+            self._flush(stage)
+        self._queue.put(None)
+        self._thread.join()
+        for sink in self._sinks.values():
+            if not isinstance(sink, str):
+                sink.close()
+        if self._error:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def print_summary(self):
+        print(f"Rejected rows: {self.total}")
+        for (stage, reason), count in sorted(self.counts.items()):
+            print(f"  {stage:<10} {reason:<22} {count}")
+        print(f"Rejected records are in {self.directory}")
+
+
+def read_rejections(directory=REJECTS_DIR, stage=None):
+    """All rejection records in `directory` (optionally one stage) as a DataFrame"""
+    frames = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.*"))):
+        name, ext = os.path.splitext(os.path.basename(path))
+        if stage is not None and name != stage:
+            continue
+        if ext == ".parquet":
+            frames.append(pd.read_parquet(path))
+        elif ext == ".csv":
+            frames.append(pd.read_csv(path, dtype=str, keep_default_na=False))
+    if not frames:
+        return pd.DataFrame(columns=REJECTION_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,146 @@
+"""
+In-process response cache for read-only API endpoints
+
+Responses are cached per endpoint + query string + dataset version, with a
+TTL and LRU eviction once the cache is full. Each response carries an ETag
+derived from the same key, so a client that sends If-None-Match gets a 304
+before the view (or MySQL) is touched at all.
+"""
+import hashlib
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+from .dataset_version import get_dataset_version
+
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 512))
+
+
+class LRUCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+response_cache = LRUCache()
+
+
+def _cache_key(version):
+    args = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    return f"{request.endpoint}?{args}#{version}"
+
+
+def _etag_matches(etag):
+    # If-None-Match uses the weak comparison, so the weak ETags given to
+    # compressed responses still match
+    return request.if_none_match.contains_weak(etag) or "*" in request.if_none_match
+
+
+def _cached_lookup():
+    """(key, etag, response) for the current request; response is None on a cache miss"""
+    version = get_dataset_version()
+    key = _cache_key(version)
+    # Without a version marker we can't tell when data changes, so only
+    # the TTL cache applies and no ETag is handed out
+    etag = hashlib.sha1(key.encode()).hexdigest() if version is not None else None
+
+    if etag and _etag_matches(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return key, etag, response
+
+    cached = response_cache.get(key)
+    return key, etag, None if cached is None else _cached_body(cached, etag)
+
+
+def _cache_view_response(key, etag, response):
+    """Cache a successful view response; anything else is passed through"""
+    if not isinstance(response, Response) or response.status_code != 200:
+        return response
+    cached = (response.get_data(), response.mimetype)
+    response_cache.set(key, cached)
+    return _cached_body(cached, etag)
+
+
+def _cached_body(cached, etag):
+    body, mimetype = cached
+    response = Response(body, mimetype=mimetype)
+    if etag:
+        response.set_etag(etag)
+        # Let browsers keep the body but revalidate it on every use
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def cached_response(view):
+    """
+    Cache a view's successful responses and answer conditional requests
+    with 304 Not Modified. Only use on views whose output depends solely on
+    the query string and the loaded dataset. Works on sync and async views.
+    """
+    if inspect.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            key, etag, response = _cached_lookup()
+            if response is None:
+                response = _cache_view_response(key, etag, await view(*args, **kwargs))
+            return response
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key, etag, response = _cached_lookup()
+        if response is None:
+            response = _cache_view_response(key, etag, view(*args, **kwargs))
+        return response
+
+    return wrapper
@@ -0,0 +1,173 @@
+"""
+Single-pass, mergeable statistics for trip data
+
+Each accumulator is fed chunk by chunk (update) and two accumulators built
+on different chunks or partitions combine into the same result as one built
+on all the data (merge), so nothing needs the whole dataset in memory.
+
+- RunningStats: count, mean, variance (Welford / Chan et al.), min, max
+- HourlyHistogram: trip counts in 24 fixed hour-of-day bins
+- QuantileSketch: log-bucketed histogram giving quantiles within a fixed
+  relative error (the DDSketch scheme) for non-negative values
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def _finite(values):
+    """Float array of the finite values in `values`"""
+    values = np.asarray(values, dtype="float64").ravel()
+    return values[np.isfinite(values)]
+
+
+class RunningStats:
+    """Count, mean, population variance, min and max of a stream of numbers"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, values):
+        """Add a chunk of values (NaN and inf are ignored)"""
+        values = _finite(values)
+        if len(values):
+            chunk = RunningStats()
+            chunk.count = len(values)
+            chunk.mean = float(values.mean())
+            chunk.m2 = float(((values - chunk.mean) ** 2).sum())
+            chunk.min = float(values.min())
+            chunk.max = float(values.max())
+            self.merge(chunk)
+        return self
+
+    def merge(self, other):
+        """Fold another RunningStats into this one"""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.min, self.max = other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance) if self.count else math.nan
+
+    def z_scores(self, values):
+        """Absolute z-scores of `values` against the accumulated mean and std"""
+        values = np.asarray(values, dtype="float64")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.abs((values - self.mean) / self.std)
+
+    def to_dict(self):
+        if not self.count:
+            return {"count": 0, "mean": None, "std": None, "min": None, "max": None}
+        return {"count": self.count, "mean": self.mean, "std": self.std, "min": self.min, "max": self.max}
+
+
+class HourlyHistogram:
+    """Trip counts per hour of day (0-23)"""
+
+    def __init__(self):
+        self.counts = np.zeros(24, dtype=np.int64)
+
+    def update(self, datetimes):
+        """Add a chunk of pickup datetimes (anything pd.to_datetime accepts)"""
+        datetimes = pd.Series(datetimes)
+        if not pd.api.types.is_datetime64_any_dtype(datetimes):
+            datetimes = pd.to_datetime(datetimes, errors="coerce")
+        hours = datetimes.dt.hour.dropna().to_numpy(dtype=np.int64)
+        self.counts += np.bincount(hours, minlength=24)
+        return self
+
+    def add_counts(self, hours, counts):
+        """Add precomputed counts, e.g. from a GROUP BY HOUR(...) query"""
+        np.add.at(self.counts, np.asarray(hours, dtype=np.int64), np.asarray(counts, dtype=np.int64))
+        return self
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    def peak_hours(self):
+        """Hours whose count is more than one standard deviation above the mean"""
+        observed = np.flatnonzero(self.counts)
+        if len(observed) < 2:
+            return []
+        counts = self.counts[observed]
+        # Sample std over the hours that occur, as value_counts().std() gave
+        threshold = counts.mean() + counts.std(ddof=1)
+        return [int(hour) for hour in observed[counts > threshold]]
+
+
+class QuantileSketch:
+    """
+    Quantiles of non-negative values within `relative_accuracy` of the true
+    value. Values fall into logarithmic buckets, so the sketch stays small
+    (a few hundred buckets for speeds) and merging is adding bucket counts.
+    Negative values are counted with zero.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def update(self, values):
+        values = _finite(values)
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        if len(positive):
+            keys, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int64),
+                                     return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                self.buckets[key] = self.buckets.get(key, 0) + count
+        return self
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1), or None if the sketch is empty"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                # Midpoint (in relative terms) of the bucket (gamma^(key-1), gamma^key]
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def quantiles(self, qs):
+        return {q: self.quantile(q) for q in qs}
@@ -0,0 +1,142 @@
+"""
+Reading and writing the intermediate trip files between pipeline stages
+
+Stages exchange Parquet files with proper dtypes (datetimes, small integers,
+categories), so the next stage reads only the columns it needs and skips
+CSV parsing and type coercion. pyarrow is optional: without it, or with
+PIPELINE_FORMAT=csv, the same helpers read and write CSV instead.
+"""
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+PIPELINE_FORMAT = os.environ.get("PIPELINE_FORMAT", "parquet" if PARQUET_AVAILABLE else "csv")
+
+DATETIME_COLUMNS = ["pickup_datetime", "dropoff_datetime"]
+
+# Storage dtypes for trip columns; anything not listed keeps its dtype.
+# Coordinates and measures stay float64 because they are loaded into DOUBLE
+# columns and float32 would change the stored values.
+TRIP_DTYPES = {
+    "vendor_id": "category",
+    "passenger_count": "Int8",
+    "store_and_fwd_flag": "category",
+    "trip_duration": "Int32",
+    "pickup_cell": "Int32",
+    "dropoff_cell": "Int32",
+}
+
+
+def trip_file(stem):
+    """Path for an intermediate file (no extension) in the configured format"""
+    return f"{stem}.{'parquet' if PIPELINE_FORMAT == 'parquet' else 'csv'}"
+
+
+def find_trip_file(stem):
+    """
+    Existing intermediate file for `stem`, preferring the configured format
+    and falling back to the other one (e.g. the CSVs shipped in the repo)
+    """
+    candidates = [trip_file(stem)]
+    if PARQUET_AVAILABLE and PIPELINE_FORMAT != "parquet":
+        candidates.append(f"{stem}.parquet")
+    if PIPELINE_FORMAT != "csv":
+        candidates.append(f"{stem}.csv")
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return candidates[0]
+
+
+def as_trip_dtypes(df):
+    """Cast known trip columns to their storage dtypes"""
+    for col in DATETIME_COLUMNS:
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    for col, dtype in TRIP_DTYPES.items():
+        if col in df.columns and df[col].dtype != dtype:
+            if dtype.startswith("Int"):
+                df[col] = pd.to_numeric(df[col], errors="coerce").round().astype(dtype)
+            else:
+                df[col] = df[col].astype(dtype)
+    return df
+
+
+def read_trips(path, columns=None):
+    """Read an intermediate trip file, optionally only some columns"""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+
+    header = pd.read_csv(path, nrows=0).columns
+    parse_dates = [col for col in DATETIME_COLUMNS if col in header and (columns is None or col in columns)]
+    df = pd.read_csv(path, usecols=columns, parse_dates=parse_dates)
+    if columns is not None:
+        df = df[columns]
+    return as_trip_dtypes(df)
+
+
+class TripWriter:
+    """
+    Write trip frames to one intermediate file, either in a single call or
+    chunk by chunk (each chunk becomes a Parquet row group / CSV append).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self._writer = None
+        self._schema = None
+        self._started = False
+
+    def write(self, df):
+        df = as_trip_dtypes(df)
+        if self.path.endswith(".parquet"):
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            self._writer.write_table(table)
+        else:
+            df.to_csv(self.path, index=False, mode="a" if self._started else "w", header=not self._started)
+        self._started = True
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_trips(df, path):
+    """Write a whole frame to an intermediate file"""
+    with TripWriter(path) as writer:
+        writer.write(df)
+
+
+def to_python_objects(df):
+    """
+    Convert a typed trip frame into object columns of plain Python values
+    (None for missing, 'YYYY-MM-DD HH:MM:SS' for datetimes) that the MySQL
+    connector accepts.
+    """
+    converted = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = series.dt.strftime("%Y-%m-%d %H:%M:%S").astype(object)
+        else:
+            values = series.astype(object)
+        converted[col] = values.where(series.notna(), None)
+    return pd.DataFrame(converted, index=df.index)
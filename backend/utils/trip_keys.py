@@ -0,0 +1,75 @@
+"""
+Compact integer keys for trip ids
+
+Trip ids look like "id2875421": "id" followed by digits. trip_key() packs
+the number and its digit count into one BIGINT (the count keeps "id05" and
+"id5" apart), so the id can be rebuilt exactly from the key. With
+TRIP_KEYS=compact the trips table is keyed on (trip_key, pickup_datetime)
+instead of (id, pickup_datetime): every secondary index entry carries an
+8-byte integer instead of a VARCHAR(255), and point lookups compare integers
+instead of collated strings. The id column is kept for responses.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# "string" (default): primary key on id; "compact": primary key on trip_key
+TRIP_KEYS = os.environ.get("TRIP_KEYS", "string")
+
+# Column the trips primary key (and keyset tie-breaks) start with
+KEY_COLUMN = "trip_key" if TRIP_KEYS == "compact" else "id"
+
+ID_PREFIX = "id"
+# Low bits of a key hold the digit count; 17 digits still fit a signed BIGINT
+DIGIT_BITS = 5
+MAX_DIGITS = 17
+
+_ID_PATTERN = re.compile(rf"{ID_PREFIX}(\d{{1,{MAX_DIGITS}}})")
+
+
+def trip_key(trip_id):
+    """The compact key of a trip id, or None if the id doesn't have the idNNN form"""
+    match = _ID_PATTERN.fullmatch(str(trip_id))
+    if not match:
+        return None
+    digits = match.group(1)
+    return int(digits) << DIGIT_BITS | len(digits)
+
+
+def trip_id_from_key(key):
+    """The trip id a compact key was made from"""
+    width = key & ((1 << DIGIT_BITS) - 1)
+    return f"{ID_PREFIX}{key >> DIGIT_BITS:0{width}d}"
+
+
+def trip_keys(ids):
+    """Vectorized trip_key over a Series of ids (nullable Int64, <NA> where there is no key)"""
+    digits = ids.astype(str).str.extract(rf"^{ID_PREFIX}(\d{{1,{MAX_DIGITS}}})$", expand=False)
+    valid = digits.notna().to_numpy()
+    keys = np.zeros(len(ids), dtype="int64")
+    if valid.any():
+        found = digits[valid]
+        keys[valid] = found.astype("int64").to_numpy() << DIGIT_BITS | found.str.len().to_numpy()
+    return pd.Series(pd.arrays.IntegerArray(keys, ~valid), index=ids.index)
+
+
+def trip_key_sql(id_column="id"):
+    """SQL expression computing trip_key() from an id column (NULL where there is no key)"""
+    return (f"IF({id_column} REGEXP '^{ID_PREFIX}[0-9]{{1,{MAX_DIGITS}}}$', "
+            f"CAST(SUBSTRING({id_column}, {len(ID_PREFIX) + 1}) AS UNSIGNED) << {DIGIT_BITS} "
+            f"| (CHAR_LENGTH({id_column}) - {len(ID_PREFIX)}), NULL)")
+
+
+def primary_keys(trip_ids):
+    """KEY_COLUMN values for these trip ids; ids that can't have a compact key are left out"""
+    if KEY_COLUMN == "id":
+        return list(trip_ids)
+    keys = (trip_key(trip_id) for trip_id in trip_ids)
+    return [key for key in keys if key is not None]
+
+
+def trip_id_from_primary_key(value):
+    """The trip id for a KEY_COLUMN value"""
+    return value if KEY_COLUMN == "id" else trip_id_from_key(value)
@@ -0,0 +1,244 @@
+"""
+Pre-aggregated trip cube for grouped insights
+
+trip_rollup holds one row per pickup date, hour, passenger_count and
+vendor_id (day_of_week is stored alongside for grouping) with the trip count
+and the sums / non-null counts of duration, speed and distance. Any grouping
+or filter over those dimensions is answered from the cube, which is tens of
+thousands of rows instead of the full trips table. Like trip_summary, the
+loader adds to it in the same transaction as each batch of trips.
+
+Trips without a pickup time are not part of the cube.
+"""
+import datetime
+
+import pandas as pd
+
+from .trip_summary import NULL_PASSENGER_COUNT, SUMMARY_MEASURES, net_rows
+from .trips_schema import PICKUP_DATE, PICKUP_HOUR, PICKUP_WEEKDAY
+
+# vendor_id is part of the primary key, so NULL is stored as ''
+NULL_VENDOR_ID = ""
+
+# API dimension name -> trip_rollup column
+ROLLUP_DIMENSIONS = {
+    "date": "pickup_date",
+    "hour": "pickup_hour",
+    "day_of_week": "day_of_week",
+    "passenger_count": "passenger_count",
+    "vendor_id": "vendor_id",
+}
+
+CREATE_ROLLUP_TABLE = """
+CREATE TABLE IF NOT EXISTS trip_rollup (
+    pickup_date DATE NOT NULL,
+    pickup_hour TINYINT NOT NULL,
+    day_of_week TINYINT NOT NULL,
+    passenger_count INT NOT NULL,
+    vendor_id VARCHAR(50) NOT NULL,
+    trip_count BIGINT NOT NULL DEFAULT 0,
+    duration_sum DOUBLE NOT NULL DEFAULT 0,
+    duration_count BIGINT NOT NULL DEFAULT 0,
+    speed_sum DOUBLE NOT NULL DEFAULT 0,
+    speed_count BIGINT NOT NULL DEFAULT 0,
+    distance_sum DOUBLE NOT NULL DEFAULT 0,
+    distance_count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (pickup_date, pickup_hour, passenger_count, vendor_id)
+)
+"""
+
+_KEY_COLUMNS = ["pickup_date", "pickup_hour", "day_of_week", "passenger_count", "vendor_id"]
+_MEASURE_COLUMNS = ["trip_count"] + [
+    f"{prefix}_{kind}" for _, prefix in SUMMARY_MEASURES for kind in ("sum", "count")
+]
+_ROLLUP_COLUMNS = _KEY_COLUMNS + _MEASURE_COLUMNS
+
+_UPSERT_ROLLUP = """
+INSERT INTO trip_rollup ({columns}) VALUES ({placeholders})
+ON DUPLICATE KEY UPDATE {updates}
+""".format(
+    columns=", ".join(_ROLLUP_COLUMNS),
+    placeholders=", ".join(["%s"] * len(_ROLLUP_COLUMNS)),
+    updates=", ".join(f"{col} = {col} + VALUES({col})" for col in _MEASURE_COLUMNS),
+)
+
+# Same cube computed straight from trips in one scan (reading the stored
+# generated time columns with the compact layout)
+ROLLUP_SCAN_QUERY = """
+SELECT {pickup_date} AS pickup_date,
+       {pickup_hour} AS pickup_hour,
+       {pickup_weekday} AS day_of_week,
+       COALESCE(passenger_count, {null_passengers}) AS passenger_count,
+       COALESCE(vendor_id, '{null_vendor}') AS vendor_id,
+       COUNT(*) AS trip_count,
+       {measures}
+FROM trips
+WHERE pickup_datetime IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5
+""".format(
+    pickup_date=PICKUP_DATE,
+    pickup_hour=PICKUP_HOUR,
+    pickup_weekday=PICKUP_WEEKDAY,
+    null_passengers=NULL_PASSENGER_COUNT,
+    null_vendor=NULL_VENDOR_ID,
+    measures=",\n       ".join(
+        f"COALESCE(SUM({col}), 0) AS {prefix}_sum, COUNT({col}) AS {prefix}_count"
+        for col, prefix in SUMMARY_MEASURES
+    ),
+)
+
+
+class InvalidRollupQuery(ValueError):
+    """Raised for an unknown dimension or a malformed filter"""
+
+
+def rollup_frame(df):
+    """
+    Aggregate a DataFrame of trips into trip_rollup rows (list of tuples in
+    _ROLLUP_COLUMNS order), sorted by primary key.
+    """
+    pickup = pd.to_datetime(df["pickup_datetime"], errors="coerce")
+    has_pickup = pickup.notna()
+    if not has_pickup.any():
+        return []
+    pickup = pickup[has_pickup]
+
+    data = pd.DataFrame({
+        "pickup_date": pickup.dt.strftime("%Y-%m-%d"),
+        "pickup_hour": pickup.dt.hour,
+        "day_of_week": pickup.dt.dayofweek,  # Monday = 0, like MySQL WEEKDAY()
+        "passenger_count": pd.to_numeric(df.loc[has_pickup, "passenger_count"], errors="coerce")
+        .fillna(NULL_PASSENGER_COUNT).astype("int64"),
+        "vendor_id": df.loc[has_pickup, "vendor_id"].astype(object).where(
+            df.loc[has_pickup, "vendor_id"].notna(), NULL_VENDOR_ID).astype(str),
+    })
+    aggregations = {"trip_count": ("pickup_hour", "size")}
+    for col, prefix in SUMMARY_MEASURES:
+        data[col] = pd.to_numeric(df.loc[has_pickup, col], errors="coerce")
+        aggregations[f"{prefix}_sum"] = (col, "sum")
+        aggregations[f"{prefix}_count"] = (col, "count")
+
+    # Sorted keys mean concurrent loaders lock rows in the same order
+    grouped = data.groupby(_KEY_COLUMNS, sort=True).agg(**aggregations).reset_index()
+    rows = []
+    for row in grouped[_ROLLUP_COLUMNS].itertuples(index=False):
+        date, hour, day_of_week, passengers, vendor = row[:5]
+        measures = [int(v) if col.endswith("_count") else float(v)
+                    for col, v in zip(_MEASURE_COLUMNS, row[5:])]
+        rows.append((date, int(hour), int(day_of_week), int(passengers), vendor, *measures))
+    return rows
+
+
+def update_trip_rollup(cursor, df, removed=None):
+    """
+    Add the trips in `df` to trip_rollup, less the `removed` trips they
+    replace, as a single upsert in primary key order (caller commits)
+    """
+    rows = rollup_frame(df)
+    if removed is not None and not removed.empty:
+        rows = net_rows(rows, rollup_frame(removed), len(_KEY_COLUMNS))
+    if rows:
+        cursor.executemany(_UPSERT_ROLLUP, rows)
+    return len(rows)
+
+
+def rebuild_trip_rollup(cursor):
+    """Recompute trip_rollup from the trips table in one scan (caller commits)"""
+    cursor.execute(CREATE_ROLLUP_TABLE)
+    cursor.execute("DELETE FROM trip_rollup")
+    cursor.execute(f"INSERT INTO trip_rollup ({', '.join(_ROLLUP_COLUMNS)}) {ROLLUP_SCAN_QUERY}")
+
+
+def parse_dimensions(text):
+    """'hour,vendor_id' -> ['hour', 'vendor_id']"""
+    dimensions = [d.strip() for d in (text or "").split(",") if d.strip()]
+    unknown = [d for d in dimensions if d not in ROLLUP_DIMENSIONS]
+    if unknown:
+        raise InvalidRollupQuery(
+            f"Unknown dimension(s): {', '.join(unknown)}; use {', '.join(ROLLUP_DIMENSIONS)}")
+    return list(dict.fromkeys(dimensions))
+
+
+def _filter_value(dimension, value):
+    if dimension == "date":
+        try:
+            return datetime.date.fromisoformat(value).isoformat()
+        except ValueError:
+            raise InvalidRollupQuery(f"Invalid date: {value}")
+    if dimension == "vendor_id":
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidRollupQuery(f"Invalid value for {dimension}: {value}")
+
+
+def parse_filters(text):
+    """
+    Parse 'dim:value,...' filters. A value is a single value, alternatives
+    separated by '|', or an inclusive range 'low..high'.
+
+        day_of_week:5|6,hour:7..9,date:2016-03-01..2016-03-31
+
+    Returns {dimension: ("in", [values]) or ("range", (low, high))}.
+    """
+    filters = {}
+    for part in (text or "").split(","):
+        if not part.strip():
+            continue
+        dimension, sep, value = part.partition(":")
+        dimension = dimension.strip()
+        if not sep or not value.strip():
+            raise InvalidRollupQuery(f"Filters look like dimension:value, got '{part}'")
+        parse_dimensions(dimension)
+        value = value.strip()
+        if ".." in value:
+            low, high = value.split("..", 1)
+            filters[dimension] = ("range", (_filter_value(dimension, low), _filter_value(dimension, high)))
+        else:
+            filters[dimension] = ("in", [_filter_value(dimension, v) for v in value.split("|")])
+    return filters
+
+
+def build_rollup_query(group_by, filters):
+    """SELECT over trip_rollup grouped by `group_by` dimensions; returns (query, params)"""
+    select = [f"{ROLLUP_DIMENSIONS[d]} AS {d}" for d in group_by]
+    select.append("SUM(trip_count) AS trip_count")
+    for _, prefix in SUMMARY_MEASURES:
+        select.append(f"SUM({prefix}_sum) AS {prefix}_sum, SUM({prefix}_count) AS {prefix}_count")
+
+    query = f"SELECT {', '.join(select)} FROM trip_rollup WHERE 1=1"
+    params = []
+    for dimension, (kind, values) in filters.items():
+        column = ROLLUP_DIMENSIONS[dimension]
+        if kind == "range":
+            query += f" AND {column} BETWEEN %s AND %s"
+            params.extend(values)
+        else:
+            query += f" AND {column} IN ({', '.join(['%s'] * len(values))})"
+            params.extend(values)
+
+    if group_by:
+        columns = ", ".join(ROLLUP_DIMENSIONS[d] for d in group_by)
+        query += f" GROUP BY {columns} ORDER BY {columns}"
+    return query, params
+
+
+def format_rollup_row(row, group_by):
+    """Turn a build_rollup_query() row into the API shape (sentinels back to None, averages)"""
+    result = {}
+    for dimension in group_by:
+        value = row[dimension]
+        if dimension == "passenger_count" and value == NULL_PASSENGER_COUNT:
+            value = None
+        elif dimension == "vendor_id" and value == NULL_VENDOR_ID:
+            value = None
+        elif isinstance(value, datetime.date):
+            value = value.isoformat()
+        result[dimension] = value
+    result["trip_count"] = int(row["trip_count"] or 0)
+    for key, prefix in (("avg_duration_min", "duration"), ("avg_speed_kmh", "speed"),
+                        ("avg_distance_km", "distance")):
+        measure_count = int(row[f"{prefix}_count"] or 0)
+        result[key] = float(row[f"{prefix}_sum"]) / measure_count if measure_count else None
+    return result
@@ -0,0 +1,363 @@
+"""
+Reservoir samples of trips for approximate insights
+
+trip_sample holds a fixed-size uniform random sample of the trips table
+(stratum -1) and, with TRIP_SAMPLE_STRATA=hour, one more reservoir per pickup
+hour (strata 0-23). trip_sample_state records each reservoir's capacity and
+how many trips have been offered to it. The loader runs the reservoir step
+(Vitter's algorithm R) for every batch of new trips in the same transaction
+as the trips themselves, so the sample stays uniform however the data
+arrives.
+
+`approx=true` requests answer from the sample where no precomputed table
+does: filtered trip counts, and the insights while trip_summary or
+trip_rollup are missing. Counts are scaled up to the population, averages
+are ratio estimates, and each comes with a normal approximation confidence
+interval (with finite population correction, so a stratum sampled in full
+is exact). With hour strata, per-hour counts are exact and the other
+estimates are stratified, which narrows their intervals.
+
+Trips an upsert updates keep their old values in the sample until it is
+rebuilt (insert_data.py --rebuild-summary).
+"""
+import os
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+from mysql.connector import Error
+
+from .trip_io import to_python_objects
+from .trip_summary import NULL_PASSENGER_COUNT, SUMMARY_MEASURES
+from .trips_schema import TRIP_COLUMN_TYPES
+
+# Trips in the uniform reservoir
+TRIP_SAMPLE_SIZE = int(os.environ.get("TRIP_SAMPLE_SIZE", 100000))
+# "none" (default) or "hour": also keep a reservoir per pickup hour
+TRIP_SAMPLE_STRATA = os.environ.get("TRIP_SAMPLE_STRATA", "none")
+STRATA_OPTIONS = ("none", "hour")
+# Trips in each pickup hour reservoir
+TRIP_SAMPLE_HOUR_SIZE = int(os.environ.get("TRIP_SAMPLE_HOUR_SIZE", 10000))
+
+UNIFORM_STRATUM = -1
+HOUR_STRATA = range(24)
+
+# Confidence level of the reported intervals
+CONFIDENCE = 0.95
+_Z = NormalDist().inv_cdf(0.5 + CONFIDENCE / 2)
+
+# Columns copied into the sample: everything the approximate endpoints filter or aggregate on
+SAMPLE_COLUMNS = ["id", "vendor_id", "pickup_datetime", "passenger_count",
+                  "trip_duration_min", "trip_distance_km", "speed_kmh"]
+
+_COLUMN_TYPES = {name: standard_type for name, standard_type, _ in TRIP_COLUMN_TYPES}
+
+CREATE_SAMPLE_TABLE = """
+CREATE TABLE IF NOT EXISTS trip_sample (
+    stratum TINYINT NOT NULL,
+    slot INT NOT NULL,
+    {columns},
+    PRIMARY KEY (stratum, slot)
+)
+""".format(columns=",\n    ".join(f"{col} {_COLUMN_TYPES[col]}" for col in SAMPLE_COLUMNS))
+
+CREATE_SAMPLE_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS trip_sample_state (
+    stratum TINYINT PRIMARY KEY,
+    capacity INT NOT NULL,
+    seen BIGINT NOT NULL DEFAULT 0
+)
+"""
+
+_SAMPLE_TABLE_COLUMNS = ["stratum", "slot"] + SAMPLE_COLUMNS
+
+# Trips read per fetchmany() call when the sample is drawn again
+REBUILD_FETCH_SIZE = 50000
+
+_UPSERT_SAMPLE = """
+INSERT INTO trip_sample ({columns}) VALUES ({placeholders})
+ON DUPLICATE KEY UPDATE {updates}
+""".format(
+    columns=", ".join(_SAMPLE_TABLE_COLUMNS),
+    placeholders=", ".join(["%s"] * len(_SAMPLE_TABLE_COLUMNS)),
+    updates=", ".join(f"{col} = VALUES({col})" for col in SAMPLE_COLUMNS),
+)
+
+
+def sample_strata(strata=TRIP_SAMPLE_STRATA):
+    """{stratum: capacity} of the reservoirs kept for a TRIP_SAMPLE_STRATA setting"""
+    if strata not in STRATA_OPTIONS:
+        raise ValueError(f"TRIP_SAMPLE_STRATA must be one of {', '.join(STRATA_OPTIONS)}")
+    reservoirs = {UNIFORM_STRATUM: TRIP_SAMPLE_SIZE}
+    if strata == "hour":
+        reservoirs.update({hour: TRIP_SAMPLE_HOUR_SIZE for hour in HOUR_STRATA})
+    return reservoirs
+
+
+def create_trip_sample(cursor, strata=TRIP_SAMPLE_STRATA):
+    """
+    Create the sample tables. The reservoirs start empty only while trips
+    is empty too; reservoirs added to a loaded table would miss its trips,
+    so they are left for rebuild_trip_sample. Returns the reservoirs that
+    still need a rebuild.
+    """
+    cursor.execute(CREATE_SAMPLE_TABLE)
+    cursor.execute(CREATE_SAMPLE_STATE_TABLE)
+    cursor.execute("SELECT stratum FROM trip_sample_state")
+    existing = {row[0] for row in cursor.fetchall()}
+    missing = {stratum: capacity for stratum, capacity in sample_strata(strata).items() if stratum not in existing}
+    if not missing:
+        return []
+    cursor.execute("SELECT 1 FROM trips LIMIT 1")
+    if cursor.fetchall():
+        return sorted(missing)
+    cursor.executemany("INSERT INTO trip_sample_state (stratum, capacity, seen) VALUES (%s, %s, 0)",
+                       list(missing.items()))
+    return []
+
+
+def reservoir_slots(seen, capacity, count, rng):
+    """
+    Algorithm R for `count` new items after `seen`: returns (positions,
+    slots), the items that enter the reservoir and the slot each one takes.
+    The i-th item fills an empty slot, or replaces a random one with
+    probability capacity / (seen + i + 1); of several items drawn for the
+    same slot only the last is kept.
+    """
+    index = seen + np.arange(count, dtype="int64")
+    slots = np.where(index < capacity, index, rng.integers(0, index + 1))
+    positions = np.flatnonzero(slots < capacity)
+    slots = slots[positions]
+    # Last occurrence of each slot
+    _, last = np.unique(slots[::-1], return_index=True)
+    keep = np.sort(len(slots) - 1 - last)
+    return positions[keep], slots[keep]
+
+
+def sample_rows(df, states, rng=None):
+    """
+    The reservoir step for a frame of new trips: returns (rows, seen), the
+    trip_sample rows (tuples in _SAMPLE_TABLE_COLUMNS order) it writes and
+    the new seen count of every reservoir. `states` is {stratum: (capacity,
+    seen)}.
+    """
+    rng = rng or np.random.default_rng()
+    hours = pd.to_datetime(df["pickup_datetime"], errors="coerce").dt.hour.to_numpy()
+    values = None
+    rows, seen = [], {}
+    for stratum, (capacity, stratum_seen) in sorted(states.items()):
+        members = np.arange(len(df)) if stratum == UNIFORM_STRATUM else np.flatnonzero(hours == stratum)
+        positions, slots = reservoir_slots(stratum_seen, capacity, len(members), rng)
+        if len(positions):
+            if values is None:
+                values = list(to_python_objects(df[SAMPLE_COLUMNS]).itertuples(index=False, name=None))
+            rows.extend((stratum, int(slot), *values[members[position]])
+                        for position, slot in zip(positions, slots))
+        seen[stratum] = stratum_seen + len(members)
+    return rows, seen
+
+
+def update_trip_sample(cursor, df):
+    """
+    Offer a frame of trips new to the table to the reservoirs (caller
+    commits). The state rows are locked until the commit, so concurrent
+    loaders take turns for this step.
+    """
+    if df.empty:
+        return 0
+    cursor.execute("SELECT stratum, capacity, seen FROM trip_sample_state ORDER BY stratum FOR UPDATE")
+    states = {int(stratum): (int(capacity), int(seen)) for stratum, capacity, seen in cursor.fetchall()}
+    if not states:
+        # Sample not built yet
+        return 0
+    rows, seen = sample_rows(df, states)
+    if rows:
+        cursor.executemany(_UPSERT_SAMPLE, rows)
+    cursor.executemany("UPDATE trip_sample_state SET seen = %s WHERE stratum = %s",
+                       [(count, stratum) for stratum, count in seen.items()])
+    return len(rows)
+
+
+def rebuild_trip_sample(cursor, strata=TRIP_SAMPLE_STRATA, rng=None):
+    """
+    Draw the reservoirs again from the trips table (caller commits). The
+    trips are streamed once through the same reservoir step the loader runs,
+    so nothing is sorted and only the reservoirs are held in memory.
+    """
+    reservoirs = sample_strata(strata)
+    rng = rng or np.random.default_rng()
+    states = {stratum: (capacity, 0) for stratum, capacity in reservoirs.items()}
+    slots = {}
+    cursor.execute(f"SELECT {', '.join(SAMPLE_COLUMNS)} FROM trips")
+    while True:
+        rows = cursor.fetchmany(REBUILD_FETCH_SIZE)
+        if not rows:
+            break
+        drawn, seen = sample_rows(pd.DataFrame(rows, columns=SAMPLE_COLUMNS), states, rng)
+        # A slot drawn again replaces the trip it held
+        slots.update(((row[0], row[1]), row) for row in drawn)
+        states = {stratum: (capacity, seen[stratum]) for stratum, capacity in reservoirs.items()}
+
+    cursor.execute(CREATE_SAMPLE_TABLE)
+    cursor.execute(CREATE_SAMPLE_STATE_TABLE)
+    cursor.execute("DELETE FROM trip_sample")
+    cursor.execute("DELETE FROM trip_sample_state")
+    if slots:
+        cursor.executemany(
+            f"INSERT INTO trip_sample ({', '.join(_SAMPLE_TABLE_COLUMNS)}) "
+            f"VALUES ({', '.join(['%s'] * len(_SAMPLE_TABLE_COLUMNS))})",
+            [slots[key] for key in sorted(slots)])
+    cursor.executemany("INSERT INTO trip_sample_state (stratum, capacity, seen) VALUES (%s, %s, %s)",
+                       [(stratum, capacity, seen) for stratum, (capacity, seen) in sorted(states.items())])
+    return len(slots)
+
+
+# --- Estimates (dictionary cursors) ---
+
+def read_sample_state(cursor, strata=TRIP_SAMPLE_STRATA):
+    """
+    {stratum: (population, sample size)} of the reservoirs estimates are
+    made from: the hour strata when kept, else the uniform sample. None
+    when the sample hasn't been built.
+    """
+    try:
+        cursor.execute("SELECT stratum, capacity, seen FROM trip_sample_state")
+        rows = cursor.fetchall()
+    except Error:
+        # Sample tables not created yet
+        return None
+    states = {int(row['stratum']): (int(row['seen']), min(int(row['seen']), int(row['capacity']))) for row in rows}
+    if strata == "hour" and all(hour in states for hour in HOUR_STRATA):
+        return {hour: states[hour] for hour in HOUR_STRATA}
+    if UNIFORM_STRATUM in states:
+        return {UNIFORM_STRATUM: states[UNIFORM_STRATUM]}
+    return None
+
+
+def _strata_clause(states):
+    return f"stratum IN ({', '.join(str(stratum) for stratum in states)})"
+
+
+def _interval(estimate, variance, low=None):
+    margin = _Z * np.sqrt(max(variance, 0.0))
+    lower = estimate - margin
+    return [lower if low is None else max(low, lower), estimate + margin]
+
+
+def estimate_total(states, hits):
+    """
+    Population count of the trips matching a condition, from `hits`
+    {stratum: sampled trips matching it}: returns (estimate, [low, high])
+    """
+    estimate, variance = 0.0, 0.0
+    for stratum, (population, size) in states.items():
+        if not size:
+            continue
+        share = hits.get(stratum, 0) / size
+        estimate += population * share
+        if size < population:
+            variance += population ** 2 * (1 - size / population) * share * (1 - share) / max(size - 1, 1)
+    return estimate, _interval(estimate, variance, low=0.0)
+
+
+def estimate_mean(states, sums):
+    """
+    Ratio estimate of a column's mean over its non-null values, from `sums`
+    {stratum: (non-null count, sum, sum of squares)}: returns (estimate,
+    [low, high]), or (None, None) without sampled values
+    """
+    total, count = 0.0, 0.0
+    for stratum, (population, size) in states.items():
+        if size and stratum in sums:
+            total += population * sums[stratum][1] / size
+            count += population * sums[stratum][0] / size
+    if not count:
+        return None, None
+    ratio = total / count
+
+    variance = 0.0
+    for stratum, (population, size) in states.items():
+        if not size or size >= population or stratum not in sums:
+            continue
+        values, value_sum, value_squares = sums[stratum]
+        # Residuals d = y - ratio * (y is not null), with 0 for nulls
+        residual_sum = value_sum - ratio * values
+        residual_squares = value_squares - 2 * ratio * value_sum + ratio ** 2 * values
+        residual_variance = (residual_squares - residual_sum ** 2 / size) / max(size - 1, 1)
+        variance += population ** 2 * (1 - size / population) * residual_variance / size
+    return ratio, _interval(ratio, variance / count ** 2)
+
+
+def _rounded(estimate):
+    count, (low, high) = estimate
+    return round(count), [round(low), round(high)]
+
+
+def sample_info(states):
+    """Fields every approximate response carries"""
+    return {
+        "approximate": True,
+        "sample_size": sum(size for _, size in states.values()),
+        "confidence": CONFIDENCE,
+    }
+
+
+def sample_count(cursor, where="", params=(), strata=TRIP_SAMPLE_STRATA):
+    """
+    Estimated number of trips matching a build_trip_filters() WHERE
+    fragment: (estimate, [low, high]) rounded to whole trips, or None
+    without a sample
+    """
+    states = read_sample_state(cursor, strata)
+    if states is None:
+        return None
+    cursor.execute(
+        f"SELECT stratum, COUNT(*) AS hits FROM trip_sample WHERE {_strata_clause(states)}{where} GROUP BY stratum",
+        params)
+    return _rounded(estimate_total(states, {int(row['stratum']): int(row['hits']) for row in cursor.fetchall()}))
+
+
+def sample_group_counts(cursor, expression, states):
+    """{value of `expression`: (estimated trips, [low, high])}, sorted by value"""
+    cursor.execute(
+        f"SELECT stratum, {expression} AS value, COUNT(*) AS hits FROM trip_sample "
+        f"WHERE {_strata_clause(states)} GROUP BY stratum, {expression}")
+    hits = {}
+    for row in cursor.fetchall():
+        hits.setdefault(row['value'], {})[int(row['stratum'])] = int(row['hits'])
+    return {value: _rounded(estimate_total(states, hits[value]))
+            for value in sorted(hits, key=lambda v: (v is None, v))}
+
+
+def sample_stats(cursor, strata=TRIP_SAMPLE_STRATA):
+    """
+    /stats from the sample: exact total, estimated averages and most
+    common passenger count, with intervals. None without a sample.
+    """
+    states = read_sample_state(cursor, strata)
+    if states is None:
+        return None
+    measures = ", ".join(
+        f"COUNT({col}) AS {prefix}_count, COALESCE(SUM({col}), 0) AS {prefix}_sum, "
+        f"COALESCE(SUM({col} * {col}), 0) AS {prefix}_squares"
+        for col, prefix in SUMMARY_MEASURES)
+    cursor.execute(f"SELECT stratum, {measures} FROM trip_sample WHERE {_strata_clause(states)} GROUP BY stratum")
+    rows = cursor.fetchall()
+
+    stats = {"total_trips": sum(population for population, _ in states.values())}
+    intervals = {}
+    for key, prefix in (("avg_duration_min", "duration"), ("avg_speed_kmh", "speed"),
+                        ("avg_distance_km", "distance")):
+        sums = {int(row['stratum']): (int(row[f"{prefix}_count"]), float(row[f"{prefix}_sum"]),
+                                      float(row[f"{prefix}_squares"])) for row in rows}
+        stats[key], intervals[key] = estimate_mean(states, sums)
+
+    # Most common passenger count (NULL groups count like any other value)
+    passengers = sample_group_counts(cursor, f"COALESCE(passenger_count, {NULL_PASSENGER_COUNT})", states)
+    most_common = max(passengers, key=lambda value: passengers[value][0], default=None)
+    stats["most_common_passenger_count"] = (
+        None if most_common is None or most_common == NULL_PASSENGER_COUNT else int(most_common))
+
+    stats.update(sample_info(states))
+    stats["intervals"] = intervals
+    return stats
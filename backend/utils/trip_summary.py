@@ -0,0 +1,151 @@
+"""
+Precomputed trip statistics for /api/insights/stats
+
+The trip_summary table holds one row per passenger_count with the trip count
+and the sums / non-null counts needed for the dashboard averages. The loader
+adds to it in the same transaction as each batch of trips, so reading the
+stats costs a handful of rows no matter how large the trips table gets.
+"""
+import pandas as pd
+
+# passenger_count is part of the primary key, so NULL is stored as -1
+NULL_PASSENGER_COUNT = -1
+
+# (column in trips, prefix in trip_summary)
+SUMMARY_MEASURES = [
+    ("trip_duration_min", "duration"),
+    ("speed_kmh", "speed"),
+    ("trip_distance_km", "distance"),
+]
+
+CREATE_SUMMARY_TABLE = """
+CREATE TABLE IF NOT EXISTS trip_summary (
+    passenger_count INT PRIMARY KEY,
+    trip_count BIGINT NOT NULL DEFAULT 0,
+    duration_sum DOUBLE NOT NULL DEFAULT 0,
+    duration_count BIGINT NOT NULL DEFAULT 0,
+    speed_sum DOUBLE NOT NULL DEFAULT 0,
+    speed_count BIGINT NOT NULL DEFAULT 0,
+    distance_sum DOUBLE NOT NULL DEFAULT 0,
+    distance_count BIGINT NOT NULL DEFAULT 0
+)
+"""
+
+_SUMMARY_COLUMNS = ["passenger_count", "trip_count"] + [
+    f"{prefix}_{kind}" for _, prefix in SUMMARY_MEASURES for kind in ("sum", "count")
+]
+
+_UPSERT_SUMMARY = """
+INSERT INTO trip_summary ({columns}) VALUES ({placeholders})
+ON DUPLICATE KEY UPDATE {updates}
+""".format(
+    columns=", ".join(_SUMMARY_COLUMNS),
+    placeholders=", ".join(["%s"] * len(_SUMMARY_COLUMNS)),
+    updates=", ".join(f"{col} = {col} + VALUES({col})" for col in _SUMMARY_COLUMNS[1:]),
+)
+
+# Same aggregates computed straight from trips in a single scan
+SINGLE_SCAN_QUERY = """
+SELECT COALESCE(passenger_count, {null}) AS passenger_count,
+       COUNT(*) AS trip_count,
+       {measures}
+FROM trips
+GROUP BY COALESCE(passenger_count, {null})
+""".format(
+    null=NULL_PASSENGER_COUNT,
+    measures=",\n       ".join(
+        f"COALESCE(SUM({col}), 0) AS {prefix}_sum, COUNT({col}) AS {prefix}_count"
+        for col, prefix in SUMMARY_MEASURES
+    ),
+)
+
+
+def summarize_frame(df):
+    """
+    Aggregate a DataFrame of trips into trip_summary rows (list of tuples
+    in _SUMMARY_COLUMNS order), grouped by passenger_count.
+    """
+    if df.empty:
+        return []
+
+    data = pd.DataFrame({
+        "passenger_count": pd.to_numeric(df["passenger_count"], errors="coerce")
+        .fillna(NULL_PASSENGER_COUNT).astype("int64")
+    })
+    aggregations = {"trip_count": ("passenger_count", "size")}
+    for col, prefix in SUMMARY_MEASURES:
+        data[col] = pd.to_numeric(df[col], errors="coerce")
+        aggregations[f"{prefix}_sum"] = (col, "sum")
+        aggregations[f"{prefix}_count"] = (col, "count")
+
+    grouped = data.groupby("passenger_count").agg(**aggregations).reset_index()
+    return [
+        tuple(int(v) if col.endswith("_count") else float(v) for col, v in zip(_SUMMARY_COLUMNS, row))
+        for row in grouped[_SUMMARY_COLUMNS].itertuples(index=False)
+    ]
+
+
+def negate_measures(rows, measures_from):
+    """Aggregate rows with every measure from position `measures_from` on negated"""
+    return [row[:measures_from] + tuple(-v for v in row[measures_from:]) for row in rows]
+
+
+def net_rows(added, removed, measures_from):
+    """
+    Aggregate rows `added` minus `removed`, one row per key (the columns
+    before `measures_from`) sorted by key, so a loader locks each row once
+    and concurrent loaders lock them in the same order. Keys whose measures
+    cancel out are dropped.
+    """
+    totals = {}
+    for row in added + negate_measures(removed, measures_from):
+        key, measures = row[:measures_from], row[measures_from:]
+        total = totals.get(key)
+        totals[key] = measures if total is None else tuple(a + b for a, b in zip(total, measures))
+    return [key + measures for key, measures in sorted(totals.items()) if any(measures)]
+
+
+def update_trip_summary(cursor, df, removed=None):
+    """
+    Add the trips in `df` to trip_summary, less the `removed` trips they
+    replace, as a single upsert (caller commits)
+    """
+    rows = summarize_frame(df)
+    if removed is not None and not removed.empty:
+        rows = net_rows(rows, summarize_frame(removed), 1)
+    if rows:
+        cursor.executemany(_UPSERT_SUMMARY, rows)
+    return len(rows)
+
+
+def rebuild_trip_summary(cursor):
+    """Recompute trip_summary from the trips table in one scan (caller commits)"""
+    cursor.execute(CREATE_SUMMARY_TABLE)
+    cursor.execute("DELETE FROM trip_summary")
+    cursor.execute(
+        f"INSERT INTO trip_summary ({', '.join(_SUMMARY_COLUMNS)}) {SINGLE_SCAN_QUERY}"
+    )
+
+
+def combine_summary(groups):
+    """
+    Turn per-passenger_count groups (dicts from trip_summary or
+    SINGLE_SCAN_QUERY) into the /stats response.
+    """
+    total_trips = sum(int(g["trip_count"]) for g in groups)
+    stats = {"total_trips": total_trips}
+
+    for key, prefix in (("avg_duration_min", "duration"), ("avg_speed_kmh", "speed"),
+                        ("avg_distance_km", "distance")):
+        measure_count = sum(int(g[f"{prefix}_count"]) for g in groups)
+        measure_sum = sum(float(g[f"{prefix}_sum"]) for g in groups)
+        stats[key] = measure_sum / measure_count if measure_count else None
+
+    # Most common passenger count (NULL groups count like any other value)
+    most_common = max(groups, key=lambda g: int(g["trip_count"]), default=None)
+    if most_common is None or most_common["passenger_count"] == NULL_PASSENGER_COUNT:
+        stats["most_common_passenger_count"] = None
+    else:
+        stats["most_common_passenger_count"] = int(most_common["passenger_count"])
+
+    return stats
@@ -0,0 +1,154 @@
+"""
+Column layouts of the trips table
+
+standard: the original layout, DOUBLE measures, INT counts, VARCHAR flags.
+compact:  the same columns in narrower types (DECIMAL coordinates, FLOAT
+          derived measures, TINYINT/MEDIUMINT counts, ENUM/CHAR flags) plus
+          stored generated pickup_hour / pickup_date / pickup_weekday columns
+          with their own indexes, so hour/day grouping and filtering reads
+          an index instead of calling HOUR()/WEEKDAY() on every row.
+
+TRIPS_SCHEMA selects the layout for the loader and the API server;
+scripts/migrate_schema.py converts a standard table. speed_kmh stays DOUBLE
+in both: keyset cursors compare it against the exact value of the last row.
+"""
+import os
+
+from .partitions import partition_clause
+from .trip_keys import KEY_COLUMN
+
+# "standard" (default) or "compact"
+TRIPS_SCHEMA = os.environ.get("TRIPS_SCHEMA", "standard")
+SCHEMAS = ("standard", "compact")
+
+# (column, standard type, compact type), in table order
+TRIP_COLUMN_TYPES = [
+    ("id", "VARCHAR(255) NOT NULL", "VARCHAR(255) NOT NULL"),
+    ("vendor_id", "VARCHAR(50)", "CHAR(1) CHARACTER SET ascii"),
+    ("pickup_datetime", "DATETIME NOT NULL", "DATETIME NOT NULL"),
+    ("dropoff_datetime", "DATETIME", "DATETIME"),
+    ("passenger_count", "INT", "TINYINT UNSIGNED"),
+    ("pickup_longitude", "DOUBLE", "DECIMAL(9,6)"),
+    ("pickup_latitude", "DOUBLE", "DECIMAL(8,6)"),
+    ("dropoff_longitude", "DOUBLE", "DECIMAL(9,6)"),
+    ("dropoff_latitude", "DOUBLE", "DECIMAL(8,6)"),
+    ("store_and_fwd_flag", "VARCHAR(10)", "ENUM('N','Y')"),
+    ("trip_duration", "INT", "MEDIUMINT UNSIGNED"),
+    ("trip_distance_km", "DOUBLE", "FLOAT"),
+    ("trip_duration_min", "DOUBLE", "FLOAT"),
+    ("speed_kmh", "DOUBLE", "DOUBLE"),
+    ("fare_per_km", "DOUBLE", "FLOAT"),
+    ("pickup_cell", "INT", "INT"),
+    ("dropoff_cell", "INT", "INT"),
+    ("created_at", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"),
+]
+
+# Decimals the compact layout's FLOAT measures are read back with: a FLOAT
+# holds about 7 significant digits, and reading it as DOUBLE would widen 2.53
+# to 2.5299999713897705
+FLOAT_READ_DECIMALS = {
+    "trip_distance_km": 3,   # metres
+    "trip_duration_min": 3,
+    "fare_per_km": 3,
+}
+
+# Stored generated columns of the compact layout
+GENERATED_COLUMNS = {
+    "pickup_hour": "TINYINT UNSIGNED AS (HOUR(pickup_datetime)) STORED",
+    "pickup_date": "DATE AS (DATE(pickup_datetime)) STORED",
+    # Monday = 0, like the rollup's day_of_week
+    "pickup_weekday": "TINYINT UNSIGNED AS (WEEKDAY(pickup_datetime)) STORED",
+}
+
+# Secondary indexes of both layouts (see models/schema.sql)
+SECONDARY_INDEXES = {
+    # Time ranges, and keyset pages ordered by (pickup_datetime, id)
+    "idx_pickup_datetime": "(pickup_datetime)",
+    # Covers COUNT(*) for any mix of the time, speed and passenger filters
+    "idx_pickup_speed_passengers": "(pickup_datetime, speed_kmh, passenger_count)",
+    # passenger_count = x with a time range, already in pickup_datetime order
+    "idx_passenger_pickup": "(passenger_count, pickup_datetime)",
+    "idx_dropoff_datetime": "(dropoff_datetime)",
+    "idx_speed_kmh": "(speed_kmh)",
+    "idx_pickup_cell": "(pickup_cell, pickup_latitude, pickup_longitude)",
+    "idx_dropoff_cell": "(dropoff_cell, dropoff_latitude, dropoff_longitude)",
+}
+
+# Indexes on the generated columns (compact layout only)
+TIME_INDEXES = {
+    # Counts by hour, or by weekday and hour, are index-only scans
+    "idx_pickup_weekday_hour": "(pickup_weekday, pickup_hour)",
+    "idx_pickup_hour": "(pickup_hour)",
+    "idx_pickup_date": "(pickup_date)",
+}
+
+# Values the compact types can't hold: name -> condition matching such rows
+COMPACT_VALUE_CHECKS = {
+    "vendor_id longer than 1 character": "CHAR_LENGTH(vendor_id) > 1",
+    "store_and_fwd_flag other than N/Y": "store_and_fwd_flag NOT IN ('N', 'Y')",
+    "passenger_count outside 0..255": "passenger_count NOT BETWEEN 0 AND 255",
+    "trip_duration outside 0..16777215": "trip_duration NOT BETWEEN 0 AND 16777215",
+    "latitude outside -99.999999..99.999999":
+        "ABS(pickup_latitude) >= 100 OR ABS(dropoff_latitude) >= 100",
+    "longitude outside -999.999999..999.999999":
+        "ABS(pickup_longitude) >= 1000 OR ABS(dropoff_longitude) >= 1000",
+}
+
+
+def _compact(schema):
+    if schema not in SCHEMAS:
+        raise ValueError(f"TRIPS_SCHEMA must be one of {', '.join(SCHEMAS)}")
+    return schema == "compact"
+
+
+def table_indexes(schema=TRIPS_SCHEMA):
+    """Secondary indexes of a layout"""
+    return {**SECONDARY_INDEXES, **(TIME_INDEXES if _compact(schema) else {})}
+
+
+def create_table_query(schema=TRIPS_SCHEMA, table="trips", partitions=None):
+    """CREATE TABLE for trips in a layout, keyed on (KEY_COLUMN, pickup_datetime)"""
+    compact = _compact(schema)
+    columns = [f"{name} {compact_type if compact else standard_type}"
+               for name, standard_type, compact_type in TRIP_COLUMN_TYPES]
+    if KEY_COLUMN == "trip_key":
+        columns.insert(0, "trip_key BIGINT NOT NULL")
+    if compact:
+        columns += [f"{name} {definition}" for name, definition in GENERATED_COLUMNS.items()]
+    # Partitioning needs pickup_datetime in every unique key, so KEY_COLUMN
+    # alone is not enforced unique (the loaders keep one row per trip)
+    columns.append(f"PRIMARY KEY ({KEY_COLUMN}, pickup_datetime)")
+    columns += [f"INDEX {name} {index}" for name, index in table_indexes(schema).items()]
+    return (f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(columns) + "\n)\n"
+            + (partitions if partitions is not None else partition_clause()))
+
+
+def select_columns(columns, schema=TRIPS_SCHEMA):
+    """
+    SELECT expressions for trips columns. DECIMAL coordinates are read back
+    as DOUBLE and FLOAT measures rounded to FLOAT_READ_DECIMALS, so both
+    layouts return plain floats with the digits that were stored.
+    """
+    if not _compact(schema):
+        return ", ".join(columns)
+    return ", ".join(_compact_select(col) for col in columns)
+
+
+def _compact_select(col):
+    if col.endswith(("_latitude", "_longitude")):
+        return f"CAST({col} AS DOUBLE) AS {col}"
+    if col in FLOAT_READ_DECIMALS:
+        return f"ROUND({col}, {FLOAT_READ_DECIMALS[col]}) AS {col}"
+    return col
+
+
+def time_expressions(schema=TRIPS_SCHEMA):
+    """SQL for the pickup hour, date and weekday: the generated columns when the layout has them"""
+    if _compact(schema):
+        return {"hour": "pickup_hour", "date": "pickup_date", "weekday": "pickup_weekday"}
+    return {"hour": "HOUR(pickup_datetime)", "date": "DATE(pickup_datetime)",
+            "weekday": "WEEKDAY(pickup_datetime)"}
+
+
+# The current layout's expressions
+PICKUP_HOUR, PICKUP_DATE, PICKUP_WEEKDAY = time_expressions().values()
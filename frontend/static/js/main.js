@@ -1,16 +1,28 @@
 const BACKEND_URL = 'http://127.0.0.1:5000/api'; 
 
+// Stats, hourly pattern and passenger distribution come from one request;
+// the backend runs the three queries concurrently
+let dashboardRequest = null;
+function fetchDashboard() {
+    if (!dashboardRequest) {
+        dashboardRequest = fetch(`${BACKEND_URL}/insights/dashboard`).then(response => {
+            if (!response.ok) {
+                dashboardRequest = null;
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            return response.json();
+        });
+    }
+    return dashboardRequest;
+}
+
 // 1. Function to fetch and display analytical insights
 async function fetchInsights() {
     const container = document.getElementById('insights-container');
     container.innerHTML = 'Fetching insights...'; 
 
     try {
-        const response = await fetch(`${BACKEND_URL}/insights/stats`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const insights = await response.json(); 
+        const insights = (await fetchDashboard()).stats;
 
         // Display the insights returned from /api/insights/stats
         container.innerHTML = `
@@ -45,7 +57,7 @@ async function fetchTripData(minSpeed = 0, maxSpeed = null) {
     tableBody.innerHTML = '<tr><td colspan="5">Loading...</td></tr>';
 
     try {
-        let url = `${BACKEND_URL}/trips/?limit=20&min_speed=${minSpeed}`;
+        let url = `${BACKEND_URL}/trips/?limit=20&count=none&min_speed=${minSpeed}`;
         if (maxSpeed) {
             url += `&max_speed=${maxSpeed}`;
         }
@@ -104,9 +116,7 @@ async function fetchHourlyPattern() {
     const chartElem = document.getElementById('hourlyChart');
     if (!chartElem) return;
     try {
-        const response = await fetch(`${BACKEND_URL}/insights/hourly-pattern`);
-        if (!response.ok) throw new Error('Failed to fetch hourly pattern');
-        const data = await response.json();
+        const data = (await fetchDashboard()).hourly_pattern;
         
         // Find peak hours
         const maxCount = Math.max(...data.counts);
@@ -154,9 +164,7 @@ async function fetchPassengerDistribution() {
     const chartElem = document.getElementById('passengerChart');
     if (!chartElem) return;
     try {
-        const response = await fetch(`${BACKEND_URL}/insights/passenger-distribution`);
-        if (!response.ok) throw new Error('Failed to fetch passenger distribution');
-        const data = await response.json();
+        const data = (await fetchDashboard()).passenger_distribution;
         
         // Calculate total and percentages
         const total = data.counts.reduce((sum, count) => sum + count, 0);